@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Registry of the bank statement scorecard attributes (df_ACCT_MAST_STG2 of test.py).
+#     * Every attribute is declared as an expression over the window columns of the account summary (e.g. TTL_INFLOW_AMT_M1),
+#       built with SUM / MAX / MIN / MEAN / STD over windows and ADD / DIV / PCT / CONST / DAYS_SINCE / PER_DAY.
+#     * COMPILE_ATTRIBUTES turns the requested attributes into a DAG of distinct nodes, in evaluation order:
+#       a node shared by several attributes (e.g. the 3-window inflow sum) is computed once, and a sum over M1-Mn
+#       is the sum over M1-Mn-1 plus Mn, so the 6-window sums reuse the 3-window ones.
+#     * SCORE_ATTRIBUTES only builds the summary stages (and only the features of them) the requested attributes read,
+#       so a small scorecard skips most of the base aggregation.
+
+import pandas as pd
+
+from bs_cpty import BUILD_CPTY_SMRY, CPTY_SMRY_LAYOUT
+from bs_daily import MONTHLY_BAL_SMRY_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT, MAX_SEQ_LAYOUT
+from bs_daymat import BUILD_DAY_MATRIX, DAY_MATRIX_SMRY
+from bs_pipeline import ACCT_KEY_COLS
+from bs_tran_smry import BUILD_MONTHLY_TRAN_SMRY, TRAN_SMRY_LAYOUT
+
+
+#Function Name: WINDOWS_OF
+#Function Description: This function returns a window list as a tuple; an integer n stands for the windows M1 to Mn
+def WINDOWS_OF(windows):
+    return tuple(range(1, windows + 1)) if isinstance(windows, int) else tuple(windows)
+
+
+#Expression builders of the registry; every node is a hashable tuple, so equal sub-expressions are the same node
+#Function Name: COL / WIN / CONST
+#Function Description: These functions return a base column, the column of a feature for window m (1 = M1), and a constant
+def COL(name):
+    return ('COL', name)
+
+
+def WIN(prefix, m):
+    return COL(prefix + '_M' + str(m))
+
+
+def CONST(value):
+    return ('CONST', value)
+
+
+#Function Name: ADD / DIV / PCT
+#Function Description: These functions return a + b, a / b and (a / b) * 100
+def ADD(a, b):
+    return ('ADD', a, b)
+
+
+def DIV(a, b):
+    return ('DIV', a, b)
+
+
+def PCT(a, b):
+    return ('PCT', a, b)
+
+
+#Function Name: SUM
+#Function Description: This function returns the sum of a feature over windows, added up from the first window on (M1 + M2 + M3 ...)
+#                      The sum over all but the last window is a node of its own, so sums over M1-M3 and M1-M6 share their first terms
+def SUM(prefix, windows):
+    windows = WINDOWS_OF(windows)
+    if len(windows) == 1:
+        return WIN(prefix, windows[0])
+    return ADD(SUM(prefix, windows[:-1]), WIN(prefix, windows[-1]))
+
+
+#Function Name: MAX / MIN / MEAN / STD
+#Function Description: These functions return the row-wise maximum, minimum, mean and standard deviation of a feature over windows (NaN skipped, as DataFrame.max(axis=1))
+def MAX(prefix, windows):
+    return ('MAX',) + tuple(WIN(prefix, m) for m in WINDOWS_OF(windows))
+
+
+def MIN(prefix, windows):
+    return ('MIN',) + tuple(WIN(prefix, m) for m in WINDOWS_OF(windows))
+
+
+def MEAN(prefix, windows):
+    return ('MEAN',) + tuple(WIN(prefix, m) for m in WINDOWS_OF(windows))
+
+
+def STD(prefix, windows):
+    return ('STD',) + tuple(WIN(prefix, m) for m in WINDOWS_OF(windows))
+
+
+#Function Name: DAYS_SINCE / PER_DAY
+#Function Description: These functions return the days from a date to the end of M1, and a value divided by the number of days of M1
+def DAYS_SINCE(a):
+    return ('DAYS_SINCE', a)
+
+
+def PER_DAY(a):
+    return ('PER_DAY', a)
+
+
+#The scorecard attributes, in the column order of df_ACCT_MAST_STG2
+SCORECARD_ATTRS = {
+    'Last 3m # of Seemingly Recurrent Inflow Sources': SUM('RECUR_INFLOW_TRAN_CNT', 3),
+    'Last 3m # of Seemingly Recurrent Outflow Destinations': SUM('RECUR_OUTFLOW_TRAN_CNT', 3),
+    'Last 3m % Of Seemingly Recurrent Inflow Transactions Amount': PCT(SUM('RECUR_INFLOW_TRAN_AMT', 3), SUM('TTL_INFLOW_AMT', 3)),
+    'Last 3m % Of Seemingly Recurrent Outflow Transactions Amount': PCT(SUM('RECUR_OUTFLOW_TRAN_AMT', 3), SUM('TTL_OUTFLOW_AMT', 3)),
+    'Last 3m Average % Of Inflow Transactions from Top 3 Clients': MEAN('TOP_CPTY_INFLOW_SHR', 3),
+    'Last 3m Average % Of Outflow Transactions to Top 3 Expense Destinations': MEAN('TOP_CPTY_OUTFLOW_SHR', 3),
+    'Last 3m Avg Revenue as % of Prev 3m Avg Revenue': PCT(SUM('TTL_REV_AMT', 3), SUM('TTL_REV_AMT', [4, 5, 6])),
+    'Last 3m Max # Days Without Outflow Transactions': MAX('DAYS_WO_OUTFLOW_TRAN_CNT', 3),
+    'Last 3m Max Extra Large (Upper Outlier > 2.5*stddev) Inflow Count': MAX('OUTLIER_INFLOW_TRAN_CNT', 3),
+    'Last 3m Max Extra Large (Upper Outlier > 2.5*stddev) Outflow Count': MAX('OUTLIER_OUTFLOW_TRAN_CNT', 3),
+    'Last 3m Max Negative Balances Days Count': MAX('NEG_BAL_DAYS', 3),
+    'Last 3m Max Sequence Of Days Without Outflow Transactions': MAX('MAX_SEQ_DAYS_WO_OUTFLOW', 3),
+    'Last 3m Revenue Volatility as % of Prev 3m Revenue Volatility': PCT(STD('TTL_REV_AMT', 3), STD('TTL_REV_AMT', [4, 5, 6])),
+    'Last 3m Total Inflow Count': SUM('TTL_INFLOW_CNT', 3),
+    'Last 3m Total Inflow Sum': SUM('TTL_INFLOW_AMT', 3),
+    'Last 3m Total Negative Balances Days Count': SUM('NEG_BAL_DAYS', 3),
+    'Last 3m Total Outflow Count': SUM('TTL_OUTFLOW_CNT', 3),
+    'Last 3m Total Outflow Sum': SUM('TTL_OUTFLOW_AMT', 3),
+    'Last 6m Lowest Minimum Balance': MIN('MIN_BAL_AMT', 6),
+    'Last 6m Lowest Minimum Balance as % of Total Outflow Amount': DIV(MIN('MIN_BAL_AMT', 6), SUM('TTL_OUTFLOW_AMT', 6)),
+    'Last 6m Max # Days Without Inflow Transactions': MAX('DAYS_WO_INFLOW_TRAN_CNT', 6),
+    'Last 6m Max Sequence Of Days Without Inflow Transactions': MAX('MAX_SEQ_DAYS_WO_INFLOW', 6),
+    'Last month # of Days Since Last Inflow Transaction': DAYS_SINCE(COL('LAST_TRAN_DT')),
+    'Last month Average Daily # Transactions': PER_DAY(WIN('TTL_TRAN_CNT', 1)),
+    'Last month Average Daily Balance': PER_DAY(WIN('TTL_DAILY_BAL_AMT', 1)),
+    'Last month Average Inflow': DIV(WIN('TTL_INFLOW_AMT', 1), WIN('TTL_INFLOW_CNT', 1)),
+    'Last month Average Outflow': DIV(WIN('TTL_OUTFLOW_AMT', 1), WIN('TTL_OUTFLOW_CNT', 1)),
+    'Last month Average Transaction Amount': DIV(ADD(WIN('TTL_OUTFLOW_AMT', 1), WIN('TTL_INFLOW_AMT', 1)), ADD(WIN('TTL_OUTFLOW_CNT', 1), WIN('TTL_INFLOW_CNT', 1))),
+    'Last month Avg Daily Balance Volatility as % of Last 3m Avg Daily Balance Volatility': PCT(WIN('DAILY_BAL_STD', 1), DIV(SUM('DAILY_BAL_STD', 3), CONST(3))),
+    'Last month Avg Inflow Amount as % of Last 6m Avg Inflow Amount': PCT(DIV(WIN('TTL_INFLOW_AMT', 1), WIN('TTL_INFLOW_CNT', 1)), DIV(SUM('TTL_INFLOW_AMT', 6), SUM('TTL_INFLOW_CNT', 6))),
+    'Last month Max Inflow': WIN('MAX_INFLOW_TRAN_AMT', 1),
+    'Last month Max Outflow': WIN('MAX_OUTFLOW_TRAN_AMT', 1),
+}
+
+#Summary stages the base columns come from, with their layouts
+ATTR_STAGES = {
+    'TRAN': TRAN_SMRY_LAYOUT,
+    'BAL': MONTHLY_BAL_SMRY_LAYOUT,
+    'MAX_SEQ': MAX_SEQ_LAYOUT,
+    'DAYS_WO': DAYS_WO_TRAN_SMRY_LAYOUT,
+    'CPTY': CPTY_SMRY_LAYOUT,
+}
+
+
+#Function Name: COMPILE_ATTRIBUTES
+#Function Description: This function returns the distinct nodes the attributes need, children before parents, and the base columns they read
+def COMPILE_ATTRIBUTES(names=None, registry=SCORECARD_ATTRS):
+    names = list(registry) if names is None else names
+    plan = []
+    seen = set()
+
+    def visit(node):
+        if node in seen:
+            return
+        seen.add(node)
+        if node[0] not in ('COL', 'CONST'):
+            for child in node[1:]:
+                visit(child)
+        plan.append(node)
+
+    for name in names:
+        visit(registry[name])
+    base_cols = [node[1] for node in plan if node[0] == 'COL']
+    return plan, base_cols
+
+
+#Function Name: BASE_LAYOUTS
+#Function Description: This function returns, per summary stage, the part of its layout holding the base columns (stages not needed are left out)
+def BASE_LAYOUTS(base_cols):
+    layouts = {}
+    for stage, layout in ATTR_STAGES.items():
+        prefixes = {name for name, measure, months in layout
+                    if any(col == name or col.rsplit('_M', 1)[0] == name for col in base_cols)}
+        if prefixes:
+            layouts[stage] = [entry for entry in layout if entry[0] in prefixes]
+    return layouts
+
+
+#Function Name: EVAL_ATTRIBUTES
+#Function Description: This function evaluates the attributes on an account summary holding their base columns (e.g. df_ACCT_MAST_STG1)
+#                      Every node of the DAG is computed once, as a vectorized column operation; returns the attributes as a frame on df's index
+def EVAL_ATTRIBUTES(df, df_WINDOWS, names=None, registry=SCORECARD_ATTRS):
+    names = list(registry) if names is None else names
+    plan, base_cols = COMPILE_ATTRIBUTES(names, registry)
+    values = {}
+    for node in plan:
+        op, args = node[0], node[1:]
+        if op == 'COL':
+            values[node] = df[args[0]]
+        elif op == 'CONST':
+            values[node] = args[0]
+        elif op == 'ADD':
+            values[node] = values[args[0]] + values[args[1]]
+        elif op == 'DIV':
+            values[node] = values[args[0]] / values[args[1]]
+        elif op == 'PCT':
+            values[node] = (values[args[0]] / values[args[1]]) * 100
+        elif op in ('MAX', 'MIN', 'MEAN', 'STD'):
+            cols = pd.concat([values[a] for a in args], axis=1)
+            values[node] = getattr(cols, op.lower())(axis=1)
+        elif op == 'DAYS_SINCE':
+            values[node] = (df_WINDOWS.loc['M1', 'END_DT'] - values[args[0]]).dt.days
+        elif op == 'PER_DAY':
+            values[node] = values[args[0]] / df_WINDOWS.loc['M1', 'DAYS']
+        else:
+            raise ValueError('unknown attribute operation ' + repr(op))
+    return pd.DataFrame({name: values[registry[name]] for name in names}, index=df.index)
+
+
+#Function Name: SCORE_ATTRIBUTES
+#Function Description: This function computes the requested scorecard attributes straight from the raw tables, building only the summary features they read
+#                      Returns one row per account (sorted by the account keys, as df_ACCT_MAST_STG1) with the account keys and the attributes
+def SCORE_ATTRIBUTES(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, names=None, registry=SCORECARD_ATTRS):
+    names = list(registry) if names is None else names
+    plan, base_cols = COMPILE_ATTRIBUTES(names, registry)
+    layouts = BASE_LAYOUTS(base_cols)
+
+    df = df_tran[ACCT_KEY_COLS].drop_duplicates().sort_values(ACCT_KEY_COLS)
+    smry = []
+    if 'TRAN' in layouts:
+        smry.append(BUILD_MONTHLY_TRAN_SMRY(df_tran, df_WINDOWS, inflow_threshold, outflow_threshold, layout=layouts['TRAN']))
+    if layouts.keys() & {'BAL', 'MAX_SEQ', 'DAYS_WO'}:
+        DAY_MATRIX = BUILD_DAY_MATRIX(df_bal, df_tran, df_WINDOWS)
+        for stage in ['BAL', 'MAX_SEQ', 'DAYS_WO']:
+            if stage in layouts:
+                smry.append(DAY_MATRIX_SMRY(DAY_MATRIX, df_WINDOWS, layouts[stage]))
+    if 'CPTY' in layouts:
+        smry.append(BUILD_CPTY_SMRY(df_tran, df_WINDOWS, layout=layouts['CPTY']))
+
+    base = df
+    for s in smry:
+        base = base.join(s, on='ACCT_ID')
+    return pd.concat([df, EVAL_ATTRIBUTES(base, df_WINDOWS, names, registry)], axis=1)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Backtest of the bank statement scorecard: the attributes of every account at many as-of dates (e.g. every month end of a long history) in one pass.
+#     * The raw tables are reduced once for all the as-of dates:
+#         * the transactions become one row per account and day (day buckets), in account and day order, with the running
+#           per-account sums of every additive measure (prefix sums) and the running latest inflow day
+#         * the day-end balances and transaction flags become one account x day store (bs_daymat) spanning the windows of all the as-of dates,
+#           with running sums along the days of the balances, the negative balance days and the days without inflow / outflow
+#     * The buckets of an account in a window are one contiguous slice, found with searchsorted: a window sum or count is the difference
+#       of two prefix sums (its cost does not depend on the length of the window), a window maximum a reduceat over the slice.
+#     * The counterparty amounts are day buckets of every (account, counterparty) pair with running sums too: the pair sums of a window are
+#       prefix sum differences, and the top-k pairs of every account are picked by one lexsort over the pairs (the amounts without
+#       a counterparty are a pair of their own, in the total but not ranked).
+#     * The minima, standard deviations and streaks are reduced over the window's column slice of the store, as they are not differences of running values.
+#     * The windows of all the as-of dates are deduplicated: a window shared by several as-of dates (calendar months) is reduced once.
+#     * Each as-of date only sees the data up to the end of its M1: the accounts are those with a transaction by then, and an account without
+#       a balance record by then has no day-level features, as a rerun on the data cut at that date gives. The outlier thresholds and the
+#       recurrent flags are inputs, taken over the whole history as a rerun on the whole files does.
+#     * The sums of float amounts are the prefix sum differences, so they match a rerun to the rounding of the running sums;
+#       counts and the sums of int64 minor units are exact.
+#     * Only the features the requested attributes read are built (bs_attrs.BASE_LAYOUTS); the result is a long table of
+#       ACCT_ID, AS_OF_DT, ATTRIBUTE, VALUE.
+#
+# Usage: python bs_backtest.py <statement folder> -o <output.csv> [--as-of MM/DD/YYYY ...] [--from MM/DD/YYYY] [--to MM/DD/YYYY] [--windows N] [--window-rule days|month] [--recurrent auto|feed|detect] [--amounts float32|float64|minor]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from bs_attrs import SCORECARD_ATTRS, COMPILE_ATTRIBUTES, BASE_LAYOUTS, EVAL_ATTRIBUTES
+from bs_cpty import CPTY_COL, CPTY_TOP_K, CPTY_AMOUNT_COLS
+from bs_daymat import BUILD_DAY_MATRIX, DAY_MATRIX_MEASURE
+from bs_ingest import READ_BS_TRAN, READ_BS_ACCT_BAL, BS_TRAN_SCHEMA, BS_TRAN_FILE, BS_ACCT_BAL_FILE, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES, AMOUNT_SCHEMA
+from bs_pipeline import OUTLIER_THRESHOLDS
+from bs_recur import SET_RECURRENT_FLAGS
+from bs_tran_smry import TRAN_SMRY_MEASURES, TRAN_SMRY_AGG, TRAN_SMRY_MAJOR_UNITS
+from bs_window import ALL_WINDOWS, BUILD_WINDOWS
+from bs_write import WRITE_FRAME
+
+BACKTEST_COLS = ['ACCT_ID', 'AS_OF_DT', 'ATTRIBUTE', 'VALUE']
+#Additive measures of the transaction summary, taken as prefix sum differences
+TRAN_SUM_MEASURES = [m for m, agg in TRAN_SMRY_AGG.items() if agg == 'sum']
+#Day of an account without any inflow yet, in the running latest inflow day
+NO_DAY = np.iinfo('int64').min
+
+
+#Function Name: MONTH_ENDS
+#Function Description: This function returns the month ends from start_dt to end_dt (both inclusive), the usual as-of dates of a backtest
+def MONTH_ENDS(start_dt, end_dt):
+    return list(pd.date_range(pd.to_datetime(start_dt).normalize(), pd.to_datetime(end_dt).normalize(), freq='ME'))
+
+
+#Function Name: DAY_NUMBERS
+#Function Description: This function returns dates as int64 day numbers (days since 1970-01-01); NaT gives NO_DAY
+def DAY_NUMBERS(dates):
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    return np.where(np.isnat(dates), NO_DAY, dates.astype('int64'))
+
+
+#Function Name: BUCKET_INDEX
+#Function Description: This function returns the lookup of day buckets held in group and day order, from the group code (0 to n_groups - 1) and day number of every bucket
+#                      A bucket's key is its group code, then its day, so the keys are sorted as the buckets are held
+def BUCKET_INDEX(code, day, n_groups):
+    day0 = day.min() if len(day) else 0
+    stride = (day.max() - day0 + 3) if len(day) else 3
+    return {'N_GROUPS': n_groups, 'CODE': code, 'DAY0': day0, 'STRIDE': stride, 'KEY': code * stride + (day - day0 + 1)}
+
+
+#Function Name: BUCKET_SLICES
+#Function Description: This function returns, for every group, the slice [start, end) of its buckets whose day is within first:last (day numbers, inclusive)
+def BUCKET_SLICES(index, first, last):
+    base = np.arange(index['N_GROUPS']) * index['STRIDE']
+    first = np.clip(first - index['DAY0'] + 1, 0, index['STRIDE'] - 1)
+    last = np.clip(last - index['DAY0'] + 1, 0, index['STRIDE'] - 1)
+    return np.searchsorted(index['KEY'], base + first, side='left'), np.searchsorted(index['KEY'], base + last, side='right')
+
+
+#Function Name: SLICE_SUM
+#Function Description: This function returns the sum over every group's slice of buckets, as the difference of the group's running sums at its two ends (0 for an empty slice)
+def SLICE_SUM(index, running, start, end):
+    if not len(running):
+        return np.zeros(len(start), dtype=running.dtype)
+    groups = np.arange(len(start))
+
+    #The group's running sum before position pos, 0 when the bucket before it is another group's
+    def before(pos):
+        prev = (pos - 1).clip(0)
+        return np.where((pos > 0) & (index['CODE'][prev] == groups), running[prev], 0)
+
+    return before(end) - before(start)
+
+
+#Function Name: BUILD_TRAN_PREFIX
+#Function Description: This function reduces the transactions to day buckets (one row per account and day, in account and day order)
+#                      with the running per-account sums of the additive measures and the running latest inflow day
+#                      Float amounts are summed in float64 and the window sums given back in the measure's dtype
+def BUILD_TRAN_PREFIX(df_tran, inflow_threshold, outflow_threshold):
+    measures = TRAN_SMRY_MEASURES(df_tran, inflow_threshold, outflow_threshold)
+    dtypes = measures.dtypes
+    for m in TRAN_SUM_MEASURES:
+        if dtypes[m].kind == 'f':
+            measures[m] = measures[m].astype('float64')
+    measures['TRAN_DT'] = df_tran['TRAN_DT']
+    buckets = measures.groupby(['ACCT_ID', 'TRAN_DT'], sort=True).agg(TRAN_SMRY_AGG).reset_index()
+
+    accounts = np.unique(buckets['ACCT_ID'].to_numpy(dtype='int64'))
+    code = np.searchsorted(accounts, buckets['ACCT_ID'].to_numpy(dtype='int64'))
+    by_acct = buckets.groupby(code, sort=False)
+    return {
+        'ACCT_ID': accounts, 'INDEX': BUCKET_INDEX(code, DAY_NUMBERS(buckets['TRAN_DT']), len(accounts)),
+        'FIRST_DAY': DAY_NUMBERS(by_acct['TRAN_DT'].min()),
+        'RUNNING': {m: by_acct[m].cumsum().to_numpy() for m in TRAN_SUM_MEASURES},
+        'MAX': {m: buckets[m].to_numpy() for m in ['INFLOW_MAX', 'OUTFLOW_MAX']},
+        'LAST_INFLOW': pd.Series(DAY_NUMBERS(buckets['LAST_INFLOW_DT'])).groupby(code, sort=False).cummax().to_numpy(),
+        'DTYPES': dtypes,
+    }
+
+
+#Function Name: TRAN_WINDOW_MEASURE
+#Function Description: This function returns one transaction measure over the days first:last for every account of the buckets
+#                      Sums are SLICE_SUM differences, maxima a reduceat over the account's slice (NaN when empty);
+#                      LAST_INFLOW_DT is the running latest inflow day at the end of the slice, when it falls within the days
+#                      slices = BUCKET_SLICES of the buckets for first:last, when already found for another measure
+def TRAN_WINDOW_MEASURE(tran, measure, first, last, slices=None):
+    start, end = slices or BUCKET_SLICES(tran['INDEX'], first, last)
+    hit = end > start
+    dtype = tran['DTYPES'][measure]
+    if measure in tran['RUNNING']:
+        return SLICE_SUM(tran['INDEX'], tran['RUNNING'][measure], start, end).astype(dtype)
+    if measure == 'LAST_INFLOW_DT':
+        day = np.where(hit, tran['LAST_INFLOW'][(end - 1).clip(0)], NO_DAY) if hit.any() else np.full(len(start), NO_DAY)
+        return np.where(day >= first, day, NO_DAY).astype('datetime64[D]').astype('datetime64[ns]')
+    values = tran['MAX'][measure]
+    result = np.full(len(start), np.nan, dtype=np.result_type(dtype, 'float32'))
+    if hit.any():
+        #start / end of the non-empty slices interleaved; reduceat then reduces every slice at the even positions
+        bounds = np.column_stack([start[hit], end[hit]]).ravel()
+        result[hit] = np.fmax.reduceat(np.append(values, values[:1]), bounds)[::2]
+    return result
+
+
+#Function Name: BUILD_CPTY_PREFIX
+#Function Description: This function reduces the positive inflow / outflow amounts to day buckets of every (account, counterparty) pair,
+#                      in pair and day order, with their running per-pair sums; accounts = the sorted account ids the pairs are mapped to
+#                      The amounts without a counterparty are one more pair of their account (HAS_CPTY False): counted in its total, never ranked
+#                      Returns None for a feed without a COUNTERPARTY column
+def BUILD_CPTY_PREFIX(df_tran, accounts):
+    if CPTY_COL not in df_tran:
+        return None
+    rows = pd.DataFrame({'ACCT_ID': df_tran['ACCT_ID'].to_numpy(dtype='int64'), CPTY_COL: pd.factorize(df_tran[CPTY_COL])[0],
+                         'TRAN_DT': df_tran['TRAN_DT'].to_numpy()})
+    for name, col in CPTY_AMOUNT_COLS.items():
+        amount = df_tran[col].to_numpy(dtype='float64')
+        rows[name] = np.where(amount > 0, amount, 0.0)
+    rows = rows[(rows[list(CPTY_AMOUNT_COLS)] > 0).any(axis=1).to_numpy()]
+    buckets = rows.groupby(['ACCT_ID', CPTY_COL, 'TRAN_DT'], sort=True).sum().reset_index()
+
+    pair_keys = buckets[['ACCT_ID', CPTY_COL]].to_numpy()
+    new_pair = np.r_[True, (pair_keys[1:] != pair_keys[:-1]).any(axis=1)] if len(buckets) else np.zeros(0, dtype=bool)
+    code = np.cumsum(new_pair) - 1
+    by_pair = buckets.groupby(code, sort=False)
+    return {
+        'INDEX': BUCKET_INDEX(code, DAY_NUMBERS(buckets['TRAN_DT']), int(new_pair.sum())),
+        'PAIR_ACCT': np.searchsorted(accounts, buckets['ACCT_ID'].to_numpy()[new_pair]),
+        'HAS_CPTY': buckets[CPTY_COL].to_numpy()[new_pair] >= 0,
+        'RUNNING': {name: by_pair[name].cumsum().to_numpy() for name in CPTY_AMOUNT_COLS},
+    }
+
+
+#Function Name: CPTY_WINDOW_SHARE
+#Function Description: This function returns, for every account, the % of its inflow / outflow amount (measure = INFLOW_SHR / OUTFLOW_SHR) in the days first:last
+#                      taken by its top k counterparties (NaN without any such amount), from the pair sums of the window
+#                      The total holds the amounts without a counterparty too; the counterparty pairs are ranked within their account by one lexsort,
+#                      so the cost is that of the pairs, not of the transactions
+def CPTY_WINDOW_SHARE(cpty, measure, first, last, n_accounts, k=CPTY_TOP_K, slices=None):
+    if cpty is None:
+        return np.full(n_accounts, np.nan)
+    start, end = slices or BUCKET_SLICES(cpty['INDEX'], first, last)
+    amount = SLICE_SUM(cpty['INDEX'], cpty['RUNNING'][measure], start, end)
+    total = np.bincount(cpty['PAIR_ACCT'], weights=amount, minlength=n_accounts)
+    ranked = np.flatnonzero(cpty['HAS_CPTY'])
+    order = ranked[np.lexsort((-amount[ranked], cpty['PAIR_ACCT'][ranked]))]
+    acct = cpty['PAIR_ACCT'][order]
+    top = (np.arange(len(order)) - np.searchsorted(acct, acct, side='left')) < k
+    top_sum = np.bincount(acct[top], weights=amount[order][top], minlength=n_accounts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, top_sum / total * 100, np.nan)
+
+
+#Function Name: BUILD_DAY_PREFIX
+#Function Description: This function returns the running sums along the days of the additive day-level measures of the store, with a leading 0 column,
+#                      so the sum over the day columns first:last is prefix[:, last + 1] - prefix[:, first]
+def BUILD_DAY_PREFIX(store):
+    n_accounts, n_days = store['ACCT_BAL'].shape
+    in_calendar = np.arange(n_days) >= np.asarray(store['FIRST_DAY'])[:, None]
+    bal = np.asarray(store['ACCT_BAL'])
+    values = {
+        'BAL_SUM': np.nan_to_num(bal, nan=0.0),
+        'NEG_BAL_CNT': bal <= 0,
+        'WO_INFLOW_CNT': in_calendar & (np.asarray(store['DAILY_INFLOW_FLG']) == 0),
+        'WO_OUTFLOW_CNT': in_calendar & (np.asarray(store['DAILY_OUTFLOW_FLG']) == 0),
+    }
+    prefix = {}
+    for measure, value in values.items():
+        dtype = 'float64' if measure == 'BAL_SUM' else 'int64'
+        prefix[measure] = np.zeros((n_accounts, n_days + 1), dtype=dtype)
+        np.cumsum(value, axis=1, dtype=dtype, out=prefix[measure][:, 1:])
+    return prefix
+
+
+#Function Name: DAY_WINDOW_MEASURE
+#Function Description: This function returns one day-level measure over the day columns first:last of the store, one value per account of the store
+def DAY_WINDOW_MEASURE(store, prefix, measure, first, last):
+    if measure in prefix:
+        return prefix[measure][:, last + 1] - prefix[measure][:, first]
+    return DAY_MATRIX_MEASURE(store, measure, first, last)
+
+
+#Function Name: BACKTEST_ATTRIBUTES
+#Function Description: This function computes the scorecard attributes of every account at every as-of date in one pass over the raw tables
+#                      The windows of an as-of date are BUILD_WINDOWS(as_of_dt, n_windows, window_days, rule); the thresholds are as in SCORE_ACCOUNTS
+#                      Returns the long table of ACCT_ID, AS_OF_DT (the as-of date), ATTRIBUTE (categorical, in the order of names) and VALUE (float64),
+#                      sorted by as-of date, account and attribute
+def BACKTEST_ATTRIBUTES(df_tran, df_bal, as_of_dates, inflow_threshold, outflow_threshold, n_windows=6, window_days=30, rule='days',
+                        names=None, registry=SCORECARD_ATTRS):
+    names = list(registry) if names is None else names
+    plan, base_cols = COMPILE_ATTRIBUTES(names, registry)
+    layouts = BASE_LAYOUTS(base_cols)
+    windows = {as_of: BUILD_WINDOWS(as_of, n_windows, window_days, rule) for as_of in sorted(set(pd.to_datetime(as_of_dates).normalize()))}
+    empty = pd.DataFrame({c: pd.Series(dtype=t) for c, t in zip(BACKTEST_COLS, ['int64', 'datetime64[ns]', pd.CategoricalDtype(names), 'float64'])})
+    if not windows or not len(df_tran):
+        return empty
+
+    #Day numbers of the first and last day of every window (row m - 1 = Mm) of every as-of date
+    bounds = {as_of: (DAY_NUMBERS(w['START_DT']), DAY_NUMBERS(w['END_DT'])) for as_of, w in windows.items()}
+    tran = BUILD_TRAN_PREFIX(df_tran, inflow_threshold, outflow_threshold)
+    accounts = tran['ACCT_ID']
+    if layouts.keys() & {'BAL', 'MAX_SEQ', 'DAYS_WO'}:
+        span = pd.DataFrame({'START_DT': [min(w['START_DT'].min() for w in windows.values())],
+                             'END_DT': [max(w['END_DT'].max() for w in windows.values())]})
+        store = BUILD_DAY_MATRIX(df_bal, df_tran, span)
+        day_prefix = BUILD_DAY_PREFIX(store)
+        store_start = store['START_DT'].astype('int64')
+        #Row of every account in the store; the balance history of an account starts at its first record (FIRST_DAY, clipped to the span)
+        store_row = np.searchsorted(store['ACCT_ID'], accounts).clip(0, max(len(store['ACCT_ID']) - 1, 0))
+        in_store = (store['ACCT_ID'][store_row] == accounts) if len(store['ACCT_ID']) else np.zeros(len(accounts), dtype=bool)
+        first_record = np.full(len(accounts), np.iinfo('int64').max)
+        first_record[in_store] = store_start + store['FIRST_DAY'][store_row[in_store]]
+    if 'CPTY' in layouts:
+        cpty = BUILD_CPTY_PREFIX(df_tran, accounts)
+
+    #Window features, keyed by (measure, first day, last day): a window shared by several as-of dates is reduced once
+    #The bucket slices of a window are kept under ('SLICES', stage, first day, last day) for all the measures of the stage
+    cache = {}
+
+    def slices(stage, index, first, last):
+        if ('SLICES', stage, first, last) not in cache:
+            cache[('SLICES', stage, first, last)] = BUCKET_SLICES(index, first, last)
+        return cache[('SLICES', stage, first, last)]
+
+    def tran_feature(measure, first, last):
+        if (measure, first, last) not in cache:
+            cache[(measure, first, last)] = TRAN_WINDOW_MEASURE(tran, measure, first, last, slices('TRAN', tran['INDEX'], first, last))
+        return cache[(measure, first, last)]
+
+    def day_feature(measure, first, last):
+        if (measure, first, last) not in cache:
+            values = DAY_WINDOW_MEASURE(store, day_prefix, measure, first - store_start, last - store_start)
+            values = values[store_row] if len(values) else np.full(len(accounts), np.nan)
+            cache[(measure, first, last)] = values if in_store.all() else np.where(in_store, values, np.nan)
+        return cache[(measure, first, last)]
+
+    def cpty_feature(measure, first, last):
+        if (measure, first, last) not in cache:
+            cache[(measure, first, last)] = CPTY_WINDOW_SHARE(cpty, measure, first, last, len(accounts),
+                                                              slices=None if cpty is None else slices('CPTY', cpty['INDEX'], first, last))
+        return cache[(measure, first, last)]
+
+    frames = []
+    for as_of, df_WINDOWS in windows.items():
+        first, last = bounds[as_of]
+        #The accounts with a transaction by the end of M1
+        keep = tran['FIRST_DAY'] <= last[0]
+        index = pd.Index(accounts[keep], name='ACCT_ID')
+        #Accounts without a balance record by the end of M1, which are not in the store of a rerun at this date
+        late = first_record[keep] > last[0] if layouts.keys() & {'BAL', 'MAX_SEQ', 'DAYS_WO'} else None
+        columns = {}
+        for stage, layout in layouts.items():
+            for name, measure, months in layout:
+                if months is None:
+                    columns[name] = tran_feature(measure, first.min(), last.max())[keep]
+                    continue
+                for m in (range(1, n_windows + 1) if months == ALL_WINDOWS else months):
+                    f, l = int(first[m - 1]), int(last[m - 1])
+                    if stage == 'TRAN':
+                        value = tran_feature(measure, f, l)[keep]
+                    elif stage == 'CPTY':
+                        value = cpty_feature(measure, f, l)[keep]
+                    else:
+                        value = day_feature(measure, f, l)[keep]
+                        value = np.where(late, np.nan, value) if late.any() else value
+                    columns[name + '_M' + str(m)] = value
+        base = pd.DataFrame(columns, index=index)
+        if 'TRAN' in layouts and is_integer_dtype(df_tran['INFLOW_TRAN_AMT_HKD']):
+            base = TRAN_SMRY_MAJOR_UNITS(base, layouts['TRAN'])
+        values = EVAL_ATTRIBUTES(base, df_WINDOWS, names, registry).to_numpy(dtype='float64')
+        frames.append(pd.DataFrame({
+            'ACCT_ID': np.repeat(index.to_numpy(), len(names)),
+            'AS_OF_DT': as_of,
+            'ATTRIBUTE': pd.Categorical.from_codes(np.tile(np.arange(len(names)), len(index)), categories=names),
+            'VALUE': values.ravel(),
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else empty
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the bank statement scorecard attributes over many as-of dates in one pass.')
+    parser.add_argument('folder', help='statement folder holding ' + BS_TRAN_FILE + ' and ' + BS_ACCT_BAL_FILE)
+    parser.add_argument('-o', '--output', default='BS_BACKTEST.csv', help='output (ACCT_ID, AS_OF_DT, ATTRIBUTE, VALUE) as .csv, .csv.gz, .npz or .parquet')
+    parser.add_argument('--as-of', nargs='+', default=None, help='as-of dates, MM/DD/YYYY (default: every month end from --from to --to)')
+    parser.add_argument('--from', dest='start', default=None, help='first month end of the backtest, MM/DD/YYYY (default: the first transaction date)')
+    parser.add_argument('--to', dest='end', default=None, help='last month end of the backtest, MM/DD/YYYY (default: the last balance date)')
+    parser.add_argument('--windows', type=int, default=6, help='number of windows (M1 to Mn)')
+    parser.add_argument('--window-rule', choices=['days', 'month'], default='days', help='30-day windows ending on the as-of date, or calendar months')
+    parser.add_argument('--recurrent', choices=['auto', 'feed', 'detect'], default='auto',
+                        help='recurrent transaction flags from the feed, detected from the counterparties, or the feed when it has them')
+    parser.add_argument('--amounts', choices=BS_AMOUNT_TYPES, default='float32', help='type of the transaction amounts (minor = exact int64 cents)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df_tran = READ_BS_TRAN(os.path.join(args.folder, BS_TRAN_FILE), schema=AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, args.amounts))
+    df_tran = SET_RECURRENT_FLAGS(df_tran, args.recurrent)
+    df_bal = READ_BS_ACCT_BAL(os.path.join(args.folder, BS_ACCT_BAL_FILE))
+    if args.as_of:
+        as_of_dates = pd.to_datetime(args.as_of, format='%m/%d/%Y')
+    else:
+        last_dt = df_bal['ACCT_BAL_DT'].max() if len(df_bal) else df_tran['TRAN_DT'].max()
+        start_dt = pd.to_datetime(args.start, format='%m/%d/%Y') if args.start else df_tran['TRAN_DT'].min()
+        end_dt = pd.to_datetime(args.end, format='%m/%d/%Y') if args.end else last_dt
+        as_of_dates = MONTH_ENDS(start_dt, end_dt)
+    inflow_threshold, outflow_threshold = OUTLIER_THRESHOLDS(df_tran)
+    df_BACKTEST = BACKTEST_ATTRIBUTES(df_tran, df_bal, as_of_dates, inflow_threshold, outflow_threshold, args.windows, rule=args.window_rule)
+    WRITE_FRAME(df_BACKTEST, args.output, index=False)
+    print(str(len(df_BACKTEST)) + ' rows for ' + str(len(as_of_dates)) + ' as-of dates written in ' + format(time.perf_counter() - start, '.2f') + ' s',
+          file=sys.stderr)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Batch scoring of many applicant statement folders in one process.
+#     * An applicant is a folder holding the two raw feeds (bs_ingest.BS_TRAN_FILE, bs_ingest.BS_ACCT_BAL_FILE).
+#     * The input is either a directory whose sub-folders are the applicants, or a manifest csv with a FOLDER column
+#       and an optional AS_OF_DT column (MM/DD/YYYY, as --as-of; relative folders are taken from the manifest's own folder).
+#     * The as-of date of an applicant is, in order: its AS_OF_DT in the manifest, --as-of, or its last day-end balance date;
+#       the windows are built from it (bs_window.BUILD_WINDOWS, 6 windows of 30 days unless --windows / --window-rule say otherwise).
+#     * The recurrent transaction flags are taken from the feed or detected (bs_recur.SET_RECURRENT_FLAGS, --recurrent).
+#     * The transaction amounts are float32 unless --amounts says float64 or minor (exact int64 cents, bs_ingest.AMOUNT_SCHEMA).
+#     * With --memo, the feature vectors of the accounts are memoized across runs (bs_memo): only the accounts whose in-window rows changed are recomputed,
+#       and the memo hits / misses of every applicant are reported.
+#     * Applicants are scored by a bounded pool of threads and appended, in input order, to one combined output (bs_write, on a background thread):
+#       df_ACCT_MAST_STG1 of every applicant with the APPLICANT and AS_OF_DT columns in front, as csv, csv.gz, npz or parquet after the output's extension.
+#
+# Usage: python bs_batch.py <folder or manifest.csv> -o <output.csv> [--as-of MM/DD/YYYY] [--windows N] [--window-rule days|month] [--recurrent auto|feed|detect] [--amounts float32|float64|minor] [--jobs N] [--cache-dir DIR] [--memo FILE]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from bs_cache import CACHED_READ
+from bs_ingest import READ_BS_TRAN, READ_BS_ACCT_BAL, BS_TRAN_SCHEMA, BS_ACCT_BAL_SCHEMA, BS_TRAN_FILE, BS_ACCT_BAL_FILE
+from bs_ingest import BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES, AMOUNT_SCHEMA
+from bs_memo import MEMO_SCORE_ACCOUNTS
+from bs_pipeline import OUTLIER_THRESHOLDS, SCORE_ACCOUNTS
+from bs_recur import SET_RECURRENT_FLAGS
+from bs_window import BUILD_WINDOWS
+from bs_write import OPEN_WRITER, WRITE_BATCH, CLOSE_WRITER
+
+
+#Function Name: LIST_APPLICANTS
+#Function Description: This function returns the applicants of a batch input as a table of FOLDER and AS_OF_DT (NaT where the manifest gives none)
+def LIST_APPLICANTS(source):
+    if os.path.isdir(source):
+        folders = sorted(e.path for e in os.scandir(source) if e.is_dir() and os.path.exists(os.path.join(e.path, BS_TRAN_FILE)))
+        return pd.DataFrame({'FOLDER': folders, 'AS_OF_DT': pd.NaT})
+    manifest = pd.read_csv(source, dtype={'FOLDER': 'str', 'AS_OF_DT': 'str'})
+    if 'FOLDER' not in manifest:
+        raise ValueError('the manifest ' + source + ' has no FOLDER column')
+    base = os.path.dirname(os.path.abspath(source))
+    return pd.DataFrame({
+        'FOLDER': [os.path.join(base, f) for f in manifest['FOLDER']],
+        'AS_OF_DT': pd.to_datetime(manifest['AS_OF_DT'], format='%m/%d/%Y') if 'AS_OF_DT' in manifest else pd.NaT,
+    })
+
+
+#Function Name: SCORE_STATEMENT
+#Function Description: This function scores the typed feeds of one applicant (as bs_ingest reads them) and returns its df_ACCT_MAST_STG1 with AS_OF_DT in front,
+#                      the memo hit / miss counts (None without a memo_file) and the window table it was scored on
+#                      The as-of date defaults to the last day-end balance date; the outlier thresholds are taken over the applicant's transactions
+def SCORE_STATEMENT(df_tran, df_bal, as_of_dt=None, n_windows=6, rule='days', recur_mode='auto', memo_file=None):
+    df_tran = SET_RECURRENT_FLAGS(df_tran, recur_mode)
+    if as_of_dt is None or pd.isnull(as_of_dt):
+        as_of_dt = df_bal['ACCT_BAL_DT'].max() if len(df_bal) else df_tran['TRAN_DT'].max()
+    df_WINDOWS = BUILD_WINDOWS(as_of_dt, n_windows, rule=rule)
+    inflow_threshold, outflow_threshold = OUTLIER_THRESHOLDS(df_tran)
+    if memo_file is None:
+        df, memo = SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold)[0], None
+    else:
+        df, memo = MEMO_SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, memo_file)
+    df.insert(0, 'AS_OF_DT', df_WINDOWS.loc['M1', 'END_DT'])
+    return df, memo, df_WINDOWS
+
+
+#Function Name: SCORE_APPLICANT
+#Function Description: This function reads the feeds of one applicant folder and returns its df_ACCT_MAST_STG1, with APPLICANT and AS_OF_DT in front
+#                      With a memo_file the features come through bs_memo.MEMO_SCORE_ACCOUNTS; also returns its hit / miss counts (None without a memo_file)
+def SCORE_APPLICANT(folder, as_of_dt=None, cache_dir=None, n_windows=6, rule='days', recur_mode='auto', amount_type='float32', memo_file=None):
+    tran_schema = AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, amount_type)
+    df_tran = CACHED_READ(os.path.join(folder, BS_TRAN_FILE), READ_BS_TRAN, tran_schema, cache_dir)
+    df_bal = CACHED_READ(os.path.join(folder, BS_ACCT_BAL_FILE), READ_BS_ACCT_BAL, BS_ACCT_BAL_SCHEMA, cache_dir)
+    df, memo, df_WINDOWS = SCORE_STATEMENT(df_tran, df_bal, as_of_dt, n_windows, rule, recur_mode, memo_file)
+    df.insert(0, 'APPLICANT', os.path.basename(os.path.normpath(folder)))
+    return df, memo
+
+
+#Function Name: SCORE_BATCH
+#Function Description: This function scores every applicant of df_APPLICANTS on at most jobs threads and appends the results, in input order, to output_file
+#                      At most 2 * jobs applicants are in flight, so memory stays bounded however long the batch is
+#                      A failing applicant is reported on stderr and skipped; returns the table of applicants with their STATUS, ROWS and SECONDS
+#                      (and MEMO_HITS / MEMO_MISSES with a memo_file)
+def SCORE_BATCH(df_APPLICANTS, output_file, as_of_dt=None, jobs=4, cache_dir=None, n_windows=6, rule='days', recur_mode='auto', amount_type='float32',
+                memo_file=None):
+    def task(folder, applicant_as_of):
+        start = time.perf_counter()
+        try:
+            df, memo = SCORE_APPLICANT(folder, as_of_dt if pd.isnull(applicant_as_of) else applicant_as_of, cache_dir, n_windows, rule, recur_mode,
+                                       amount_type, memo_file)
+        except Exception as e:
+            return None, 'ERROR: ' + repr(e), None, time.perf_counter() - start
+        return df, 'OK', memo, time.perf_counter() - start
+
+    status = []
+    writer = OPEN_WRITER(output_file, index=False, background=True)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            pending = []
+            applicants = list(df_APPLICANTS.itertuples(index=False))
+            for i in range(len(applicants) + 1):
+                if i < len(applicants):
+                    pending.append(pool.submit(task, applicants[i].FOLDER, applicants[i].AS_OF_DT))
+                #Write the oldest applicant once the window is full, or drain at the end
+                while pending and (len(pending) >= 2 * jobs or i == len(applicants)):
+                    df, state, memo, seconds = pending.pop(0).result()
+                    if df is not None:
+                        WRITE_BATCH(writer, df)
+                    else:
+                        print(applicants[len(status)].FOLDER + ': ' + state, file=sys.stderr)
+                    status.append({'STATUS': state, 'ROWS': 0 if df is None else len(df), 'SECONDS': seconds})
+                    if memo_file is not None:
+                        status[-1].update({'MEMO_HITS': memo and memo['HITS'], 'MEMO_MISSES': memo and memo['MISSES']})
+    finally:
+        CLOSE_WRITER(writer)
+    return pd.concat([df_APPLICANTS.reset_index(drop=True), pd.DataFrame(status)], axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score many applicant bank statement folders into one csv.')
+    parser.add_argument('source', help='folder of applicant folders, or a manifest csv with FOLDER (and optional AS_OF_DT) columns')
+    parser.add_argument('-o', '--output', required=True, help='combined output (.csv, .csv.gz, .npz or .parquet)')
+    parser.add_argument('--as-of', default=None, help='as-of date for applicants without one in the manifest (default: their last balance date)')
+    parser.add_argument('--windows', type=int, default=6, help='number of windows (M1 to Mn)')
+    parser.add_argument('--window-rule', choices=['days', 'month'], default='days', help='30-day windows ending on the as-of date, or calendar months')
+    parser.add_argument('--recurrent', choices=['auto', 'feed', 'detect'], default='auto',
+                        help='recurrent transaction flags from the feed, detected from the counterparties, or the feed when it has them')
+    parser.add_argument('--amounts', choices=BS_AMOUNT_TYPES, default='float32', help='type of the transaction amounts (minor = exact int64 cents)')
+    parser.add_argument('--jobs', type=int, default=4, help='applicants scored at the same time')
+    parser.add_argument('--cache-dir', default=None, help='cache of the parsed feeds (bs_cache)')
+    parser.add_argument('--memo', default=None, help='sqlite file memoizing the per-account features across runs (bs_memo)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df_STATUS = SCORE_BATCH(LIST_APPLICANTS(args.source), args.output, args.as_of and pd.to_datetime(args.as_of, format='%m/%d/%Y'), args.jobs, args.cache_dir,
+                            args.windows, args.window_rule, args.recurrent, args.amounts, args.memo)
+    n_ok = int((df_STATUS['STATUS'] == 'OK').sum())
+    print(str(n_ok) + '/' + str(len(df_STATUS)) + ' applicants scored in ' + format(time.perf_counter() - start, '.2f') + ' s'
+          + ', median ' + format(df_STATUS['SECONDS'].median() * 1000, '.0f') + ' ms per applicant', file=sys.stderr)
+    if args.memo:
+        print('memo: ' + format(df_STATUS['MEMO_HITS'].sum(), '.0f') + ' account hits, ' + format(df_STATUS['MEMO_MISSES'].sum(), '.0f') + ' misses', file=sys.stderr)
+    sys.exit(0 if n_ok == len(df_STATUS) else 1)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Benchmarks of the bank statement scorecard.
+#     * amounts: the transaction amounts held as float32, float64 and int64 minor units (bs_ingest.AMOUNT_SCHEMA),
+#       compared on parse time, memory, per-account sums / maxima, the outlier comparisons and the exactness of the totals.
+#     * stages: every stage of test.py timed on its own, on synthetic statements (bs_synth) of several sizes, with its throughput (input rows per second)
+#       and its peak memory (the high-water mark of the allocations above what the stage started with, from tracemalloc, in a separate untimed run).
+#       The results can be saved as a baseline (json) and later runs compared with it: a stage slower or bigger than the baseline by more than
+#       the tolerance is flagged as a regression, and the command then exits with status 1.
+#     * writers: the output writers of bs_write (csv, csv.gz, npz, parquet when pyarrow is installed, each also on a background thread)
+#       against the plain to_csv calls of test.py, on the TRAN_FLG_STG1 and account summary tables of a synthetic statement:
+#       write time, time the caller is held (CALLER_S, lower than the write time on a background thread) and file size.
+#
+# Usage: python bs_bench.py amounts <statement folder> [--repeat N]
+#        python bs_bench.py stages [--accounts N ...] [--tran-per-day X] [--recurring SHARE] [--outliers SHARE] [--gaps SHARE] [--seed N] [--repeat N]
+#                                  [--baseline FILE] [--save-baseline] [--tolerance 0.25]
+#        python bs_bench.py writers [--accounts N] [--seed N] [--repeat N] [--work-dir DIR]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from bs_attrs import EVAL_ATTRIBUTES
+from bs_cpty import BUILD_CPTY_SMRY
+from bs_daily import BUILD_DAILY_CALENDAR, BUILD_TRAN_FLG, BUILD_SEQ_DAYS, MONTHLY_BAL_SMRY_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT, MAX_SEQ_LAYOUT
+from bs_daymat import BUILD_DAY_MATRIX, DAY_MATRIX_SMRY
+from bs_ingest import READ_BS_TRAN, READ_BS_ACCT_BAL, BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES, BS_MINOR_UNITS, BS_TRAN_FILE, BS_ACCT_BAL_FILE
+from bs_ingest import AMOUNT_SCHEMA, MINOR_UNIT_SCALE
+from bs_pipeline import ACCT_KEY_COLS, AMOUNT_COLS, OUTLIER_THRESHOLDS
+from bs_recur import DETECT_RECURRENT
+from bs_synth import WRITE_SYNTH_STATEMENT
+from bs_tran_smry import BUILD_MONTHLY_TRAN_SMRY
+from bs_window import BUILD_WINDOWS
+from bs_write import OUTPUT_FORMATS, OUTPUT_BATCH_ROWS, OPEN_WRITER, WRITE_BATCH, CLOSE_WRITER
+
+#A stage is a regression when slower / bigger than baseline * (1 + tolerance) plus these margins, so the timer and allocator noise
+#of the very short stages is not flagged
+BENCH_TOLERANCE = 0.25
+BENCH_SLACK_S = 0.01
+BENCH_SLACK_MB = 1.0
+
+
+#Function Name: BEST_TIME
+#Function Description: This function runs fn repeat times and returns the shortest time in seconds and the result of the last run
+def BEST_TIME(fn, repeat=3):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+#Function Name: BENCH_AMOUNT_TYPES
+#Function Description: This function reads the transaction file with every amount type and times the parse, the per-account sums and maxima
+#                      of the inflow / outflow amounts and the outlier comparisons (amount > mean + 2.5 * stddev)
+#                      The per-account totals of every type are checked against the exact ones of the minor units: MAX_TTL_ERR is the largest
+#                      error in HKD, CENT_OFF_ACCTS the number of accounts with a total off by half a cent or more
+def BENCH_AMOUNT_TYPES(file, repeat=3):
+    rows = []
+    totals = {}
+    for amount_type in BS_AMOUNT_TYPES:
+        schema = AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, amount_type)
+        parse, df = BEST_TIME(lambda: READ_BS_TRAN(file, schema=schema), repeat)
+        amounts = df[AMOUNT_COLS]
+        by_acct = amounts.groupby(df['ACCT_ID'].to_numpy(), sort=False)
+        sums, total = BEST_TIME(lambda: by_acct.sum(), repeat)
+        maxes, _ = BEST_TIME(lambda: by_acct.max(), repeat)
+        thresholds = OUTLIER_THRESHOLDS(df)
+        outliers, _ = BEST_TIME(lambda: [(df[col] > thr).sum() for col, thr in zip(AMOUNT_COLS, thresholds)], repeat)
+        totals[amount_type] = total / MINOR_UNIT_SCALE if amount_type == BS_MINOR_UNITS else total.astype('float64')
+        rows.append({'AMOUNT_TYPE': amount_type, 'ROWS': len(df), 'AMOUNT_MB': amounts.memory_usage(index=False).sum() / 2 ** 20,
+                     'PARSE_S': parse, 'SUM_S': sums, 'MAX_S': maxes, 'OUTLIER_S': outliers})
+    df_BENCH = pd.DataFrame(rows).set_index('AMOUNT_TYPE')
+    exact = totals[BS_MINOR_UNITS]
+    for amount_type, total in totals.items():
+        err = (total - exact).abs()
+        df_BENCH.loc[amount_type, 'MAX_TTL_ERR'] = err.to_numpy().max()
+        df_BENCH.loc[amount_type, 'CENT_OFF_ACCTS'] = (err >= 0.005).any(axis=1).sum()
+    return df_BENCH
+
+
+#Function Name: PIPELINE_STAGES
+#Function Description: This function returns the stages of test.py on a statement folder, in run order, as (stage, function, input):
+#                      the function takes the outputs of the stages before it (a dict by stage name) and returns the stage's output,
+#                      input = the stage whose output's rows the stage reads (None: the stage reads a file, its rows are those it returns)
+def PIPELINE_STAGES(folder, df_WINDOWS):
+    end_dt = df_WINDOWS.loc['M1', 'END_DT']
+
+    def merge(s):
+        df = pd.merge(s['FORWARD_FILL'], s['TRAN_INFLOW_OUTFLOW_FLG'], left_on=['ACCT_ID', 'ACCT_BAL_DT'], right_on=['ACCT_ID', 'TRAN_DT'], how='left')
+        return df.fillna({'DAILY_INFLOW_FLG': 0, 'DAILY_OUTFLOW_FLG': 0})
+
+    def streaks(s):
+        return s['MERGE'].assign(TRAN_INFLOW_SEQ_DAYS=BUILD_SEQ_DAYS(s['MERGE'], 'DAILY_INFLOW_FLG'),
+                                 TRAN_OUTFLOW_SEQ_DAYS=BUILD_SEQ_DAYS(s['MERGE'], 'DAILY_OUTFLOW_FLG'))
+
+    def attributes(s):
+        df = s['INGEST_TRAN'][ACCT_KEY_COLS].drop_duplicates().sort_values(ACCT_KEY_COLS)
+        for stage in ['MONTHLY_BAL_SMRY', 'MONTHLY_TRAN_SMRY', 'MAX_SEQ_DAYS_WO_TRAN', 'DAYS_WO_TRAN', 'CPTY_SMRY']:
+            df = df.join(s[stage], on='ACCT_ID')
+        return df.join(EVAL_ATTRIBUTES(df, df_WINDOWS))
+
+    return [
+        ('INGEST_TRAN', lambda s: READ_BS_TRAN(os.path.join(folder, BS_TRAN_FILE)), None),
+        ('INGEST_BAL', lambda s: READ_BS_ACCT_BAL(os.path.join(folder, BS_ACCT_BAL_FILE)), None),
+        ('RECURRENT', lambda s: DETECT_RECURRENT(s['INGEST_TRAN']), 'INGEST_TRAN'),
+        ('THRESHOLDS', lambda s: OUTLIER_THRESHOLDS(s['INGEST_TRAN']), 'INGEST_TRAN'),
+        ('MONTHLY_TRAN_SMRY', lambda s: BUILD_MONTHLY_TRAN_SMRY(s['INGEST_TRAN'], df_WINDOWS, *s['THRESHOLDS']), 'INGEST_TRAN'),
+        ('TRAN_INFLOW_OUTFLOW_FLG', lambda s: BUILD_TRAN_FLG(s['INGEST_TRAN']), 'INGEST_TRAN'),
+        ('FORWARD_FILL', lambda s: BUILD_DAILY_CALENDAR(s['INGEST_BAL'], end_dt), 'INGEST_BAL'),
+        ('MERGE', merge, 'FORWARD_FILL'),
+        ('STREAKS', streaks, 'MERGE'),
+        ('DAY_MATRIX', lambda s: BUILD_DAY_MATRIX(s['FORWARD_FILL'], s['INGEST_TRAN'], df_WINDOWS), 'FORWARD_FILL'),
+        ('MONTHLY_BAL_SMRY', lambda s: DAY_MATRIX_SMRY(s['DAY_MATRIX'], df_WINDOWS, MONTHLY_BAL_SMRY_LAYOUT), 'FORWARD_FILL'),
+        ('MAX_SEQ_DAYS_WO_TRAN', lambda s: DAY_MATRIX_SMRY(s['DAY_MATRIX'], df_WINDOWS, MAX_SEQ_LAYOUT), 'FORWARD_FILL'),
+        ('DAYS_WO_TRAN', lambda s: DAY_MATRIX_SMRY(s['DAY_MATRIX'], df_WINDOWS, DAYS_WO_TRAN_SMRY_LAYOUT), 'FORWARD_FILL'),
+        ('CPTY_SMRY', lambda s: BUILD_CPTY_SMRY(s['INGEST_TRAN'], df_WINDOWS), 'INGEST_TRAN'),
+        ('ATTRIBUTES', attributes, 'MONTHLY_TRAN_SMRY'),
+    ]
+
+
+#Function Name: BENCH_STAGES
+#Function Description: This function times every stage of PIPELINE_STAGES on a statement folder (best of repeat runs, the stage's inputs being the outputs
+#                      of the stages before it) and measures its peak memory in one more run under tracemalloc
+#                      Returns one row per stage: ROWS (input rows), SECONDS, ROWS_PER_S and PEAK_MB
+def BENCH_STAGES(folder, df_WINDOWS, repeat=3):
+    stages = PIPELINE_STAGES(folder, df_WINDOWS)
+    outputs = {}
+    rows = []
+    for stage, fn, source in stages:
+        seconds, outputs[stage] = BEST_TIME(lambda: fn(outputs), repeat)
+        n_rows = len(outputs[source if source else stage])
+        rows.append({'STAGE': stage, 'ROWS': n_rows, 'SECONDS': seconds, 'ROWS_PER_S': n_rows / seconds if seconds > 0 else float('nan')})
+
+    #Memory in a separate run, as tracing every allocation slows the stages down
+    tracemalloc.start()
+    try:
+        traced = {}
+        for (stage, fn, source), row in zip(stages, rows):
+            start_mb = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            traced[stage] = fn(traced)
+            row['PEAK_MB'] = (tracemalloc.get_traced_memory()[1] - start_mb) / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    return pd.DataFrame(rows).set_index('STAGE')
+
+
+#Function Name: BENCH_SCALES
+#Function Description: This function runs BENCH_STAGES on synthetic statements (bs_synth.WRITE_SYNTH_STATEMENT) of every number of accounts of scales
+#                      synth = the other arguments of WRITE_SYNTH_STATEMENT; the windows are the 6 x 30 days ending on the last day of the statements
+#                      Returns one row per (ACCOUNTS, STAGE)
+def BENCH_SCALES(scales, synth=None, repeat=3, work_dir=None):
+    synth = dict(synth or {})
+    df_WINDOWS = BUILD_WINDOWS(synth.get('end_dt', '2019-12-31'))
+    results = {}
+    for n_accounts in scales:
+        folder = tempfile.mkdtemp(prefix='bs_bench_', dir=work_dir)
+        try:
+            WRITE_SYNTH_STATEMENT(folder, n_accounts, **synth)
+            results[n_accounts] = BENCH_STAGES(folder, df_WINDOWS, repeat)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return pd.concat(results, names=['ACCOUNTS'])
+
+
+#Function Name: SAVE_BENCH_BASELINE / LOAD_BENCH_BASELINE
+#Function Description: These functions write the results of BENCH_SCALES, with the synthetic data settings they were taken on, to a json baseline and read them back
+def SAVE_BENCH_BASELINE(df_BENCH, synth, file):
+    with open(file, 'w') as f:
+        json.dump({'SYNTH': synth, 'STAGES': df_BENCH.reset_index().to_dict(orient='records')}, f, indent=1)
+
+
+def LOAD_BENCH_BASELINE(file):
+    with open(file) as f:
+        baseline = json.load(f)
+    return baseline['SYNTH'], pd.DataFrame(baseline['STAGES']).set_index(['ACCOUNTS', 'STAGE'])
+
+
+#Function Name: COMPARE_BENCH_BASELINE
+#Function Description: This function adds the baseline's SECONDS / PEAK_MB (BASE_SECONDS / BASE_PEAK_MB) and their ratios to the results,
+#                      and flags in REGRESSION the stages slower or bigger than the baseline by more than tolerance (plus BENCH_SLACK_S / BENCH_SLACK_MB)
+#                      Stages or scales missing from the baseline are never flagged
+def COMPARE_BENCH_BASELINE(df_BENCH, df_BASE, tolerance=BENCH_TOLERANCE):
+    base = df_BASE[['SECONDS', 'PEAK_MB']].reindex(df_BENCH.index)
+    df = df_BENCH.assign(BASE_SECONDS=base['SECONDS'], BASE_PEAK_MB=base['PEAK_MB'])
+    df['TIME_RATIO'] = df['SECONDS'] / df['BASE_SECONDS']
+    df['MEM_RATIO'] = df['PEAK_MB'] / df['BASE_PEAK_MB']
+    df['REGRESSION'] = ((df['SECONDS'] > df['BASE_SECONDS'] * (1 + tolerance) + BENCH_SLACK_S)
+                        | (df['PEAK_MB'] > df['BASE_PEAK_MB'] * (1 + tolerance) + BENCH_SLACK_MB))
+    return df
+
+
+#Function Name: BENCH_WRITERS
+#Function Description: This function writes the tables (a dict of name: DataFrame) into work_dir with to_csv, as test.py did, and with every writer of bs_write,
+#                      in batches of batch_rows rows, in the foreground and on a background thread (best of repeat runs)
+#                      Returns one row per (TABLE, WRITER): SECONDS (until the file is closed), CALLER_S (spent in the writer calls before the close),
+#                      MB, SIZE_RATIO and SPEEDUP against to_csv; parquet is left out when pyarrow is not installed
+def BENCH_WRITERS(tables, work_dir, repeat=3, batch_rows=OUTPUT_BATCH_ROWS):
+    def to_csv(df, file):
+        start = time.perf_counter()
+        df.to_csv(file, header=True)
+        return time.perf_counter() - start, time.perf_counter() - start
+
+    def streamed(df, file, fmt, background):
+        start = time.perf_counter()
+        writer = OPEN_WRITER(file, fmt, background=background)
+        for first in range(0, len(df), batch_rows):
+            WRITE_BATCH(writer, df.iloc[first:first + batch_rows])
+        caller = time.perf_counter() - start
+        CLOSE_WRITER(writer)
+        return time.perf_counter() - start, caller
+
+    runs = [('to_csv', 'csv', to_csv)]
+    for fmt in OUTPUT_FORMATS:
+        if fmt == 'parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                continue
+        for background in [False, True]:
+            runs.append((fmt + (' (background)' if background else ''), fmt, lambda df, file, fmt=fmt, background=background: streamed(df, file, fmt, background)))
+
+    rows = []
+    for table, df in tables.items():
+        for name, fmt, fn in runs:
+            file = os.path.join(work_dir, table + '.' + fmt)
+            seconds, caller = min(fn(df, file) for _ in range(repeat))
+            rows.append({'TABLE': table, 'WRITER': name, 'ROWS': len(df), 'SECONDS': seconds, 'CALLER_S': caller, 'MB': os.path.getsize(file) / 2 ** 20})
+            os.remove(file)
+    df_BENCH = pd.DataFrame(rows).set_index(['TABLE', 'WRITER'])
+    base = df_BENCH.xs('to_csv', level='WRITER')
+    df_BENCH['SIZE_RATIO'] = df_BENCH['MB'] / base['MB'].reindex(df_BENCH.index, level='TABLE')
+    df_BENCH['SPEEDUP'] = base['SECONDS'].reindex(df_BENCH.index, level='TABLE') / df_BENCH['SECONDS']
+    return df_BENCH
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the bank statement scorecard.')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    amounts = sub.add_parser('amounts', help='float32 / float64 / int64 minor unit amounts')
+    amounts.add_argument('folder', help='statement folder holding ' + BS_TRAN_FILE)
+    amounts.add_argument('--repeat', type=int, default=3, help='runs per timing (the best is kept)')
+    stages = sub.add_parser('stages', help='every stage of test.py on synthetic statements of several sizes')
+    stages.add_argument('--accounts', type=int, nargs='+', default=[100, 1000, 10000], help='numbers of accounts benchmarked')
+    stages.add_argument('--tran-per-day', type=float, default=2.0, help='transactions per account per day')
+    stages.add_argument('--recurring', type=float, default=0.1, help='share of recurrent transactions')
+    stages.add_argument('--outliers', type=float, default=0.01, help='share of outlier transactions')
+    stages.add_argument('--gaps', type=float, default=0.2, help='share of days without transactions')
+    stages.add_argument('--seed', type=int, default=0, help='seed of the synthetic statements')
+    stages.add_argument('--repeat', type=int, default=3, help='runs per timing (the best is kept)')
+    stages.add_argument('--baseline', default=None, help='json baseline the results are compared with (or saved to, with --save-baseline)')
+    stages.add_argument('--save-baseline', action='store_true', help='save the results as the baseline instead of comparing')
+    stages.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE, help='slowdown / memory growth over the baseline flagged as a regression')
+    stages.add_argument('--work-dir', default=None, help='folder of the synthetic statements (default: the system temp folder)')
+    writers = sub.add_parser('writers', help='the output writers of bs_write against to_csv')
+    writers.add_argument('--accounts', type=int, default=1000, help='number of accounts of the synthetic statement')
+    writers.add_argument('--seed', type=int, default=0, help='seed of the synthetic statement')
+    writers.add_argument('--repeat', type=int, default=3, help='runs per timing (the best is kept)')
+    writers.add_argument('--work-dir', default=None, help='folder of the synthetic statement and the files written (default: the system temp folder)')
+    args = parser.parse_args()
+
+    if args.bench == 'amounts':
+        with pd.option_context('display.width', 200, 'display.max_columns', 20):
+            print(BENCH_AMOUNT_TYPES(os.path.join(args.folder, BS_TRAN_FILE), args.repeat))
+
+    if args.bench == 'stages':
+        synth = {'tran_per_day': args.tran_per_day, 'recur_share': args.recurring, 'outlier_share': args.outliers, 'gap_share': args.gaps, 'seed': args.seed}
+        if args.baseline and not args.save_baseline:
+            base_synth, df_BASE = LOAD_BENCH_BASELINE(args.baseline)
+            if base_synth != synth:
+                print('warning: the baseline was taken on other synthetic data settings ' + json.dumps(base_synth), file=sys.stderr)
+        df_BENCH = BENCH_SCALES(args.accounts, synth, args.repeat, args.work_dir)
+        if args.baseline and args.save_baseline:
+            SAVE_BENCH_BASELINE(df_BENCH, synth, args.baseline)
+        elif args.baseline:
+            df_BENCH = COMPARE_BENCH_BASELINE(df_BENCH, df_BASE, args.tolerance)
+        with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.max_rows', 500):
+            print(df_BENCH)
+        if 'REGRESSION' in df_BENCH and df_BENCH['REGRESSION'].any():
+            print(str(int(df_BENCH['REGRESSION'].sum())) + ' stage(s) regressed against ' + args.baseline, file=sys.stderr)
+            sys.exit(1)
+
+    if args.bench == 'writers':
+        folder = tempfile.mkdtemp(prefix='bs_bench_', dir=args.work_dir)
+        try:
+            WRITE_SYNTH_STATEMENT(folder, args.accounts, seed=args.seed)
+            outputs = {}
+            for stage, fn, source in PIPELINE_STAGES(folder, BUILD_WINDOWS('2019-12-31')):
+                outputs[stage] = fn(outputs)
+            df_BENCH = BENCH_WRITERS({'TRAN_FLG_STG1': outputs['STREAKS'], 'BS_ACCT_SMRY': outputs['ATTRIBUTES']}, folder, args.repeat)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        with pd.option_context('display.width', 200, 'display.max_columns', 20):
+            print(df_BENCH)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Local on-disk cache of the parsed bank statement files.
+#     * An entry is keyed by a hash of the raw file content, the reader, its schema and BS_SCHEMA_VERSION, so it is invalidated when any of them changes.
+#     * Each column is stored as a .npy file (categoricals as their codes plus a category list) and is memory-mapped on load.
+#     * The cache is bounded in size; the least recently used entries are evicted first.
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from bs_ingest import BS_SCHEMA_VERSION
+
+BS_CACHE_MAX_BYTES = 2 * 1024 ** 3
+BS_CACHE_META = 'meta.json'
+
+
+#Function Name: FILE_HASH
+#Function Description: This function returns the blake2b hash of a file's content, read in blocks
+def FILE_HASH(file, block_size=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+#Function Name: CACHE_KEY
+#Function Description: This function returns the cache key of a raw file read with the given reader and schema
+def CACHE_KEY(file, reader, schema):
+    h = hashlib.blake2b(digest_size=20)
+    h.update(FILE_HASH(file).encode())
+    h.update(reader.__name__.encode())
+    h.update(json.dumps(schema, sort_keys=True).encode())
+    h.update(str(BS_SCHEMA_VERSION).encode())
+    return h.hexdigest()
+
+
+#Function Name: SAVE_FRAME
+#Function Description: This function writes a DataFrame into entry_dir as one .npy file per column plus a meta.json describing the columns
+def SAVE_FRAME(df, entry_dir):
+    os.makedirs(entry_dir)
+    meta = {'columns': [], 'rows': len(df)}
+    for i, col in enumerate(df.columns):
+        file = 'c' + str(i) + '.npy'
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(entry_dir, file), df[col].cat.codes.to_numpy())
+            meta['columns'].append({'name': col, 'file': file, 'categories': df[col].cat.categories.tolist()})
+        else:
+            values = df[col].to_numpy()
+            if values.dtype == object:
+                raise TypeError('column ' + col + ' has no fixed-width dtype and cannot be cached')
+            np.save(os.path.join(entry_dir, file), values)
+            meta['columns'].append({'name': col, 'file': file})
+    with open(os.path.join(entry_dir, BS_CACHE_META), 'w') as f:
+        json.dump(meta, f)
+
+
+#Function Name: LOAD_FRAME
+#Function Description: This function reads back a DataFrame written by SAVE_FRAME, memory-mapping the column files
+def LOAD_FRAME(entry_dir):
+    with open(os.path.join(entry_dir, BS_CACHE_META)) as f:
+        meta = json.load(f)
+    columns = {}
+    for col in meta['columns']:
+        values = np.load(os.path.join(entry_dir, col['file']), mmap_mode='r')
+        if 'categories' in col:
+            columns[col['name']] = pd.Categorical.from_codes(values, categories=col['categories'])
+        else:
+            columns[col['name']] = values
+    return pd.DataFrame(columns, index=pd.RangeIndex(meta['rows']), copy=False)
+
+
+#Function Name: CACHE_SIZE
+#Function Description: This function returns the size in bytes of a cache entry
+def CACHE_SIZE(entry_dir):
+    return sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+
+
+#Function Name: EVICT_CACHE
+#Function Description: This function removes the least recently used entries until the cache holds at most max_bytes
+#                      The last use of an entry is the modification time of its meta.json, which CACHED_READ touches on every hit
+def EVICT_CACHE(cache_dir, max_bytes=BS_CACHE_MAX_BYTES):
+    entries = []
+    for e in os.scandir(cache_dir):
+        meta = os.path.join(e.path, BS_CACHE_META)
+        if e.is_dir() and os.path.exists(meta):
+            entries.append((os.path.getmtime(meta), CACHE_SIZE(e.path), e.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+
+#Function Name: CACHED_READ
+#Function Description: This function returns reader(file, schema=schema) from the cache in cache_dir, parsing the file and adding it to the cache on a miss
+#                      schema is the schema the reader applies (e.g. bs_ingest.BS_TRAN_SCHEMA); a new entry is written to a temporary folder and renamed into place
+#                      With cache_dir = None the file is simply read
+def CACHED_READ(file, reader, schema, cache_dir, max_bytes=BS_CACHE_MAX_BYTES):
+    if cache_dir is None:
+        return reader(file, schema=schema)
+    entry_dir = os.path.join(cache_dir, CACHE_KEY(file, reader, schema))
+    if os.path.exists(os.path.join(entry_dir, BS_CACHE_META)):
+        os.utime(os.path.join(entry_dir, BS_CACHE_META))
+        return LOAD_FRAME(entry_dir)
+
+    df = reader(file, schema=schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = os.path.join(cache_dir, '.tmp-' + uuid.uuid4().hex)
+    SAVE_FRAME(df, tmp_dir)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        #Another run cached the same file first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    EVICT_CACHE(cache_dir, max_bytes)
+    return df
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Counterparty concentration of the bank statement scorecard: the share of an account's inflow / outflow in a window
+#   taken by its top-k counterparties (the COUNTERPARTY column of the transaction feed).
+#     * The share is of all the account's positive in-window amounts; the transactions without a counterparty count in that total
+#       but are not a counterparty of their own.
+#     * The amounts are first summed per (account, window, counterparty) in one grouped sum.
+#     * The top-k are picked per (account, window) by k passes of a grouped maximum, a partial selection linear in the
+#       number of (account, window, counterparty) groups, instead of sorting every account's counterparties.
+#     * For very large feeds, the sketch mode keeps at most sketch_size counterparties per (account, window) with a mergeable
+#       Misra-Gries summary folded over chunks; a counterparty's amount is then under-estimated by at most total / (sketch_size + 1).
+#       The error is large for a small sketch_size: on a 1000-account bs_synth statement the shares are off by up to 40 points at 5,
+#       15 at 10 and 5 at 20, and exact at 50. It is off by default (SCORE_ACCOUNTS cpty_sketch_size, bs_ooc --cpty-sketch).
+#     * Feeds without a COUNTERPARTY column give NaN shares.
+
+import numpy as np
+import pandas as pd
+
+from bs_window import ALL_WINDOWS, TAG_WINDOW, WINDOW_SMRY, ACCOUNT_INDEX
+
+CPTY_COL = 'COUNTERPARTY'
+CPTY_TOP_K = 3
+CPTY_KEYS = ['ACCT_ID', 'WINDOW', CPTY_COL]
+
+#Layout of the concentration summary: % of the window's inflow / outflow amount from the top-k counterparties
+CPTY_SMRY_LAYOUT = [
+    ('TOP_CPTY_INFLOW_SHR', 'INFLOW_SHR', ALL_WINDOWS),
+    ('TOP_CPTY_OUTFLOW_SHR', 'OUTFLOW_SHR', ALL_WINDOWS),
+]
+CPTY_AMOUNT_COLS = {'INFLOW_SHR': 'INFLOW_TRAN_AMT_HKD', 'OUTFLOW_SHR': 'OUTFLOW_TRAN_AMT_HKD'}
+
+
+#Function Name: CPTY_AMOUNTS
+#Function Description: This function sums the positive amounts of amount_col for the rows inside the windows: per (ACCT_ID, WINDOW, COUNTERPARTY)
+#                      for the rows with a counterparty, and per (ACCT_ID, WINDOW) for all of them (the total the shares are taken of)
+def CPTY_AMOUNTS(df, df_WINDOWS, amount_col):
+    win = TAG_WINDOW(df['TRAN_DT'], df_WINDOWS)
+    amount = df[amount_col].to_numpy(dtype='float64')
+    keep = (win >= 0) & (amount > 0)
+    rows = pd.DataFrame({'ACCT_ID': df['ACCT_ID'].to_numpy()[keep], 'WINDOW': win[keep],
+                         CPTY_COL: np.asarray(df[CPTY_COL])[keep], 'AMOUNT': amount[keep]})
+    total = rows.groupby(['ACCT_ID', 'WINDOW'], sort=False)['AMOUNT'].sum()
+    rows = rows[rows[CPTY_COL].notna().to_numpy()]
+    return rows.groupby(CPTY_KEYS, sort=False, observed=True)['AMOUNT'].sum(), total
+
+
+#Function Name: MG_TRUNCATE
+#Function Description: This function keeps at most m counterparties per (account, window): the (m+1)-th largest amount of the group
+#                      is taken off every counter of the group and the counters left at 0 or below are dropped (mergeable Misra-Gries summary)
+def MG_TRUNCATE(amounts, m):
+    rank = amounts.groupby(level=['ACCT_ID', 'WINDOW'], sort=False).rank(method='first', ascending=False)
+    cut = amounts[rank == m + 1].droplevel(CPTY_COL)
+    cut = cut.reindex(amounts.index.droplevel(CPTY_COL)).fillna(0.0).to_numpy()
+    amounts = amounts - cut
+    return amounts[amounts > 0]
+
+
+#Function Name: TOP_K_SUM
+#Function Description: This function returns the sum of the k largest counterparty amounts of every (account, window)
+#                      Each of the k passes takes the grouped maximum and removes it, so the cost is linear in the number of counterparty groups
+def TOP_K_SUM(amounts, k=CPTY_TOP_K):
+    code, groups = pd.factorize(amounts.index.droplevel(CPTY_COL))
+    values = amounts.to_numpy(dtype='float64').copy()
+    top = np.zeros(len(groups))
+    for _ in range(k):
+        pick = pd.Series(values).groupby(code).idxmax().to_numpy()
+        best = values[pick]
+        top += np.where(np.isfinite(best), best, 0.0)
+        values[pick] = -np.inf
+    return pd.Series(top, index=groups.set_names(['ACCT_ID', 'WINDOW']))
+
+
+#Function Name: BUILD_CPTY_SMRY
+#Function Description: This function computes, per account and window, the % of the inflow / outflow amount coming from / going to the top k counterparties
+#                      df_tran is the transaction table or an iterable of its chunks; sketch_size = None sums every counterparty exactly,
+#                      an integer m keeps at most m counterparties per (account, window) while the chunks are folded (sketch mode);
+#                      a small m gives large errors (up to 40 share points at m = 5 on bs_synth data), so m should be well above k
+#                      layout = the features to build, a subset of CPTY_SMRY_LAYOUT (all of it by default)
+def BUILD_CPTY_SMRY(df_tran, df_WINDOWS, k=CPTY_TOP_K, sketch_size=None, layout=CPTY_SMRY_LAYOUT):
+    chunks = [df_tran] if isinstance(df_tran, pd.DataFrame) else df_tran
+    measures = [name for prefix, name, months in layout]
+    amounts = {name: None for name in measures}
+    totals = {name: None for name in measures}
+    accounts = []
+    for chunk in chunks:
+        accounts.append(ACCOUNT_INDEX(chunk))
+        if CPTY_COL not in chunk:
+            continue
+        for name in measures:
+            part, total = CPTY_AMOUNTS(chunk, df_WINDOWS, CPTY_AMOUNT_COLS[name])
+            totals[name] = total if totals[name] is None else totals[name].add(total, fill_value=0.0)
+            part = part if amounts[name] is None else amounts[name].add(part, fill_value=0.0)
+            if sketch_size is not None:
+                part = MG_TRUNCATE(part, sketch_size)
+            amounts[name] = part
+    accounts = pd.Index(np.unique(np.concatenate([a.to_numpy() for a in accounts])) if accounts else [], name='ACCT_ID')
+
+    return CPTY_SHARES(amounts, totals, accounts, len(df_WINDOWS), k, layout)
+
+
+#Function Name: CPTY_SHARES
+#Function Description: This function lays out the top-k shares of the summed counterparty amounts as one wide row per account
+#                      amounts / totals = per measure of the layout, the amounts per (ACCT_ID, WINDOW, COUNTERPARTY) and their totals per (ACCT_ID, WINDOW);
+#                      a measure missing from them (a feed without counterparties) gives NaN shares
+def CPTY_SHARES(amounts, totals, accounts, n_windows, k=CPTY_TOP_K, layout=CPTY_SMRY_LAYOUT):
+    measures = [name for prefix, name, months in layout]
+    #One row per (account, window) holding the shares, laid out wide like the other summaries
+    shares = {}
+    for name in measures:
+        if totals.get(name) is not None and len(totals[name]):
+            shares[name] = TOP_K_SUM(amounts[name], k).reindex(totals[name].index, fill_value=0.0) / totals[name] * 100
+    if shares:
+        df = pd.concat(shares, axis=1).reset_index()
+    else:
+        df = pd.DataFrame({'ACCT_ID': pd.Series(dtype='int64'), 'WINDOW': pd.Series(dtype='int64')})
+    for name in measures:
+        if name not in df:
+            df[name] = np.nan
+    agg = {name: 'max' for name in measures}
+    return WINDOW_SMRY(df, df['WINDOW'].to_numpy(), agg, layout, accounts, n_windows)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Vectorized day-level stages of the bank statement scorecard.
+#     * The day-end balance table is densified into one row per account per calendar day.
+#     * Streaks of days without inflow / outflow are found from run boundaries and cumulative sums, without a row-by-row loop.
+#     * The day-level summaries read the window table and are taken in one groupby over (ACCT_ID, window), like the transaction summary.
+
+import numpy as np
+import pandas as pd
+
+from bs_window import ALL_WINDOWS, TAG_WINDOW, WINDOW_SMRY, ACCOUNT_INDEX
+
+
+#Function Name: BUILD_DAILY_CALENDAR
+#Function Description: This function fills in the missing dates of the day-end balance table, per account, from the account's first day to end_dt (the end of M1)
+#                      On a day without a balance record, the previous day's identity columns and ACCT_BAL are carried forward
+def BUILD_DAILY_CALENDAR(df, end_dt, date_col='ACCT_BAL_DT'):
+    end = np.datetime64(pd.to_datetime(end_dt), 'D')
+    df = df.sort_values(['ACCT_ID', date_col], kind='stable')
+    df = df.drop_duplicates(['ACCT_ID', date_col], keep='first')
+    days = np.asarray(df[date_col], dtype='datetime64[D]')
+    df = df[days <= end]
+    days = days[days <= end]
+
+    #One block of consecutive days per account, starting at the account's first balance record
+    acct_code = pd.factorize(df['ACCT_ID'], sort=True)[0]
+    block_start = np.flatnonzero(np.diff(acct_code, prepend=-1))
+    first_day = days[block_start]
+    n_days = (end - first_day).astype('int64') + 1
+    offset = np.cumsum(n_days) - n_days
+    total = int(n_days.sum())
+
+    #Position of every observed record in the dense table, then the last observed record at or before every dense row
+    #The first row of every block is observed, so the running maximum never carries a record over into the next account
+    pos = offset[acct_code] + (days - first_day[acct_code]).astype('int64')
+    last_obs = np.full(total, -1, dtype='int64')
+    last_obs[pos] = pos
+    last_obs = np.maximum.accumulate(last_obs)
+    obs_row = np.empty(total, dtype='int64')
+    obs_row[pos] = np.arange(len(pos))
+    src = obs_row[last_obs]
+
+    day_in_block = np.arange(total) - np.repeat(offset, n_days)
+    out = {date_col: pd.Series(np.repeat(first_day, n_days) + day_in_block, dtype='datetime64[ns]')}
+    for col in df.columns:
+        if col != date_col:
+            out[col] = df[col].take(src).reset_index(drop=True)
+    return pd.DataFrame(out)
+
+
+#Function Name: BUILD_TRAN_FLG
+#Function Description: This function counts the inflow / outflow transactions of every account on every date with transactions (DAILY_INFLOW_FLG, DAILY_OUTFLOW_FLG)
+#                      The result is indexed by (ACCT_ID, TRAN_DT), as the original groupby(['ACCT_ID','TRAN_DT']).apply(TRAN_INFLOW_OUTFLOW_FLG)
+def BUILD_TRAN_FLG(df):
+    flags = pd.DataFrame({
+        'ACCT_ID': df['ACCT_ID'],
+        'TRAN_DT': df['TRAN_DT'],
+        'DAILY_INFLOW_FLG': (df['INFLOW_TRAN_AMT_HKD'] > 0).astype('int64'),
+        'DAILY_OUTFLOW_FLG': (df['OUTFLOW_TRAN_AMT_HKD'] > 0).astype('int64'),
+    }, index=df.index)
+    return flags.groupby(['ACCT_ID', 'TRAN_DT'], sort=True).sum()
+
+
+#Layout of the day-end balance summary, in the column order of the original MONTHLY_BAL_SMRY
+MONTHLY_BAL_SMRY_LAYOUT = [
+    ('TTL_DAILY_BAL_AMT', 'BAL_SUM', [1]),
+    ('MIN_BAL_AMT', 'BAL_MIN', ALL_WINDOWS),
+    ('NEG_BAL_DAYS', 'NEG_BAL_CNT', ALL_WINDOWS),
+    ('DAILY_BAL_STD', 'BAL_STD', ALL_WINDOWS),
+]
+MONTHLY_BAL_SMRY_AGG = {'BAL_SUM': 'sum', 'BAL_MIN': 'min', 'NEG_BAL_CNT': 'sum', 'BAL_STD': 'std'}
+
+#Layout of the days without transactions summary
+DAYS_WO_TRAN_SMRY_LAYOUT = [
+    ('DAYS_WO_INFLOW_TRAN_CNT', 'WO_INFLOW_CNT', ALL_WINDOWS),
+    ('DAYS_WO_OUTFLOW_TRAN_CNT', 'WO_OUTFLOW_CNT', ALL_WINDOWS),
+]
+DAYS_WO_TRAN_SMRY_AGG = {'WO_INFLOW_CNT': 'sum', 'WO_OUTFLOW_CNT': 'sum'}
+
+#Layout of the streak summary
+MAX_SEQ_LAYOUT = [
+    ('MAX_SEQ_DAYS_WO_INFLOW', 'DAILY_INFLOW_FLG', ALL_WINDOWS),
+    ('MAX_SEQ_DAYS_WO_OUTFLOW', 'DAILY_OUTFLOW_FLG', ALL_WINDOWS),
+]
+
+
+#Function Name: BUILD_MONTHLY_BAL_SMRY
+#Function Description: This function aggregates the daily balance attributes of every account for the last 6 months
+#                      layout = the features to build, a subset of MONTHLY_BAL_SMRY_LAYOUT (all of it by default)
+def BUILD_MONTHLY_BAL_SMRY(df, df_WINDOWS, date_col='ACCT_BAL_DT', layout=MONTHLY_BAL_SMRY_LAYOUT):
+    bal = df['ACCT_BAL']
+    measures = pd.DataFrame({
+        'ACCT_ID': df['ACCT_ID'],
+        'BAL_SUM': bal,
+        'BAL_MIN': bal,
+        'NEG_BAL_CNT': (bal <= 0).astype('int64'),
+        'BAL_STD': bal,
+    }, index=df.index)
+    win = TAG_WINDOW(df[date_col], df_WINDOWS)
+    return WINDOW_SMRY(measures, win, MONTHLY_BAL_SMRY_AGG, layout, ACCOUNT_INDEX(df), len(df_WINDOWS))
+
+
+#Function Name: BUILD_DAYS_WO_TRAN_SMRY
+#Function Description: This function calculates the # of days without inflow / outflow transactions of every account for the last 6 months
+#                      layout = the features to build, a subset of DAYS_WO_TRAN_SMRY_LAYOUT (all of it by default)
+def BUILD_DAYS_WO_TRAN_SMRY(df, df_WINDOWS, date_col='ACCT_BAL_DT', layout=DAYS_WO_TRAN_SMRY_LAYOUT):
+    measures = pd.DataFrame({
+        'ACCT_ID': df['ACCT_ID'],
+        'WO_INFLOW_CNT': (df['DAILY_INFLOW_FLG'] == 0).astype('int64'),
+        'WO_OUTFLOW_CNT': (df['DAILY_OUTFLOW_FLG'] == 0).astype('int64'),
+    }, index=df.index)
+    win = TAG_WINDOW(df[date_col], df_WINDOWS)
+    return WINDOW_SMRY(measures, win, DAYS_WO_TRAN_SMRY_AGG, layout, ACCOUNT_INDEX(df), len(df_WINDOWS))
+
+
+#Function Name: DAY_ORDER
+#Function Description: This function returns the row order sorting the day-level table by account and date, and a flag marking where a new run of consecutive days starts
+#                      A run also breaks on a new account, a gap in the calendar, or where key (e.g. the window index) changes
+def DAY_ORDER(df, date_col, key=None):
+    acct_code = pd.factorize(df['ACCT_ID'])[0]
+    days = np.asarray(df[date_col], dtype='datetime64[D]').astype('int64')
+    order = np.lexsort((days, acct_code))
+    acct_code = acct_code[order]
+    days = days[order]
+    new_run = np.r_[True, (acct_code[1:] != acct_code[:-1]) | (days[1:] - days[:-1] != 1)]
+    if key is not None:
+        key = np.asarray(key)[order]
+        new_run[1:] |= key[1:] != key[:-1]
+    return order, new_run
+
+
+#Function Name: STREAK_LENGTH
+#Function Description: This function returns, for rows already in day order, the length so far of the streak of zero-flag days each row belongs to (0 on a non-zero day)
+#                      A streak ends on a day with a non-zero flag or where new_run is set; there is no state kept between calls
+def STREAK_LENGTH(flag, new_run):
+    zero = flag == 0
+    run_break = new_run | ~zero
+    run_id = np.cumsum(run_break) - 1
+    zero_cnt = np.cumsum(zero)
+    run_start = np.flatnonzero(run_break)
+    return zero_cnt - (zero_cnt[run_start] - zero[run_start])[run_id]
+
+
+#Function Name: BUILD_SEQ_DAYS
+#Function Description: This function generates, for each date, the number of consecutive days up to that date without a transaction of the flag type (0 on a day with one)
+#                      The count restarts for every account, so the result does not depend on the order the accounts come in
+def BUILD_SEQ_DAYS(df, flag_col, date_col='ACCT_BAL_DT'):
+    order, new_run = DAY_ORDER(df, date_col)
+    flag = np.asarray(df[flag_col])[order]
+    seq = np.empty(len(df), dtype='int64')
+    seq[order] = STREAK_LENGTH(flag, new_run)
+    return pd.Series(seq, index=df.index)
+
+
+#Function Name: BUILD_MAX_SEQ_DAYS_WO_TRAN
+#Function Description: This function computes the longest sequence of days without inflow / outflow transactions per account for every window
+#                      A sequence crossing a window edge is clipped to the window; a window holding no days of the account gives NaN
+#                      layout = the features to build, a subset of MAX_SEQ_LAYOUT (all of it by default)
+def BUILD_MAX_SEQ_DAYS_WO_TRAN(df, df_WINDOWS, date_col='ACCT_BAL_DT', layout=MAX_SEQ_LAYOUT):
+    win = TAG_WINDOW(df[date_col], df_WINDOWS)
+    order, new_run = DAY_ORDER(df, date_col, key=win)
+    measures = pd.DataFrame({'ACCT_ID': np.asarray(df['ACCT_ID'])[order]})
+    for name, flag_col, months in layout:
+        measures[flag_col] = STREAK_LENGTH(np.asarray(df[flag_col])[order], new_run)
+    agg = {flag_col: 'max' for name, flag_col, months in layout}
+    return WINDOW_SMRY(measures, win[order], agg, layout, ACCOUNT_INDEX(df), len(df_WINDOWS))
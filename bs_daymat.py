@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Dense account x day store of the day-level inputs of the bank statement scorecard.
+#     * ACCT_BAL (float64) and DAILY_INFLOW_FLG / DAILY_OUTFLOW_FLG (int32 transaction counts) are arrays of shape (accounts, days):
+#       row i is the account ACCT_ID[i] (sorted, looked up with searchsorted), column j is the day START_DT + j.
+#     * The days span the window table, from the start of the oldest window to the end of M1. A day before the account's first
+#       balance record (FIRST_DAY) is not in the account's calendar; its ACCT_BAL is NaN.
+#     * ACCT_BAL carries the last balance forward as BUILD_DAILY_CALENDAR does, seeded with the last record before START_DT.
+#     * Every day-level feature of a window is an axis-1 reduction over the window's column slice: no join, no groupby.
+#       Sums and standard deviations fold the columns in day order as the groupby did, so they are the same bit for bit.
+#     * The store can be written as .npy files and memory-mapped back (SAVE_DAY_MATRIX / LOAD_DAY_MATRIX).
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from bs_daily import MONTHLY_BAL_SMRY_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT, MAX_SEQ_LAYOUT
+from bs_prof import PROFILED
+from bs_window import ALL_WINDOWS, WINDOW_BOUNDS
+
+DAY_MATRIX_ARRAYS = ['ACCT_ID', 'FIRST_DAY', 'ACCT_BAL', 'DAILY_INFLOW_FLG', 'DAILY_OUTFLOW_FLG']
+DAY_MATRIX_META = 'meta.json'
+
+
+#Function Name: BUILD_DAY_MATRIX
+#Function Description: This function builds the account x day store from the day-end balances (raw, or already densified by BUILD_DAILY_CALENDAR)
+#                      and the transactions, over the days of the window table; the accounts are those with a balance record up to the end of M1
+def BUILD_DAY_MATRIX(df_bal, df_tran, df_WINDOWS):
+    starts, ends, order = WINDOW_BOUNDS(df_WINDOWS)
+    start = starts.min().astype('datetime64[D]')
+    end = ends.max().astype('datetime64[D]')
+    n_days = int((end - start).astype('int64')) + 1
+
+    #Balance records up to the end, in account and date order; the first record of a day wins, as in BUILD_DAILY_CALENDAR
+    bal = df_bal.sort_values(['ACCT_ID', 'ACCT_BAL_DT'], kind='stable').drop_duplicates(['ACCT_ID', 'ACCT_BAL_DT'], keep='first')
+    days = np.asarray(bal['ACCT_BAL_DT'], dtype='datetime64[D]')
+    bal = bal[days <= end]
+    days = (days[days <= end] - start).astype('int64')
+    acct = bal['ACCT_ID'].to_numpy(dtype='int64')
+    accounts = np.unique(acct)
+    row = np.searchsorted(accounts, acct)
+    first_day = np.full(len(accounts), n_days, dtype='int64')
+    np.minimum.at(first_day, row, days)
+    first_day = first_day.clip(0)
+
+    #Records before START_DT are moved onto day 0, where the last of them (or a record of day 0 itself) is kept
+    pos = row * n_days + days.clip(0)
+    last = np.diff(pos, append=-1) != 0
+    pos = pos[last]
+    values = bal['ACCT_BAL'].to_numpy(dtype='float64')[last]
+    src = np.full(len(accounts) * n_days, -1, dtype='int64')
+    src[pos] = np.arange(len(pos))
+    src = np.maximum.accumulate(src.reshape(len(accounts), n_days), axis=1)
+    acct_bal = np.where(src >= 0, values[src], np.nan)
+
+    #Transaction counts per account and day, for the accounts and days of the store
+    tran_days = (np.asarray(df_tran['TRAN_DT'], dtype='datetime64[D]') - start).astype('int64')
+    tran_acct = df_tran['ACCT_ID'].to_numpy(dtype='int64')
+    tran_row = np.searchsorted(accounts, tran_acct).clip(0, max(len(accounts) - 1, 0))
+    keep = (tran_days >= 0) & (tran_days < n_days) & (accounts[tran_row] == tran_acct) if len(accounts) else np.zeros(len(df_tran), dtype=bool)
+    tran_pos = tran_row[keep] * n_days + tran_days[keep]
+    store = {'START_DT': start, 'ACCT_ID': accounts, 'FIRST_DAY': first_day, 'ACCT_BAL': acct_bal}
+    for flag_col, amount_col in [('DAILY_INFLOW_FLG', 'INFLOW_TRAN_AMT_HKD'), ('DAILY_OUTFLOW_FLG', 'OUTFLOW_TRAN_AMT_HKD')]:
+        counts = np.bincount(tran_pos, weights=(df_tran[amount_col].to_numpy()[keep] > 0), minlength=len(accounts) * n_days)
+        store[flag_col] = counts.astype('int32').reshape(len(accounts), n_days)
+    return store
+
+
+#Function Name: SAVE_DAY_MATRIX
+#Function Description: This function writes the store into store_dir, one .npy file per array plus a meta.json holding START_DT
+def SAVE_DAY_MATRIX(store, store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    for name in DAY_MATRIX_ARRAYS:
+        np.save(os.path.join(store_dir, name + '.npy'), store[name])
+    with open(os.path.join(store_dir, DAY_MATRIX_META), 'w') as f:
+        json.dump({'START_DT': str(store['START_DT'])}, f)
+
+
+#Function Name: LOAD_DAY_MATRIX
+#Function Description: This function maps a store written by SAVE_DAY_MATRIX; the arrays are read-only memory maps, paged in as the reductions touch them
+def LOAD_DAY_MATRIX(store_dir):
+    with open(os.path.join(store_dir, DAY_MATRIX_META)) as f:
+        store = {'START_DT': np.datetime64(json.load(f)['START_DT'], 'D')}
+    for name in DAY_MATRIX_ARRAYS:
+        store[name] = np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r')
+    return store
+
+
+#Function Name: LONGEST_ZERO_RUN
+#Function Description: This function returns, per row, the longest run of consecutive True values of a boolean matrix
+def LONGEST_ZERO_RUN(zero):
+    count = np.cumsum(zero, axis=1)
+    #count at the last non-zero day so far, so count - reset is the length of the current run
+    reset = np.maximum.accumulate(np.where(zero, 0, count), axis=1)
+    return (count - reset).max(axis=1, initial=0)
+
+
+#Function Name: SUM_COLS / STD_COLS
+#Function Description: These functions return, per row, the sum and the sample standard deviation of a matrix, NaN skipped
+#                      The columns are folded in day order with vector operations over the accounts: a compensated sum and Welford updates,
+#                      the same steps as the groupby sum / std over the long daily table, so the results are the same bit for bit
+def SUM_COLS(values):
+    total = np.zeros(len(values))
+    carry = np.zeros(len(values))
+    for j in range(values.shape[1]):
+        value = values[:, j]
+        ok = ~np.isnan(value)
+        y = value - carry
+        t = total + y
+        carry = np.where(ok, t - total - y, carry)
+        total = np.where(ok, t, total)
+    return total
+
+
+def STD_COLS(values):
+    n = np.zeros(len(values))
+    mean = np.zeros(len(values))
+    m2 = np.zeros(len(values))
+    for j in range(values.shape[1]):
+        value = values[:, j]
+        ok = ~np.isnan(value)
+        n_new = n + ok
+        mean_new = mean + np.where(ok, (value - mean) / np.maximum(n_new, 1), 0.0)
+        m2 = m2 + np.where(ok, (value - mean_new) * (value - mean), 0.0)
+        n, mean = n_new, mean_new
+    return np.where(n > 1, np.sqrt(m2 / np.maximum(n - 1, 1)), np.nan)
+
+
+#Function Name: DAY_MATRIX_MEASURE
+#Function Description: This function reduces one measure over the day columns first:last (inclusive) of the store, one value per account
+#                      The measures are those of the day-level layouts of bs_daily; days outside an account's calendar are skipped,
+#                      and a window holding none of the account's days gives 0 for the counts and NaN otherwise
+def DAY_MATRIX_MEASURE(store, measure, first, last):
+    cols = slice(first, last + 1)
+    in_calendar = np.arange(first, last + 1) >= np.asarray(store['FIRST_DAY'])[:, None]
+    n_cal = in_calendar.sum(axis=1)
+    if measure in ('BAL_SUM', 'BAL_MIN', 'NEG_BAL_CNT', 'BAL_STD'):
+        bal = np.asarray(store['ACCT_BAL'][:, cols])
+        if measure == 'BAL_SUM':
+            return SUM_COLS(bal)
+        if measure == 'NEG_BAL_CNT':
+            return (bal <= 0).sum(axis=1)
+        if measure == 'BAL_MIN':
+            return np.fmin.reduce(bal, axis=1)
+        return STD_COLS(bal)
+    flag_col = {'WO_INFLOW_CNT': 'DAILY_INFLOW_FLG', 'WO_OUTFLOW_CNT': 'DAILY_OUTFLOW_FLG'}.get(measure, measure)
+    if flag_col not in ('DAILY_INFLOW_FLG', 'DAILY_OUTFLOW_FLG'):
+        raise ValueError('unknown day-level measure ' + repr(measure))
+    zero = in_calendar & (np.asarray(store[flag_col][:, cols]) == 0)
+    if measure != flag_col:
+        return zero.sum(axis=1)
+    #Longest streak of days without a transaction, clipped to the window (the streak measure of MAX_SEQ_LAYOUT)
+    streak = LONGEST_ZERO_RUN(zero)
+    return streak if (n_cal > 0).all() else np.where(n_cal > 0, streak, np.nan)
+
+
+#Function Name: DAY_MATRIX_SMRY
+#Function Description: This function lays the day-level features of the store out as one wide row per account, like bs_window.WINDOW_SMRY
+#                      layout = entries of MONTHLY_BAL_SMRY_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT and / or MAX_SEQ_LAYOUT; every window must lie within the store's days
+def DAY_MATRIX_SMRY(store, df_WINDOWS, layout):
+    start = store['START_DT']
+    n_days = store['ACCT_BAL'].shape[1]
+    first = (np.asarray(df_WINDOWS['START_DT'], dtype='datetime64[D]') - start).astype('int64')
+    last = (np.asarray(df_WINDOWS['END_DT'], dtype='datetime64[D]') - start).astype('int64')
+    if (first < 0).any() or (last >= n_days).any():
+        raise ValueError('the windows are not within the days of the day matrix')
+    accounts = pd.Index(np.asarray(store['ACCT_ID']), name='ACCT_ID')
+    columns = {}
+    for name, measure, months in layout:
+        if months == ALL_WINDOWS:
+            months = range(1, len(df_WINDOWS) + 1)
+        for m in months:
+            columns[name + '_M' + str(m)] = DAY_MATRIX_MEASURE(store, measure, first[m - 1], last[m - 1])
+    return pd.DataFrame(columns, index=accounts)
+
+
+#Function Name: BUILD_DAY_SMRY
+#Function Description: This function returns the three day-level summaries of the scorecard from the store:
+#                      (df_MONTHLY_BAL_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2), in the column layout of bs_daily
+def BUILD_DAY_SMRY(store, df_WINDOWS):
+    return tuple(PROFILED(stage, DAY_MATRIX_SMRY, store, df_WINDOWS, layout)
+                 for stage, layout in [('MONTHLY_BAL_SMRY', MONTHLY_BAL_SMRY_LAYOUT), ('MAX_SEQ_DAYS_WO_TRAN', MAX_SEQ_LAYOUT), ('DAYS_WO_TRAN', DAYS_WO_TRAN_SMRY_LAYOUT)])
@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Incremental daily rescoring of the bank statement scorecard, from mergeable per-window aggregates.
+#     * The state holds, per account, one slot of aggregates for every window of the window grid (M1 to Mn) plus an open slot for the days after M1:
+#         * transactions: compensated sums, counts and maxima of the measures of bs_tran_smry and the latest inflow date, plus a Welford state
+#           of the slot's amounts (the outlier thresholds are taken over the transactions of the windows)
+#         * day-end balances, folded day by day into the slot of the day: compensated sum, minimum, negative balance days, Welford (n, mean, m2)
+#           for DAILY_BAL_STD, days in the account's calendar, days without inflow / outflow and the open and longest streaks of them (MAX_SEQ_*)
+#         * the counterparty sums of the slot (bs_cpty), and the compensated sums of all its positive inflow / outflow amounts the shares are taken of
+#         * its positive amounts: an outlier count cannot be kept as a sum,
+#           as the threshold moves with the windows, so the amounts are counted against it when the state is scored
+#       and, per account, the carried day-end balance and the first balance day, and the account master.
+#     * A daily batch only folds its own rows and days into the open slot: its cost is its rows plus one vector step over the accounts per day,
+#       whatever the length of the history. Only the first batch (the history up to the first as-of date) is folded into all the windows.
+#     * When the open slot is complete (rule 'days': window_days days after the end of M1; rule 'month': the calendar month after M1), the windows
+#       roll forward: the open slot becomes M1, every slot moves one window back and Mn is evicted with everything it held.
+#       The state is scored for the windows of its last complete window (AS_OF); the days of the open slot count once it is complete.
+#     * Every aggregate folds the rows and days in the order of a full run, with the same compensated steps as the grouped sums and bs_daymat,
+#       so SCORE_INCR_STATE equals bs_pipeline.SCORE_ACCOUNTS on the same rows bit for bit (CHECK_INCR_STATE).
+#     * Only the global outlier thresholds (mean + 2.5 * stddev) are supported, not the per-account ones.
+#
+# Usage: python bs_incr.py update <state_dir> <tran.csv> <bal.csv> <as-of MM/DD/YYYY> [-o output] [--windows N] [--window-days N] [--window-rule days|month] [--amounts float32|float64|minor]
+#        python bs_incr.py check <statement folder> --as-of MM/DD/YYYY [--days N] [--windows N] [--window-days N] [--window-rule days|month] [--amounts float32|float64|minor]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bs_cache import SAVE_FRAME, LOAD_FRAME
+from bs_cpty import CPTY_COL, CPTY_KEYS, CPTY_AMOUNT_COLS, CPTY_SHARES
+from bs_daily import MONTHLY_BAL_SMRY_LAYOUT, MAX_SEQ_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT
+from bs_ingest import BS_TRAN_FILE, BS_ACCT_BAL_FILE, BS_TRAN_SCHEMA, BS_ACCT_BAL_SCHEMA, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES
+from bs_ingest import AMOUNT_SCHEMA, CONCAT_TYPED, READ_BS_TRAN, READ_BS_ACCT_BAL
+from bs_pipeline import ACCT_KEY_COLS, AMOUNT_COLS, OUTLIER_STD_MULT, OUTLIER_THRESHOLDS, SCORE_ACCOUNTS
+from bs_recur import SET_RECURRENT_FLAGS
+from bs_stats import WELFORD_EMPTY, WELFORD_STATE, WELFORD_MERGE, WELFORD_MEAN, WELFORD_STD
+from bs_tran_smry import TRAN_SMRY_MEASURES, TRAN_SMRY_AGG, TRAN_SMRY_LAYOUT, TRAN_SMRY_MAJOR_UNITS
+from bs_window import ALL_WINDOWS, BUILD_WINDOWS, TAG_WINDOW, WINDOW_SMRY, ACCOUNT_INDEX
+from bs_write import WRITE_FRAME
+
+#Transaction measures of a slot (bs_tran_smry.TRAN_SMRY_MEASURES), by how they are folded; the outlier counts are counted at scoring
+INCR_TRAN_SUMS = ['REV_AMT', 'INFLOW_AMT', 'OUTFLOW_AMT', 'RECUR_INFLOW_AMT', 'RECUR_OUTFLOW_AMT']
+INCR_TRAN_COUNTS = ['INFLOW_CNT', 'OUTFLOW_CNT', 'TRAN_CNT', 'RECUR_INFLOW_CNT', 'RECUR_OUTFLOW_CNT']
+INCR_TRAN_MAXIMA = ['INFLOW_MAX', 'OUTFLOW_MAX']
+#Day-level aggregates of a slot: (dtype, initial value); BAL_COMP is the compensation of BAL_SUM, BAL_N / BAL_MEAN / BAL_M2 the Welford state of the balances
+INCR_DAY_SLOTS = {
+    'BAL_SUM': ('float64', 0.0), 'BAL_COMP': ('float64', 0.0), 'BAL_MIN': ('float64', np.nan), 'NEG_BAL_CNT': ('int64', 0),
+    'BAL_N': ('float64', 0.0), 'BAL_MEAN': ('float64', 0.0), 'BAL_M2': ('float64', 0.0), 'CAL_CNT': ('int64', 0),
+    'WO_INFLOW_CNT': ('int64', 0), 'WO_OUTFLOW_CNT': ('int64', 0),
+    'INFLOW_RUN': ('int64', 0), 'INFLOW_MAX_RUN': ('int64', 0), 'OUTFLOW_RUN': ('int64', 0), 'OUTFLOW_MAX_RUN': ('int64', 0),
+}
+#Day-level measures of bs_daily's layouts -> the streak aggregates they are read from
+INCR_STREAKS = {'DAILY_INFLOW_FLG': 'INFLOW', 'DAILY_OUTFLOW_FLG': 'OUTFLOW'}
+#First balance day of an account without any balance record yet
+NO_DAY = np.iinfo('int64').max
+NAT = np.iinfo('int64').min
+INCR_META = 'state.json'
+
+
+#Function Name: EMPTY_INCR_STATE
+#Function Description: This function returns the state of an incremental run before any data has been added, for the window settings of bs_window.BUILD_WINDOWS
+def EMPTY_INCR_STATE(n_windows=6, window_days=30, rule='days'):
+    if rule not in ('days', 'month'):
+        raise ValueError("unknown window rule " + repr(rule) + ", expected 'days' or 'month'")
+    return {'N_WINDOWS': n_windows, 'WINDOW_DAYS': window_days, 'RULE': rule, 'AS_OF': None, 'LAST_DAY': None,
+            'AMOUNT_DTYPE': None, 'TRAN_DT_DTYPE': None, 'HAS_CPTY': None, 'ACCT_MAST': None,
+            'ACCT_ID': np.zeros(0, dtype='int64'), 'FIRST_DAY': np.zeros(0, dtype='int64'), 'CARRY_BAL': np.zeros(0, dtype='float64'),
+            'SLOTS': {}, 'INFLOW_STATS': [WELFORD_EMPTY] * (n_windows + 1), 'OUTFLOW_STATS': [WELFORD_EMPTY] * (n_windows + 1),
+            'AMOUNTS': [[] for _ in range(n_windows + 1)], 'CPTY': {name: [] for name in CPTY_AMOUNT_COLS}}
+
+
+#Function Name: SLOT_SPECS
+#Function Description: This function returns the (dtype, initial value) of every per-account slot aggregate of the state
+#                      The transaction sums and maxima are held in the dtype of the amounts, as the grouped sums and maxima of a full run are;
+#                      the counterparty totals (CPTY_*) in float64, as bs_cpty sums them
+def SLOT_SPECS(state):
+    dtype = np.dtype(state['AMOUNT_DTYPE'])
+    specs = {}
+    for name in INCR_TRAN_SUMS:
+        specs[name] = (dtype, 0)
+        specs['COMP_' + name] = (dtype, 0)
+    for name in INCR_TRAN_COUNTS + ['ROWS']:
+        specs[name] = ('int64', 0)
+    for name in INCR_TRAN_MAXIMA:
+        specs[name] = (dtype, np.iinfo(dtype).min if dtype.kind == 'i' else np.nan)
+    specs['LAST_INFLOW_DT'] = ('int64', NAT)
+    for name in CPTY_AMOUNT_COLS:
+        specs['CPTY_' + name] = ('float64', 0.0)
+        specs['COMP_CPTY_' + name] = ('float64', 0.0)
+    specs.update(INCR_DAY_SLOTS)
+    return specs
+
+
+#Function Name: EMPTY_CPTY_SLOT / EMPTY_AMOUNTS
+#Function Description: These functions return the empty counterparty sums and positive amounts of a slot
+def EMPTY_CPTY_SLOT():
+    return pd.DataFrame({'ACCT_ID': np.zeros(0, dtype='int64'), CPTY_COL: np.zeros(0, dtype=object),
+                         'SUM': np.zeros(0, dtype='float64'), 'COMP': np.zeros(0, dtype='float64')})
+
+
+def EMPTY_AMOUNTS(state):
+    return pd.DataFrame({'ACCT_ID': np.zeros(0, dtype='int64')} | {col: np.zeros(0, dtype=state['AMOUNT_DTYPE']) for col in AMOUNT_COLS})
+
+
+#Function Name: NEXT_WINDOW_END
+#Function Description: This function returns the end of the window after the one ending on as_of: window_days days later, or the end of the next calendar month
+def NEXT_WINDOW_END(as_of, window_days, rule):
+    if rule == 'days':
+        return as_of + pd.Timedelta(days=window_days)
+    return as_of + pd.Timedelta(days=1) + pd.offsets.MonthEnd(0)
+
+
+#Function Name: INCR_WINDOWS / INCR_SLOTS
+#Function Description: These functions return the window table of the state (M1 ending on AS_OF), and the window table of its slots: the open window, then M1 to Mn
+def INCR_WINDOWS(state):
+    return BUILD_WINDOWS(state['AS_OF'], state['N_WINDOWS'], state['WINDOW_DAYS'], state['RULE'])
+
+
+def INCR_SLOTS(state):
+    start = state['AS_OF'] + pd.Timedelta(days=1)
+    end = NEXT_WINDOW_END(state['AS_OF'], state['WINDOW_DAYS'], state['RULE'])
+    open_window = pd.DataFrame({'START_DT': [start], 'END_DT': [end], 'DAYS': [(end - start).days + 1]}, index=pd.Index(['OPEN'], name='WINDOW'))
+    return pd.concat([open_window, INCR_WINDOWS(state)])
+
+
+#Function Name: DAY_NUMBER
+#Function Description: This function returns dates as int64 day numbers (days since 1970-01-01)
+def DAY_NUMBER(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype('int64')
+
+
+#Function Name: ACCOUNT_ROWS
+#Function Description: This function returns the rows of the accounts in the per-account arrays of the state, adding rows for the accounts not seen yet
+def ACCOUNT_ROWS(state, acct_ids):
+    ids = np.asarray(acct_ids, dtype='int64')
+    rows = pd.Index(state['ACCT_ID']).get_indexer(ids)
+    if (rows < 0).any():
+        new = pd.unique(ids[rows < 0])
+        state['ACCT_ID'] = np.concatenate([state['ACCT_ID'], new])
+        state['FIRST_DAY'] = np.concatenate([state['FIRST_DAY'], np.full(len(new), NO_DAY, dtype='int64')])
+        state['CARRY_BAL'] = np.concatenate([state['CARRY_BAL'], np.full(len(new), np.nan)])
+        for name, (dtype, init) in SLOT_SPECS(state).items():
+            state['SLOTS'][name] = np.concatenate([state['SLOTS'][name], np.full((state['N_WINDOWS'] + 1, len(new)), init, dtype=dtype)], axis=1)
+        rows = pd.Index(state['ACCT_ID']).get_indexer(ids)
+    return rows
+
+
+#Function Name: KAHAN_ADD
+#Function Description: This function adds values into the compensated sums total / comp (flat arrays) at the positions group, row after row in order,
+#                      with the steps of pandas' grouped sum (NaN values skipped); the k-th values of all the groups are added in one vector step
+def KAHAN_ADD(total, comp, group, values):
+    if len(group) == 0:
+        return
+    if total.dtype.kind == 'i':
+        np.add.at(total, group, values)
+        return
+    rank = pd.Series(group).groupby(group, sort=False).cumcount().to_numpy()
+    order = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[order], np.arange(rank.max() + 2))
+    for r in range(rank.max() + 1):
+        pick = order[bounds[r]:bounds[r + 1]]
+        g = group[pick]
+        v = values[pick]
+        ok = ~np.isnan(v)
+        y = v - comp[g]
+        t = total[g] + y
+        c = t - total[g] - y
+        comp[g] = np.where(ok, np.where(np.isnan(c), 0, c), comp[g])
+        total[g] = np.where(ok, t, total[g])
+
+
+#Function Name: FOLD_CPTY
+#Function Description: This function adds the positive amounts of a slot's transactions to the slot's counterparty sums (CPTY_AMOUNTS of bs_cpty, per slot)
+#                      New counterparties are appended in order of first appearance, as the groups of the full run's grouped sum
+def FOLD_CPTY(slot, acct_ids, cpty, amounts):
+    if len(amounts) == 0:
+        return slot
+    keys = pd.MultiIndex.from_arrays([acct_ids, cpty])
+    pos = pd.MultiIndex.from_arrays([slot['ACCT_ID'].to_numpy(), slot[CPTY_COL].to_numpy()]).get_indexer(keys)
+    if (pos < 0).any():
+        new = keys[pos < 0].unique()
+        slot = pd.concat([slot, pd.DataFrame({'ACCT_ID': new.get_level_values(0).to_numpy(dtype='int64'), CPTY_COL: np.asarray(new.get_level_values(1), dtype=object),
+                                              'SUM': 0.0, 'COMP': 0.0})], ignore_index=True)
+        pos = pd.MultiIndex.from_arrays([slot['ACCT_ID'].to_numpy(), slot[CPTY_COL].to_numpy()]).get_indexer(keys)
+    total = slot['SUM'].to_numpy(copy=True)
+    comp = slot['COMP'].to_numpy(copy=True)
+    KAHAN_ADD(total, comp, pos, amounts)
+    return slot.assign(SUM=total, COMP=comp)
+
+
+#Function Name: FOLD_TRANSACTIONS
+#Function Description: This function folds transactions into the slots they fall in (win = slot of every row, -1 = before the windows, not folded)
+#                      rows = the rows of their accounts in the state
+def FOLD_TRANSACTIONS(state, df, rows, win):
+    keep = win >= 0
+    df, rows, win = df[keep], rows[keep], win[keep]
+    if len(df) == 0:
+        return
+    n_accounts = len(state['ACCT_ID'])
+    slots = state['SLOTS']
+    group = win * n_accounts + rows
+    measures = TRAN_SMRY_MEASURES(df, np.inf, np.inf)
+    for name in INCR_TRAN_SUMS:
+        KAHAN_ADD(slots[name].reshape(-1), slots['COMP_' + name].reshape(-1), group, measures[name].to_numpy())
+    for name in INCR_TRAN_COUNTS:
+        np.add.at(slots[name].reshape(-1), group, measures[name].to_numpy())
+    np.add.at(slots['ROWS'].reshape(-1), group, 1)
+    for name in INCR_TRAN_MAXIMA:
+        maximum = np.maximum if slots[name].dtype.kind == 'i' else np.fmax
+        maximum.at(slots[name].reshape(-1), group, measures[name].to_numpy())
+    inflow_day = np.where(measures['INFLOW_CNT'].to_numpy() > 0, df['TRAN_DT'].to_numpy().view('int64'), NAT)
+    np.maximum.at(slots['LAST_INFLOW_DT'].reshape(-1), group, inflow_day)
+    if state['HAS_CPTY']:
+        for name, col in CPTY_AMOUNT_COLS.items():
+            amount = df[col].to_numpy(dtype='float64')
+            KAHAN_ADD(slots['CPTY_' + name].reshape(-1), slots['COMP_CPTY_' + name].reshape(-1), group[amount > 0], amount[amount > 0])
+
+    positive = (df[AMOUNT_COLS] > 0).any(axis=1).to_numpy()
+    for s in np.unique(win):
+        in_slot = win == s
+        for stats, col in [('INFLOW_STATS', 'INFLOW_TRAN_AMT_HKD'), ('OUTFLOW_STATS', 'OUTFLOW_TRAN_AMT_HKD')]:
+            state[stats][s] = WELFORD_MERGE(state[stats][s], WELFORD_STATE(df[col].to_numpy()[in_slot]))
+        state['AMOUNTS'][s].append(df.loc[in_slot & positive, ['ACCT_ID'] + AMOUNT_COLS].reset_index(drop=True))
+        if state['HAS_CPTY']:
+            for name, col in CPTY_AMOUNT_COLS.items():
+                amount = df[col].to_numpy(dtype='float64')
+                pick = in_slot & (amount > 0) & df[CPTY_COL].notna().to_numpy()
+                state['CPTY'][name][s] = FOLD_CPTY(state['CPTY'][name][s], df['ACCT_ID'].to_numpy()[pick], np.asarray(df[CPTY_COL])[pick], amount[pick])
+
+
+#Function Name: FOLD_DAY
+#Function Description: This function folds one day into slot s: the day's balance records (first of the day per account) and whether every account had an inflow / outflow
+#                      The day-end balance of an account is its record of the day or its carried balance; the steps are those of bs_daymat.SUM_COLS / STD_COLS
+def FOLD_DAY(state, s, day, bal_rows, bal_values, has_inflow, has_outflow):
+    state['CARRY_BAL'][bal_rows] = bal_values
+    state['FIRST_DAY'][bal_rows] = np.minimum(state['FIRST_DAY'][bal_rows], day)
+    value = state['CARRY_BAL']
+    in_calendar = state['FIRST_DAY'] <= day
+    slots = {name: slot[s] for name, slot in state['SLOTS'].items()}
+
+    ok = ~np.isnan(value)
+    total, comp = slots['BAL_SUM'], slots['BAL_COMP']
+    y = value - comp
+    t = total + y
+    comp[:] = np.where(ok, t - total - y, comp)
+    total[:] = np.where(ok, t, total)
+    slots['BAL_MIN'][:] = np.fmin(slots['BAL_MIN'], value)
+    slots['NEG_BAL_CNT'] += value <= 0
+    n, mean = slots['BAL_N'], slots['BAL_MEAN']
+    n_new = n + ok
+    mean_new = mean + np.where(ok, (value - mean) / np.maximum(n_new, 1), 0.0)
+    slots['BAL_M2'][:] = slots['BAL_M2'] + np.where(ok, (value - mean_new) * (value - mean), 0.0)
+    n[:] = n_new
+    mean[:] = mean_new
+    slots['CAL_CNT'] += in_calendar
+
+    for flow, has_flow in [('INFLOW', has_inflow), ('OUTFLOW', has_outflow)]:
+        zero = in_calendar & ~has_flow
+        slots['WO_' + flow + '_CNT'] += zero
+        run = np.where(zero, slots[flow + '_RUN'] + 1, 0)
+        slots[flow + '_RUN'][:] = run
+        slots[flow + '_MAX_RUN'][:] = np.maximum(slots[flow + '_MAX_RUN'], run)
+
+
+#Function Name: ROLL_INCR_STATE
+#Function Description: This function rolls the windows forward once the open slot is complete: the open slot becomes M1, every slot moves one window back
+#                      and Mn is evicted; the open slot's amounts are concatenated once
+def ROLL_INCR_STATE(state):
+    n_accounts = len(state['ACCT_ID'])
+    for name, (dtype, init) in SLOT_SPECS(state).items():
+        state['SLOTS'][name] = np.concatenate([np.full((1, n_accounts), init, dtype=dtype), state['SLOTS'][name][:-1]])
+    for stats in ['INFLOW_STATS', 'OUTFLOW_STATS']:
+        state[stats] = [WELFORD_EMPTY] + state[stats][:-1]
+    state['AMOUNTS'] = [[EMPTY_AMOUNTS(state)], [pd.concat(state['AMOUNTS'][0], ignore_index=True)]] + state['AMOUNTS'][1:-1]
+    for name in state['CPTY']:
+        state['CPTY'][name] = [EMPTY_CPTY_SLOT()] + state['CPTY'][name][:-1]
+    state['AS_OF'] = NEXT_WINDOW_END(state['AS_OF'], state['WINDOW_DAYS'], state['RULE'])
+
+
+#Function Name: START_INCR_STATE
+#Function Description: This function sets the window grid of an empty state from the first batch: M1 ends on the as-of date (rule 'days')
+#                      or is the last month completed on it (rule 'month'); the days before the start of Mn are not folded,
+#                      only the last balance record of every account before it is carried into the windows
+def START_INCR_STATE(state, df_tran, df_bal, as_of):
+    df_WINDOWS = BUILD_WINDOWS(as_of, state['N_WINDOWS'], state['WINDOW_DAYS'], state['RULE'])
+    state['AS_OF'] = df_WINDOWS.loc['M1', 'END_DT']
+    state['LAST_DAY'] = df_WINDOWS['START_DT'].min() - pd.Timedelta(days=1)
+    state['AMOUNT_DTYPE'] = str(df_tran['INFLOW_TRAN_AMT_HKD'].dtype)
+    state['TRAN_DT_DTYPE'] = str(df_tran['TRAN_DT'].dtype)
+    state['HAS_CPTY'] = CPTY_COL in df_tran
+    state['SLOTS'] = {name: np.zeros((state['N_WINDOWS'] + 1, 0), dtype=dtype) for name, (dtype, init) in SLOT_SPECS(state).items()}
+    state['AMOUNTS'] = [[EMPTY_AMOUNTS(state)] for _ in range(state['N_WINDOWS'] + 1)]
+    state['CPTY'] = {name: [EMPTY_CPTY_SLOT() for _ in range(state['N_WINDOWS'] + 1)] for name in CPTY_AMOUNT_COLS}
+
+    before = df_bal[df_bal['ACCT_BAL_DT'] <= state['LAST_DAY']].sort_values(['ACCT_ID', 'ACCT_BAL_DT'], kind='stable')
+    before = before.drop_duplicates(['ACCT_ID', 'ACCT_BAL_DT'], keep='first')
+    first = before.drop_duplicates('ACCT_ID', keep='first')
+    last = before.drop_duplicates('ACCT_ID', keep='last')
+    rows = ACCOUNT_ROWS(state, last['ACCT_ID'])
+    state['CARRY_BAL'][rows] = last['ACCT_BAL'].to_numpy(dtype='float64')
+    state['FIRST_DAY'][ACCOUNT_ROWS(state, first['ACCT_ID'])] = DAY_NUMBER(first['ACCT_BAL_DT'])
+
+
+#Function Name: UPDATE_INCR_STATE
+#Function Description: This function adds a batch of new transactions and day-end balances up to as_of_dt to the state (updated in place and returned)
+#                      The batch must only hold days after the last day already in the state, up to as_of_dt; the days in between without rows are folded too
+#                      Every time the open slot is complete, the windows roll forward (ROLL_INCR_STATE)
+def UPDATE_INCR_STATE(state, df_tran, df_bal, as_of_dt):
+    as_of = pd.to_datetime(as_of_dt).normalize()
+    if state['LAST_DAY'] is not None:
+        if as_of < state['LAST_DAY']:
+            raise ValueError('the as-of date cannot move backwards')
+        if (df_tran['TRAN_DT'] <= state['LAST_DAY']).any() or (df_bal['ACCT_BAL_DT'] <= state['LAST_DAY']).any():
+            raise ValueError('the batch holds days already in the state')
+    if (df_tran['TRAN_DT'] > as_of).any() or (df_bal['ACCT_BAL_DT'] > as_of).any():
+        raise ValueError('the batch holds days after the as-of date')
+    if state['AS_OF'] is None:
+        START_INCR_STATE(state, df_tran, df_bal, as_of)
+    elif str(df_tran['INFLOW_TRAN_AMT_HKD'].dtype) != state['AMOUNT_DTYPE']:
+        raise ValueError('the batch amounts are ' + str(df_tran['INFLOW_TRAN_AMT_HKD'].dtype) + ', the state holds ' + state['AMOUNT_DTYPE'])
+
+    acct_mast = df_tran[ACCT_KEY_COLS] if state['ACCT_MAST'] is None else CONCAT_TYPED([state['ACCT_MAST'], df_tran[ACCT_KEY_COLS]])
+    state['ACCT_MAST'] = acct_mast.drop_duplicates().sort_values(ACCT_KEY_COLS).reset_index(drop=True)
+
+    #The batch rows from the first day to fold on, in their order; balance records: the first of the day per account
+    tran = df_tran[df_tran['TRAN_DT'] > state['LAST_DAY']]
+    tran_days = DAY_NUMBER(tran['TRAN_DT'])
+    tran_rows = ACCOUNT_ROWS(state, tran['ACCT_ID'])
+    bal = df_bal[df_bal['ACCT_BAL_DT'] > state['LAST_DAY']].drop_duplicates(['ACCT_ID', 'ACCT_BAL_DT'], keep='first')
+    bal_days = DAY_NUMBER(bal['ACCT_BAL_DT'])
+    bal_order = np.argsort(bal_days, kind='stable')
+    bal_days = bal_days[bal_order]
+    bal_rows = ACCOUNT_ROWS(state, bal['ACCT_ID'])[bal_order]
+    bal_values = bal['ACCT_BAL'].to_numpy(dtype='float64')[bal_order]
+    tran_order = np.argsort(tran_days, kind='stable')
+    inflow = (tran['INFLOW_TRAN_AMT_HKD'] > 0).to_numpy()[tran_order]
+    outflow = (tran['OUTFLOW_TRAN_AMT_HKD'] > 0).to_numpy()[tran_order]
+    flag_days, flag_rows = tran_days[tran_order], tran_rows[tran_order]
+
+    #Fold up to the end of the open slot, roll, and go on until the as-of date
+    last = DAY_NUMBER([state['LAST_DAY']])[0]
+    end = DAY_NUMBER([as_of])[0]
+    while last < end:
+        df_SLOTS = INCR_SLOTS(state)
+        segment_end = min(end, DAY_NUMBER([df_SLOTS['END_DT'].iloc[0]])[0])
+        in_segment = (tran_days > last) & (tran_days <= segment_end)
+        FOLD_TRANSACTIONS(state, tran[in_segment], tran_rows[in_segment], TAG_WINDOW(tran['TRAN_DT'][in_segment], df_SLOTS))
+        days = np.arange(last + 1, segment_end + 1)
+        day_slots = TAG_WINDOW(days.astype('datetime64[D]'), df_SLOTS)
+        n_accounts = len(state['ACCT_ID'])
+        for day, s in zip(days, day_slots):
+            lo, hi = np.searchsorted(bal_days, [day, day + 1])
+            f_lo, f_hi = np.searchsorted(flag_days, [day, day + 1])
+            has_inflow = np.zeros(n_accounts, dtype=bool)
+            has_outflow = np.zeros(n_accounts, dtype=bool)
+            has_inflow[flag_rows[f_lo:f_hi][inflow[f_lo:f_hi]]] = True
+            has_outflow[flag_rows[f_lo:f_hi][outflow[f_lo:f_hi]]] = True
+            FOLD_DAY(state, s, day, bal_rows[lo:hi], bal_values[lo:hi], has_inflow, has_outflow)
+        last = segment_end
+        state['LAST_DAY'] = pd.Timestamp(np.datetime64(int(last), 'D'))
+        if last == DAY_NUMBER([df_SLOTS['END_DT'].iloc[0]])[0]:
+            ROLL_INCR_STATE(state)
+    return state
+
+
+#Function Name: INCR_THRESHOLDS
+#Function Description: This function returns the inflow / outflow outlier thresholds of the state: mean + 2.5 * stddev of the transactions of the windows M1 to Mn
+def INCR_THRESHOLDS(state):
+    thresholds = []
+    for stats in ['INFLOW_STATS', 'OUTFLOW_STATS']:
+        merged = WELFORD_EMPTY
+        for s in range(1, state['N_WINDOWS'] + 1):
+            merged = WELFORD_MERGE(merged, state[stats][s])
+        thresholds.append(WELFORD_MEAN(merged) + OUTLIER_STD_MULT * WELFORD_STD(merged))
+    return tuple(thresholds)
+
+
+#Function Name: INCR_TRAN_SMRY
+#Function Description: This function builds the transaction summary (bs_tran_smry.BUILD_MONTHLY_TRAN_SMRY) from the slots of the windows
+#                      The aggregates of every (account, window) with transactions are laid out by WINDOW_SMRY as one row each, which leaves them unchanged
+def INCR_TRAN_SMRY(state, accounts, inflow_threshold, outflow_threshold):
+    n_windows = state['N_WINDOWS']
+    slots = state['SLOTS']
+    index = pd.Index(state['ACCT_ID'])
+    win, rows = np.nonzero(slots['ROWS'][1:] > 0)
+    measures = {'ACCT_ID': state['ACCT_ID'][rows]}
+    for name in INCR_TRAN_SUMS + INCR_TRAN_COUNTS + INCR_TRAN_MAXIMA:
+        measures[name] = slots[name][1:][win, rows]
+    measures['LAST_INFLOW_DT'] = slots['LAST_INFLOW_DT'][1:][win, rows].view(state['TRAN_DT_DTYPE'])
+
+    #Outliers counted on the kept amounts against the thresholds of the windows, as the comparison of TRAN_SMRY_MEASURES does
+    for name, col, threshold in [('OUTLIER_INFLOW_CNT', 'INFLOW_TRAN_AMT_HKD', inflow_threshold), ('OUTLIER_OUTFLOW_CNT', 'OUTFLOW_TRAN_AMT_HKD', outflow_threshold)]:
+        counts = np.zeros((n_windows, len(index)), dtype='int64')
+        for s in range(1, n_windows + 1):
+            amounts = pd.concat(state['AMOUNTS'][s], ignore_index=True)
+            np.add.at(counts[s - 1], index.get_indexer(amounts['ACCT_ID']), (amounts[col] > threshold).to_numpy())
+        measures[name] = counts[win, rows]
+    df_MONTHLY_TRAN_SMRY = WINDOW_SMRY(pd.DataFrame(measures), win, TRAN_SMRY_AGG, TRAN_SMRY_LAYOUT, accounts, n_windows)
+    return TRAN_SMRY_MAJOR_UNITS(df_MONTHLY_TRAN_SMRY) if np.dtype(state['AMOUNT_DTYPE']).kind == 'i' else df_MONTHLY_TRAN_SMRY
+
+
+#Function Name: INCR_DAY_MEASURE
+#Function Description: This function returns one day-level measure of window m (1 = M1) for the given account rows, as bs_daymat.DAY_MATRIX_MEASURE does
+def INCR_DAY_MEASURE(state, measure, m, rows):
+    slots = {name: slot[m][rows] for name, slot in state['SLOTS'].items()}
+    if measure == 'BAL_SUM':
+        return slots['BAL_SUM']
+    if measure == 'BAL_MIN':
+        return slots['BAL_MIN']
+    if measure == 'NEG_BAL_CNT':
+        return slots['NEG_BAL_CNT']
+    if measure == 'BAL_STD':
+        n = slots['BAL_N']
+        return np.where(n > 1, np.sqrt(slots['BAL_M2'] / np.maximum(n - 1, 1)), np.nan)
+    if measure in ('WO_INFLOW_CNT', 'WO_OUTFLOW_CNT'):
+        return slots[measure]
+    if measure not in INCR_STREAKS:
+        raise ValueError('unknown day-level measure ' + repr(measure))
+    streak = slots[INCR_STREAKS[measure] + '_MAX_RUN']
+    n_cal = slots['CAL_CNT']
+    return streak if (n_cal > 0).all() else np.where(n_cal > 0, streak, np.nan)
+
+
+#Function Name: INCR_DAY_SMRY
+#Function Description: This function returns the three day-level summaries (df_MONTHLY_BAL_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2) from the slots of the windows,
+#                      for the accounts with a balance record up to the end of M1, as bs_daymat.BUILD_DAY_SMRY
+def INCR_DAY_SMRY(state):
+    rows = np.flatnonzero(state['FIRST_DAY'] <= DAY_NUMBER([state['AS_OF']])[0])
+    rows = rows[np.argsort(state['ACCT_ID'][rows], kind='stable')]
+    accounts = pd.Index(state['ACCT_ID'][rows], name='ACCT_ID')
+    smry = []
+    for layout in [MONTHLY_BAL_SMRY_LAYOUT, MAX_SEQ_LAYOUT, DAYS_WO_TRAN_SMRY_LAYOUT]:
+        columns = {}
+        for name, measure, months in layout:
+            if months == ALL_WINDOWS:
+                months = range(1, state['N_WINDOWS'] + 1)
+            for m in months:
+                columns[name + '_M' + str(m)] = INCR_DAY_MEASURE(state, measure, m, rows)
+        smry.append(pd.DataFrame(columns, index=accounts))
+    return tuple(smry)
+
+
+#Function Name: INCR_CPTY_SMRY
+#Function Description: This function builds the counterparty concentration summary (bs_cpty.BUILD_CPTY_SMRY) from the counterparty sums and the totals of the windows
+def INCR_CPTY_SMRY(state, accounts):
+    amounts, totals = {}, {}
+    if state['HAS_CPTY']:
+        for name in CPTY_AMOUNT_COLS:
+            parts = [pd.Series(slot['SUM'].to_numpy(), index=pd.MultiIndex.from_arrays([slot['ACCT_ID'].to_numpy(), np.full(len(slot), s - 1), slot[CPTY_COL].to_numpy()],
+                                                                                       names=CPTY_KEYS))
+                     for s, slot in enumerate(state['CPTY'][name]) if s > 0]
+            amounts[name] = pd.concat(parts)
+            total = state['SLOTS']['CPTY_' + name][1:]
+            win, rows = np.nonzero(total > 0)
+            totals[name] = pd.Series(total[win, rows], index=pd.MultiIndex.from_arrays([state['ACCT_ID'][rows], win], names=['ACCT_ID', 'WINDOW']))
+    return CPTY_SHARES(amounts, totals, accounts, state['N_WINDOWS'])
+
+
+#Function Name: SCORE_INCR_STATE
+#Function Description: This function builds the account summary (df_ACCT_MAST_STG1 of test.py) from the state, for the windows ending on the state's AS_OF
+#                      Its cost depends on the accounts and the windows, plus one comparison per kept amount for the outlier counts, not on the history
+def SCORE_INCR_STATE(state):
+    accounts = ACCOUNT_INDEX(state['ACCT_MAST'])
+    df_MONTHLY_BAL_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2 = INCR_DAY_SMRY(state)
+    df_MONTHLY_TRAN_SMRY = INCR_TRAN_SMRY(state, accounts, *INCR_THRESHOLDS(state))
+    df_CPTY_SMRY = INCR_CPTY_SMRY(state, accounts)
+    df = state['ACCT_MAST']
+    for smry in [df_MONTHLY_BAL_SMRY, df_MONTHLY_TRAN_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2, df_CPTY_SMRY]:
+        df = df.join(smry, on='ACCT_ID')
+    return df
+
+
+#Function Name: CHECK_INCR_STATE
+#Function Description: This function compares SCORE_INCR_STATE with a full bs_pipeline.SCORE_ACCOUNTS run on the rows fed to the state (those up to its last day),
+#                      for the same windows and the state's outlier thresholds; the thresholds are compared with OUTLIER_THRESHOLDS of the windows' transactions
+#                      Returns the mismatching columns (empty when both agree bit for bit), 'OUTLIER_THRESHOLDS' if the thresholds differ beyond rounding
+def CHECK_INCR_STATE(state, df_tran, df_bal):
+    df_WINDOWS = INCR_WINDOWS(state)
+    thresholds = INCR_THRESHOLDS(state)
+    df_tran = df_tran[df_tran['TRAN_DT'] <= state['LAST_DAY']]
+    df_FULL = SCORE_ACCOUNTS(df_tran, df_bal[df_bal['ACCT_BAL_DT'] <= state['LAST_DAY']], df_WINDOWS, *thresholds)[0].reset_index(drop=True)
+    df_INCR = SCORE_INCR_STATE(state).reset_index(drop=True)
+    if list(df_FULL.columns) != list(df_INCR.columns) or len(df_FULL) != len(df_INCR):
+        return ['<columns / rows>']
+    mismatches = [col for col in df_FULL.columns if not (df_FULL[col].astype(object).equals(df_INCR[col].astype(object))
+                                                         if isinstance(df_FULL[col].dtype, pd.CategoricalDtype) else df_FULL[col].equals(df_INCR[col]))]
+    in_windows = (df_tran['TRAN_DT'] >= df_WINDOWS['START_DT'].min()) & (df_tran['TRAN_DT'] <= df_WINDOWS['END_DT'].max())
+    if not np.allclose(thresholds, OUTLIER_THRESHOLDS(df_tran[in_windows]), rtol=1e-9, atol=0):
+        mismatches.append('OUTLIER_THRESHOLDS')
+    return mismatches
+
+
+#Function Name: SAVE_INCR_STATE
+#Function Description: This function writes the state to state_dir, replacing the previous state only once the new one is complete
+#                      The slots are .npy arrays (accounts along the second axis), the frames are written with bs_cache.SAVE_FRAME
+def SAVE_INCR_STATE(state, state_dir):
+    tmp_dir = state_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in ['ACCT_ID', 'FIRST_DAY', 'CARRY_BAL']:
+        np.save(os.path.join(tmp_dir, name + '.npy'), state[name])
+    for name, slot in state['SLOTS'].items():
+        np.save(os.path.join(tmp_dir, 'SLOT_' + name + '.npy'), slot)
+    SAVE_FRAME(state['ACCT_MAST'], os.path.join(tmp_dir, 'ACCT_MAST'))
+    for s in range(state['N_WINDOWS'] + 1):
+        SAVE_FRAME(pd.concat(state['AMOUNTS'][s], ignore_index=True), os.path.join(tmp_dir, 'AMOUNTS_' + str(s)))
+        for name in state['CPTY']:
+            slot = state['CPTY'][name][s]
+            SAVE_FRAME(slot.assign(**{CPTY_COL: slot[CPTY_COL].astype('category')}), os.path.join(tmp_dir, name + '_' + str(s)))
+    scalars = {key: state[key] for key in ['N_WINDOWS', 'WINDOW_DAYS', 'RULE', 'AMOUNT_DTYPE', 'TRAN_DT_DTYPE', 'HAS_CPTY']}
+    scalars.update({'AS_OF': str(state['AS_OF']), 'LAST_DAY': str(state['LAST_DAY']),
+                    'INFLOW_STATS': [list(s) for s in state['INFLOW_STATS']], 'OUTFLOW_STATS': [list(s) for s in state['OUTFLOW_STATS']]})
+    with open(os.path.join(tmp_dir, INCR_META), 'w') as f:
+        json.dump(scalars, f)
+
+    old_dir = state_dir.rstrip('/') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(state_dir):
+        os.rename(state_dir, old_dir)
+    os.rename(tmp_dir, state_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+#Function Name: LOAD_INCR_STATE
+#Function Description: This function reads a state written by SAVE_INCR_STATE, or returns an empty state for the window settings if there is none yet
+#                      An existing state keeps the window settings it was built with
+def LOAD_INCR_STATE(state_dir, n_windows=6, window_days=30, rule='days'):
+    if not os.path.exists(os.path.join(state_dir, INCR_META)):
+        return EMPTY_INCR_STATE(n_windows, window_days, rule)
+    with open(os.path.join(state_dir, INCR_META)) as f:
+        scalars = json.load(f)
+    state = EMPTY_INCR_STATE(scalars['N_WINDOWS'], scalars['WINDOW_DAYS'], scalars['RULE'])
+    state.update({key: scalars[key] for key in ['AMOUNT_DTYPE', 'TRAN_DT_DTYPE', 'HAS_CPTY']})
+    state.update({'AS_OF': pd.Timestamp(scalars['AS_OF']), 'LAST_DAY': pd.Timestamp(scalars['LAST_DAY']),
+                  'INFLOW_STATS': [tuple(s) for s in scalars['INFLOW_STATS']], 'OUTFLOW_STATS': [tuple(s) for s in scalars['OUTFLOW_STATS']]})
+    for name in ['ACCT_ID', 'FIRST_DAY', 'CARRY_BAL']:
+        state[name] = np.load(os.path.join(state_dir, name + '.npy'))
+    state['SLOTS'] = {name: np.load(os.path.join(state_dir, 'SLOT_' + name + '.npy')) for name in SLOT_SPECS(state)}
+    state['ACCT_MAST'] = LOAD_FRAME(os.path.join(state_dir, 'ACCT_MAST'))
+    state['AMOUNTS'] = [[LOAD_FRAME(os.path.join(state_dir, 'AMOUNTS_' + str(s)))] for s in range(state['N_WINDOWS'] + 1)]
+    for name in state['CPTY']:
+        slots = [LOAD_FRAME(os.path.join(state_dir, name + '_' + str(s))) for s in range(state['N_WINDOWS'] + 1)]
+        state['CPTY'][name] = [slot.assign(**{CPTY_COL: slot[CPTY_COL].astype(object)}) for slot in slots]
+    return state
+
+
+#Function Name: REPLAY_INCR_STATE
+#Function Description: This function feeds a statement to an incremental state as a daily feed would: the rows up to as_of_dt as the first batch,
+#                      then one batch per day for n_days days; the state is compared with a full run (CHECK_INCR_STATE) after the first batch and at the end
+#                      Returns the state and one row per batch: AS_OF_DT, ROWS, SECONDS, and MISMATCHES where it was checked
+def REPLAY_INCR_STATE(df_tran, df_bal, as_of_dt, n_days, n_windows=6, window_days=30, rule='days'):
+    state = EMPTY_INCR_STATE(n_windows, window_days, rule)
+    as_of = pd.to_datetime(as_of_dt).normalize()
+    log = []
+    for i in range(n_days + 1):
+        day = as_of + pd.Timedelta(days=i)
+        first = day - pd.Timedelta(days=1) if i > 0 else pd.Timestamp.min
+        tran = df_tran[(df_tran['TRAN_DT'] > first) & (df_tran['TRAN_DT'] <= day)]
+        bal = df_bal[(df_bal['ACCT_BAL_DT'] > first) & (df_bal['ACCT_BAL_DT'] <= day)]
+        start = time.perf_counter()
+        UPDATE_INCR_STATE(state, tran, bal, day)
+        log.append({'AS_OF_DT': day, 'ROWS': len(tran) + len(bal), 'SECONDS': time.perf_counter() - start})
+        if i == 0 or i == n_days:
+            log[-1]['MISMATCHES'] = ', '.join(CHECK_INCR_STATE(state, df_tran, df_bal)) or 'none'
+    return state, pd.DataFrame(log)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental daily rescoring of the bank statement scorecard.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    update = sub.add_parser('update', help='add a daily batch to a state and score it')
+    update.add_argument('state_dir', help='folder of the state (created on the first batch)')
+    update.add_argument('tran_file', help='transactions of the batch (raw csv, with the RECURRENT_*_TRAN_FLG columns)')
+    update.add_argument('bal_file', help='day-end balances of the batch (raw csv)')
+    update.add_argument('as_of', help='last day of the batch (MM/DD/YYYY)')
+    update.add_argument('-o', '--output', default=None, help='account summary of the state (.csv, .csv.gz, .npz or .parquet)')
+    check = sub.add_parser('check', help='replay a statement day by day and compare the state with a full run')
+    check.add_argument('folder', help='statement folder (' + BS_TRAN_FILE + ' and ' + BS_ACCT_BAL_FILE + ')')
+    check.add_argument('--as-of', required=True, help='as-of date of the first batch (MM/DD/YYYY)')
+    check.add_argument('--days', type=int, default=35, help='daily batches after the first one')
+    for p in [update, check]:
+        p.add_argument('--windows', type=int, default=6, help='number of windows of a new state (M1 to Mn)')
+        p.add_argument('--window-days', type=int, default=30, help='days of a window with the days rule')
+        p.add_argument('--window-rule', choices=['days', 'month'], default='days', help='windows of window_days days, or calendar months')
+        p.add_argument('--amounts', choices=BS_AMOUNT_TYPES, default='float32', help='type of the transaction amounts (minor = exact int64 cents)')
+    args = parser.parse_args()
+    tran_schema = AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, args.amounts)
+
+    if args.command == 'update':
+        df_tran = SET_RECURRENT_FLAGS(READ_BS_TRAN(args.tran_file, schema=tran_schema), 'feed')
+        df_bal = READ_BS_ACCT_BAL(args.bal_file, schema=BS_ACCT_BAL_SCHEMA)
+        state = LOAD_INCR_STATE(args.state_dir, args.windows, args.window_days, args.window_rule)
+        start = time.perf_counter()
+        UPDATE_INCR_STATE(state, df_tran, df_bal, pd.to_datetime(args.as_of, format='%m/%d/%Y'))
+        SAVE_INCR_STATE(state, args.state_dir)
+        print(str(len(df_tran) + len(df_bal)) + ' rows added in ' + format(time.perf_counter() - start, '.2f') + ' s, scored as of '
+              + state['AS_OF'].strftime('%m/%d/%Y'), file=sys.stderr)
+        if args.output:
+            WRITE_FRAME(SCORE_INCR_STATE(state), args.output, index=False)
+
+    if args.command == 'check':
+        df_tran = SET_RECURRENT_FLAGS(READ_BS_TRAN(os.path.join(args.folder, BS_TRAN_FILE), schema=tran_schema), 'auto')
+        df_bal = READ_BS_ACCT_BAL(os.path.join(args.folder, BS_ACCT_BAL_FILE))
+        state, df_LOG = REPLAY_INCR_STATE(df_tran, df_bal, pd.to_datetime(args.as_of, format='%m/%d/%Y'), args.days,
+                                          args.windows, args.window_days, args.window_rule)
+        start = time.perf_counter()
+        SCORE_INCR_STATE(state)
+        score_s = time.perf_counter() - start
+        df_WINDOWS = INCR_WINDOWS(state)
+        start = time.perf_counter()
+        SCORE_ACCOUNTS(df_tran[df_tran['TRAN_DT'] <= state['LAST_DAY']], df_bal[df_bal['ACCT_BAL_DT'] <= state['LAST_DAY']], df_WINDOWS, *INCR_THRESHOLDS(state))
+        full_s = time.perf_counter() - start
+        print(df_LOG[df_LOG['MISMATCHES'].notna()].to_string(index=False), file=sys.stderr)
+        print('first batch ' + format(df_LOG['SECONDS'].iloc[0], '.2f') + ' s, daily batch ' + format(df_LOG['SECONDS'].iloc[1:].median() * 1000, '.0f')
+              + ' ms (median), scoring ' + format(score_s * 1000, '.0f') + ' ms; full run ' + format(full_s * 1000, '.0f') + ' ms', file=sys.stderr)
+        sys.exit(0 if (df_LOG['MISMATCHES'].dropna() == 'none').all() else 1)
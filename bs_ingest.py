@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Typed ingestion of the raw bank statement files.
+#     * Only the columns the scorecard needs are loaded, with declared dtypes, so pandas does not infer (and copy) them.
+#     * Dates are parsed and manually excluded transactions dropped chunk by chunk while the file is read.
+#     * The transaction amounts are float32 by default; AMOUNT_SCHEMA switches them to float64, or to exact int64 minor units (cents)
+#       with the BS_MINOR_UNITS dtype, so the sums, minima, maxima and comparisons on them are integer operations.
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from bs_prof import PROFILED
+
+
+#Schema of ASTRUM_RAW_DAILY_BS_TRAN_CA.csv; the amounts are float32, as pd.to_numeric(downcast='float') gave before
+BS_TRAN_SCHEMA = {
+    'CUST_ID': 'int64',
+    'CUST_NAME': 'category',
+    'ACCT_ID': 'int64',
+    'ACCT_TYP': 'category',
+    'TRAN_DT': 'str',
+    'INFLOW_TRAN_AMT_HKD': 'float32',
+    'OUTFLOW_TRAN_AMT_HKD': 'float32',
+    'CAL_BAL_AMT_HKD': 'float32',
+    'MANUAL_EXCLUSION': 'int8',
+    'REVENUE_TRAN_FLG': 'int8',
+}
+
+#Columns of ASTRUM_RAW_DAILY_BS_TRAN_CA.csv loaded only when the file has them
+#The recurrent flags can be left to bs_recur.DETECT_RECURRENT, which needs the counterparties
+BS_TRAN_OPTIONAL_SCHEMA = {
+    'RECURRENT_INFLOW_TRAN_FLG': 'int8',
+    'RECURRENT_OUTFLOW_TRAN_FLG': 'int8',
+    'COUNTERPARTY': 'category',
+}
+
+#Schema of ASTRUM_RAW_DAILY_BS_ACCT_BAL.csv
+BS_ACCT_BAL_SCHEMA = {
+    'CUST_ID': 'int64',
+    'CUST_NAME': 'category',
+    'ACCT_ID': 'int64',
+    'ACCT_TYP': 'category',
+    'ACCT_BAL_DT': 'str',
+    'ACCT_BAL': 'float64',
+}
+
+#Amount columns of the transaction file, and the amount types AMOUNT_SCHEMA gives them
+BS_TRAN_AMOUNT_COLS = ['INFLOW_TRAN_AMT_HKD', 'OUTFLOW_TRAN_AMT_HKD', 'CAL_BAL_AMT_HKD']
+BS_MINOR_UNITS = 'minor'
+BS_AMOUNT_TYPES = ['float32', 'float64', BS_MINOR_UNITS]
+#Minor units per HKD
+MINOR_UNIT_SCALE = 100
+
+#File names of the two feeds inside an applicant's statement folder
+BS_TRAN_FILE = 'ASTRUM_RAW_DAILY_BS_TRAN_CA.csv'
+BS_ACCT_BAL_FILE = 'ASTRUM_RAW_DAILY_BS_ACCT_BAL.csv'
+
+BS_DATE_FORMAT = '%d/%m/%Y'
+#Raise when the way the files are parsed changes, so the cached frames (bs_cache) are rebuilt
+BS_SCHEMA_VERSION = 4
+BS_CHUNK_SIZE = 500000
+
+
+#Function Name: AMOUNT_SCHEMA
+#Function Description: This function returns the schema with its amount columns of the given amount type ('float32', 'float64' or BS_MINOR_UNITS)
+def AMOUNT_SCHEMA(schema, amount_cols, amount_type):
+    if amount_type not in BS_AMOUNT_TYPES:
+        raise ValueError('unknown amount type ' + repr(amount_type) + ', expected one of ' + repr(BS_AMOUNT_TYPES))
+    return {c: amount_type if c in amount_cols else t for c, t in schema.items()}
+
+
+#Function Name: TO_MINOR_UNITS
+#Function Description: This function converts amounts in HKD, as parsed by read_csv (within an ulp of the decimal text), to int64 minor units
+#                      For a decimal with at most 2 decimals below 2**51 minor units, the product by MINOR_UNIT_SCALE is then far closer than 0.5 to the exact integer,
+#                      so rounding it gives the exact number of cents; an amount with more decimals, beyond that range or missing raises ValueError
+def TO_MINOR_UNITS(values, col='amount'):
+    x = np.asarray(values, dtype='float64') * MINOR_UNIT_SCALE
+    units = np.rint(x)
+    exact = (np.abs(units) < 2.0 ** 51) & (np.abs(x - units) <= np.abs(x) * 2.0 ** -50)
+    if not exact.all():
+        raise ValueError(col + ' ' + repr(float(np.asarray(values, dtype='float64')[~exact][0])) + ' is missing or cannot be held exactly in minor units')
+    return units.astype('int64')
+
+
+#Function Name: PRESENT_SCHEMA
+#Function Description: This function returns the schema extended with the optional columns found in the header of the file
+def PRESENT_SCHEMA(file, schema, optional=None):
+    if not optional:
+        return schema
+    header = pd.read_csv(file, sep=',', header=0, nrows=0).columns
+    return {**schema, **{c: t for c, t in optional.items() if c in header}}
+
+
+#Function Name: EXCLUDE_ROWS
+#Function Description: This function returns the rows of the chunk where exclude_col is 0, without the column
+def EXCLUDE_ROWS(chunk, exclude_col):
+    return chunk[chunk[exclude_col] == 0].drop(columns=exclude_col)
+
+
+#Function Name: ITER_BS_CSV
+#Function Description: This function reads a raw bank statement csv in chunks with the given schema and yields the typed chunks one by one
+#                      The date columns are converted on every chunk, and if exclude_col is given only the rows where it is 0 are kept (the column itself is dropped)
+#                      optional = columns (with their dtypes) also loaded when the file has them
+#                      Columns of the BS_MINOR_UNITS dtype are read as float64 and converted to int64 minor units (TO_MINOR_UNITS)
+def ITER_BS_CSV(file, schema, date_cols, exclude_col=None, chunksize=BS_CHUNK_SIZE, optional=None):
+    schema = PRESENT_SCHEMA(file, schema, optional)
+    minor_cols = [c for c, t in schema.items() if t == BS_MINOR_UNITS]
+    dtype = {c: 'float64' if t == BS_MINOR_UNITS else t for c, t in schema.items()}
+    reader = pd.read_csv(file, sep=',', header=0, usecols=list(schema), dtype=dtype, chunksize=chunksize)
+    for chunk in reader:
+        if exclude_col is not None:
+            chunk = PROFILED('EXCLUSION_FILTER', EXCLUDE_ROWS, chunk, exclude_col)
+        for col in minor_cols:
+            chunk[col] = TO_MINOR_UNITS(chunk[col], col)
+        for col in date_cols:
+            chunk[col] = pd.to_datetime(chunk[col], format=BS_DATE_FORMAT)
+        yield chunk
+
+
+#Function Name: READ_BS_CSV
+#Function Description: This function reads a whole raw bank statement csv with the given schema (see ITER_BS_CSV)
+def READ_BS_CSV(file, schema, date_cols, exclude_col=None, chunksize=BS_CHUNK_SIZE, optional=None):
+    schema = PRESENT_SCHEMA(file, schema, optional)
+    chunks = list(ITER_BS_CSV(file, schema, date_cols, exclude_col, chunksize))
+    if not chunks:
+        return EMPTY_BS_FRAME(schema, date_cols, exclude_col)
+    return CONCAT_TYPED(chunks)[[c for c in schema if c != exclude_col]]
+
+
+#Function Name: EMPTY_BS_FRAME
+#Function Description: This function returns a frame without rows holding the columns of the schema as READ_BS_CSV types them (without exclude_col)
+def EMPTY_BS_FRAME(schema, date_cols, exclude_col=None):
+    return pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c in date_cols else 'int64' if schema[c] == BS_MINOR_UNITS else schema[c])
+                         for c in schema if c != exclude_col})
+
+
+#Function Name: CONCAT_TYPED
+#Function Description: This function concatenates typed frames (row-wise, with a new RangeIndex), keeping the categorical columns categorical
+#                      Frames have their own categories, so the categorical columns are unioned rather than concatenated (which would give object columns)
+def CONCAT_TYPED(frames):
+    category_cols = [c for c in frames[0].columns if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([f.drop(columns=category_cols) for f in frames], ignore_index=True)
+    categories = pd.DataFrame({col: union_categoricals([f[col] for f in frames], sort_categories=True) for col in category_cols}, index=df.index)
+    return pd.concat([df, categories], axis=1)[frames[0].columns]
+
+
+#Function Name: READ_BS_TRAN
+#Function Description: This function loads the daily transactions of the bank statement, without the manually excluded ones
+#                      The recurrent flags and the COUNTERPARTY column are loaded when the file has them (BS_TRAN_OPTIONAL_SCHEMA)
+#                      schema = BS_TRAN_SCHEMA, or its variant from AMOUNT_SCHEMA for other amount types
+def READ_BS_TRAN(file, chunksize=BS_CHUNK_SIZE, schema=BS_TRAN_SCHEMA):
+    return READ_BS_CSV(file, schema, ['TRAN_DT'], exclude_col='MANUAL_EXCLUSION', chunksize=chunksize, optional=BS_TRAN_OPTIONAL_SCHEMA)
+
+
+#Function Name: ITER_BS_TRAN
+#Function Description: This function yields the daily transactions of the bank statement chunk by chunk, without the manually excluded ones
+def ITER_BS_TRAN(file, chunksize=BS_CHUNK_SIZE, schema=BS_TRAN_SCHEMA):
+    return ITER_BS_CSV(file, schema, ['TRAN_DT'], exclude_col='MANUAL_EXCLUSION', chunksize=chunksize, optional=BS_TRAN_OPTIONAL_SCHEMA)
+
+
+#Function Name: READ_BS_ACCT_BAL
+#Function Description: This function loads the day-end balances of the bank statement
+def READ_BS_ACCT_BAL(file, chunksize=BS_CHUNK_SIZE, schema=BS_ACCT_BAL_SCHEMA):
+    return READ_BS_CSV(file, schema, ['ACCT_BAL_DT'], chunksize=chunksize)
+
+
+#Function Name: ITER_BS_ACCT_BAL
+#Function Description: This function yields the day-end balances of the bank statement chunk by chunk
+def ITER_BS_ACCT_BAL(file, chunksize=BS_CHUNK_SIZE, schema=BS_ACCT_BAL_SCHEMA):
+    return ITER_BS_CSV(file, schema, ['ACCT_BAL_DT'], chunksize=chunksize)
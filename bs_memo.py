@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Memoization of the per-account feature vectors of df_ACCT_MAST_STG1 (bs_pipeline.SCORE_ACCOUNTS) across runs.
+#     * An account's vector is keyed by a 128-bit digest of everything its features are computed from:
+#         * its transactions inside the windows: dates, amounts, revenue / recurrent flags, counterparties, in file order,
+#           and whether each amount is above this run's outlier threshold
+#         * its day-end balances inside the windows, and the last one before the windows (the carried-forward balance)
+#         * the window table, the dtypes of the input tables, and BS_MEMO_VERSION
+#       so an account is only recomputed when one of its in-window rows changed, or when a threshold moved across one of its amounts.
+#     * The digests are taken over all the accounts at once: a hash per row, mixed with its rank within the account and summed per account.
+#     * The columns and dtypes of the features of a context (BS_MEMO_VERSION, windows, input dtypes) are kept with the vectors,
+#       so a run where every account hits reads the vectors without building any feature.
+#     * The vectors are held in one sqlite file, one row per account key, with the time of last use:
+#         * it is bounded in size, the least recently used vectors being evicted first
+#         * it is opened in WAL mode, so any number of runs (threads or processes) read it while one writes
+#     * The result is the same, row for row and dtype for dtype, as SCORE_ACCOUNTS on all the accounts.
+
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from bs_cpty import CPTY_COL
+from bs_pipeline import ACCT_KEY_COLS, SCORE_ACCOUNTS
+from bs_recur import RECUR_FLAG_COLS
+from bs_window import WINDOW_BOUNDS
+
+#Raise when the way any feature is computed changes, so the memoized vectors are recomputed
+BS_MEMO_VERSION = 2
+BS_MEMO_MAX_BYTES = 1024 ** 3
+#Seconds a writer waits for another one to finish
+BS_MEMO_TIMEOUT = 60
+#Seeds of the two 64-bit lanes of the digests
+MEMO_SEEDS = [0x243F6A8885A308D3, 0x13198A2E03707344]
+
+MEMO_TABLE = ('CREATE TABLE IF NOT EXISTS memo (acct INTEGER, k0 INTEGER, k1 INTEGER, value BLOB NOT NULL, used INTEGER NOT NULL, '
+              'PRIMARY KEY (acct, k0, k1)) WITHOUT ROWID')
+MEMO_INDEX = 'CREATE INDEX IF NOT EXISTS memo_used ON memo (used)'
+MEMO_META = 'CREATE TABLE IF NOT EXISTS meta (context TEXT PRIMARY KEY, dtypes TEXT NOT NULL)'
+#Transaction columns an account's features are computed from, besides the outlier flags
+MEMO_TRAN_COLS = ['TRAN_DT', 'INFLOW_TRAN_AMT_HKD', 'OUTFLOW_TRAN_AMT_HKD', 'REVENUE_TRAN_FLG'] + list(RECUR_FLAG_COLS.values()) + [CPTY_COL]
+
+
+#Function Name: MIX64
+#Function Description: This function scrambles uint64 values (the splitmix64 finalizer); products wrap around modulo 2**64
+def MIX64(x):
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+#Function Name: ROW_HASH
+#Function Description: This function returns a uint64 hash of every row of a frame, from the bits of its values (categories by their text)
+def ROW_HASH(content):
+    h = np.zeros(len(content), dtype='uint64')
+    for i, col in enumerate(content.columns):
+        values = content[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            #A missing value (code -1) takes the last entry, 0
+            table = np.append(pd.util.hash_array(values.cat.categories.to_numpy(dtype=object)), np.uint64(0))
+            bits = table[values.cat.codes.to_numpy()]
+        else:
+            values = values.to_numpy()
+            bits = values.view('u' + str(values.dtype.itemsize)).astype('uint64') if values.dtype.kind in 'iufM' else values.astype('uint64')
+        h = MIX64(h ^ bits ^ MIX64(np.full(len(h), i + 1, dtype='uint64')))
+    return h
+
+
+#Function Name: ACCOUNT_DIGESTS
+#Function Description: This function returns, for every account of accounts (sorted ids), two uint64 digests of its rows of content, in row order
+#                      acct = ACCT_ID of every row; rows of other accounts are ignored, and an account without rows gets 0
+def ACCOUNT_DIGESTS(acct, content, accounts):
+    digests = np.zeros((len(accounts), len(MEMO_SEEDS)), dtype='uint64')
+    keep = np.isin(acct, accounts)
+    acct = acct[keep]
+    if not len(acct):
+        return digests
+    row_hash = ROW_HASH(content[keep])
+    order = np.argsort(acct, kind='stable')
+    acct = acct[order]
+    row_hash = row_hash[order]
+    starts = np.flatnonzero(np.concatenate([[True], acct[1:] != acct[:-1]]))
+    rank = (np.arange(len(acct)) - np.repeat(starts, np.diff(np.append(starts, len(acct))))).astype('uint64')
+    rows = np.searchsorted(accounts, acct[starts])
+    for j, seed in enumerate(MEMO_SEEDS):
+        digests[rows, j] = np.add.reduceat(MIX64(row_hash ^ MIX64(rank + np.uint64(seed))), starts)
+    return digests
+
+
+#Function Name: MEMO_KEYS
+#Function Description: This function returns the two 64-bit key lanes (as int64, for sqlite) of every account of accounts, for the given context digest
+def MEMO_KEYS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, accounts, context):
+    starts, ends, order = WINDOW_BOUNDS(df_WINDOWS)
+    start = starts.min().astype('datetime64[D]')
+    end = ends.max().astype('datetime64[D]')
+
+    #Transactions inside the windows, with the outlier flags of their amounts (thresholds are scalars, or Series by ACCT_ID as in bs_tran_smry)
+    tran_day = np.asarray(df_tran['TRAN_DT'], dtype='datetime64[D]')
+    tran = df_tran[(tran_day >= start) & (tran_day <= end)]
+    content = tran[[c for c in MEMO_TRAN_COLS if c in tran]].copy()
+    for col, threshold in [('INFLOW_TRAN_AMT_HKD', inflow_threshold), ('OUTFLOW_TRAN_AMT_HKD', outflow_threshold)]:
+        if isinstance(threshold, pd.Series):
+            threshold = tran['ACCT_ID'].map(threshold)
+        content['OUTLIER_' + col] = tran[col] > threshold
+    tran_digests = ACCOUNT_DIGESTS(tran['ACCT_ID'].to_numpy(dtype='int64'), content, accounts)
+
+    #Day-end balances up to the end, the first of a day kept, and of those before the start only the last one (as bs_daymat.BUILD_DAY_MATRIX reads them)
+    bal_acct = df_bal['ACCT_ID'].to_numpy(dtype='int64')
+    day = (np.asarray(df_bal['ACCT_BAL_DT'], dtype='datetime64[D]') - start).astype('int64')
+    order = np.lexsort((day, bal_acct))
+    first_of_day = np.concatenate([[True], (np.diff(bal_acct[order]) != 0) | (np.diff(day[order]) != 0)])
+    order = order[first_of_day]
+    bal_acct = bal_acct[order]
+    day = day[order]
+    next_same = np.append(bal_acct[1:] == bal_acct[:-1], False)
+    next_before = np.append(day[1:] < 0, False)
+    keep = (day <= (end - start).astype('int64')) & ~((day < 0) & next_same & next_before)
+    content = pd.DataFrame({'DAY': day[keep].clip(0), 'ACCT_BAL': df_bal['ACCT_BAL'].to_numpy(dtype='float64')[order][keep]})
+    bal_digests = ACCOUNT_DIGESTS(bal_acct[keep], content, accounts)
+
+    keys = MIX64(tran_digests ^ MIX64(bal_digests ^ context))
+    return keys.view('int64')
+
+
+#Function Name: MEMO_CONTEXT
+#Function Description: This function returns the digest of what every key of a run shares: BS_MEMO_VERSION, the window table, the columns and dtypes of the input tables
+#                      and the counterparty sketch size
+def MEMO_CONTEXT(df_tran, df_bal, df_WINDOWS, cpty_sketch_size=None):
+    h = hashlib.blake2b(digest_size=8 * len(MEMO_SEEDS))
+    h.update(str(BS_MEMO_VERSION).encode())
+    h.update(json.dumps(cpty_sketch_size).encode())
+    h.update(json.dumps([[str(s), str(e)] for s, e in zip(df_WINDOWS['START_DT'], df_WINDOWS['END_DT'])]).encode())
+    for df in [df_tran, df_bal]:
+        h.update(json.dumps([[c, str(t)] for c, t in df.dtypes.items()]).encode())
+    return h.digest()
+
+
+#Function Name: MEMO_DTYPES
+#Function Description: This function returns the feature columns of STG1 with their dtypes for a context, as kept in the memo,
+#                      or else from the features of an empty run, which it keeps in the memo
+def MEMO_DTYPES(con, context, df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold):
+    row = con.execute('SELECT dtypes FROM meta WHERE context = ?', (context.hex(),)).fetchone()
+    if row is not None:
+        return {c: np.dtype(t) for c, t in json.loads(row[0])}
+    empty = SCORE_ACCOUNTS(df_tran.iloc[:0], df_bal.iloc[:0], df_WINDOWS, inflow_threshold, outflow_threshold)[0]
+    dtypes = empty.drop(columns=ACCT_KEY_COLS).dtypes.to_dict()
+    con.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', (context.hex(), json.dumps([[c, str(t)] for c, t in dtypes.items()])))
+    return dtypes
+
+
+#Function Name: MEMO_STORAGE
+#Function Description: This function returns the record dtype the vectors are stored in: 8 bytes per feature, int64 for the dates, float64 otherwise
+#                      (the counts and float32 amounts are exact in float64)
+def MEMO_STORAGE(dtypes):
+    return np.dtype([(c, 'i8' if t.kind == 'M' else 'f8') for c, t in dtypes.items()])
+
+
+#Function Name: MEMO_ENCODE / MEMO_DECODE
+#Function Description: These functions turn the feature rows of a frame into one blob per row, and blobs back into a frame of the feature dtypes
+#                      A decoded integer feature holding NaN is float64, as it is in SCORE_ACCOUNTS
+def MEMO_ENCODE(features, dtypes):
+    storage = MEMO_STORAGE(dtypes)
+    records = np.empty(len(features), dtype=storage)
+    for c, t in dtypes.items():
+        values = features[c].to_numpy()
+        records[c] = values.view('int64') if t.kind == 'M' else values.astype('float64')
+    blob = records.tobytes()
+    return [blob[i * storage.itemsize:(i + 1) * storage.itemsize] for i in range(len(records))]
+
+
+def MEMO_DECODE(blobs, dtypes, index):
+    records = np.frombuffer(b''.join(blobs), dtype=MEMO_STORAGE(dtypes))
+    columns = {}
+    for c, t in dtypes.items():
+        values = records[c]
+        if t.kind == 'M':
+            columns[c] = values.view(t)
+        elif t.kind in 'iu' and np.isnan(values).any():
+            columns[c] = values
+        else:
+            columns[c] = values.astype(t)
+    return pd.DataFrame(columns, index=index)
+
+
+#Function Name: MEMO_CONNECT
+#Function Description: This function opens the memo file (created if missing) in WAL mode, where readers never wait for the writer
+def MEMO_CONNECT(memo_file):
+    con = sqlite3.connect(memo_file, timeout=BS_MEMO_TIMEOUT, isolation_level=None)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute(MEMO_TABLE)
+    con.execute(MEMO_INDEX)
+    con.execute(MEMO_META)
+    return con
+
+
+#Function Name: EVICT_MEMO
+#Function Description: This function removes the least recently used vectors until the memo holds at most max_bytes of them; returns the number removed
+def EVICT_MEMO(con, max_bytes=BS_MEMO_MAX_BYTES):
+    count, total = con.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM memo').fetchone()
+    if total <= max_bytes:
+        return 0
+    n_evict = -(-(total - max_bytes) * count // total)
+    con.execute('DELETE FROM memo WHERE (acct, k0, k1) IN (SELECT acct, k0, k1 FROM memo ORDER BY used LIMIT ?)', (n_evict,))
+    return n_evict
+
+
+#Function Name: MEMO_SCORE_ACCOUNTS
+#Function Description: This function returns df_ACCT_MAST_STG1 as SCORE_ACCOUNTS does, taking the feature vectors of the unchanged accounts from memo_file
+#                      and running the pipeline on the other accounts only; their vectors are then added to memo_file (bounded to max_bytes)
+#                      Also returns the counts of the run: {'HITS': accounts taken from the memo, 'MISSES': accounts recomputed, 'EVICTED': vectors evicted}
+#                      cpty_sketch_size is passed on to SCORE_ACCOUNTS; the vectors of each sketch size are memoized apart
+def MEMO_SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, memo_file, max_bytes=BS_MEMO_MAX_BYTES, cpty_sketch_size=None):
+    df_ACCT_MAST_STG1 = df_tran[ACCT_KEY_COLS].drop_duplicates().sort_values(ACCT_KEY_COLS)
+    accounts = np.unique(df_ACCT_MAST_STG1['ACCT_ID'].to_numpy(dtype='int64'))
+    context = MEMO_CONTEXT(df_tran, df_bal, df_WINDOWS, cpty_sketch_size)
+    keys = MEMO_KEYS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, accounts, np.frombuffer(context, dtype='uint64'))
+    rows = list(zip(range(len(accounts)), accounts.tolist(), keys[:, 0].tolist(), keys[:, 1].tolist()))
+
+    con = MEMO_CONNECT(memo_file)
+    try:
+        dtypes = MEMO_DTYPES(con, context, df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold)
+        con.execute('CREATE TEMP TABLE wanted (pos INTEGER, acct INTEGER, k0 INTEGER, k1 INTEGER, PRIMARY KEY (acct, k0, k1)) WITHOUT ROWID')
+        con.executemany('INSERT INTO wanted VALUES (?, ?, ?, ?)', rows)
+        found = con.execute('SELECT w.pos, m.value FROM wanted w JOIN memo m ON m.acct = w.acct AND m.k0 = w.k0 AND m.k1 = w.k1 ORDER BY w.pos').fetchall()
+        hit = np.zeros(len(accounts), dtype=bool)
+        hit[[pos for pos, _ in found]] = True
+        features = [MEMO_DECODE([value for _, value in found], dtypes, pd.Index(accounts[hit], name='ACCT_ID'))]
+
+        if not hit.all():
+            missed = accounts[~hit]
+            df = SCORE_ACCOUNTS(df_tran[df_tran['ACCT_ID'].isin(missed)], df_bal[df_bal['ACCT_ID'].isin(missed)], df_WINDOWS,
+                                inflow_threshold, outflow_threshold, cpty_sketch_size)[0]
+            df = df.drop_duplicates('ACCT_ID').set_index('ACCT_ID').reindex(missed)
+            blobs = MEMO_ENCODE(df, dtypes)
+            features.append(MEMO_DECODE(blobs, dtypes, df.index))
+
+        con.execute('BEGIN IMMEDIATE')
+        used = time.time_ns()
+        con.execute('UPDATE memo SET used = ? WHERE (acct, k0, k1) IN (SELECT acct, k0, k1 FROM wanted)', (used,))
+        if not hit.all():
+            missed_rows = [rows[i] for i in np.flatnonzero(~hit)]
+            con.executemany('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?)',
+                            [(acct, k0, k1, blob, used) for (_, acct, k0, k1), blob in zip(missed_rows, blobs)])
+        evicted = EVICT_MEMO(con, max_bytes)
+        con.execute('COMMIT')
+    finally:
+        con.close()
+
+    #Decoded integer features with NaN in one part only are float64 in that part; concat gives the column the dtype SCORE_ACCOUNTS would
+    features = pd.concat(features).reindex(accounts)
+    df_ACCT_MAST_STG1 = df_ACCT_MAST_STG1.join(features, on='ACCT_ID')
+    return df_ACCT_MAST_STG1, {'HITS': int(hit.sum()), 'MISSES': int((~hit).sum()), 'EVICTED': evicted}
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Out-of-core scoring of statement files larger than memory.
+#     * The raw transaction and balance files are streamed once, chunk by chunk (bs_ingest.ITER_BS_TRAN / ITER_BS_ACCT_BAL);
+#       the rows of every chunk are spilled to disk into partitions by ACCT_ID hash (bs_parallel.SHARD_OF), so all the rows
+#       of an account land in the same partition, in file order. The outlier thresholds are folded over the same pass.
+#     * The per-account pipeline (bs_pipeline.SCORE_ACCOUNTS) then runs on one partition at a time; its df_ACCT_MAST_STG1
+#       is written back to disk and the partition's spilled rows are deleted.
+#     * BS_ACCT_SMRY is assembled by streaming: only the account keys of all the partitions are sorted in memory,
+#       and the summary rows are gathered from the memory-mapped partition results and written block by block (bs_write, on a background thread,
+#       as csv, csv.gz, npz or parquet after the output's extension).
+#     * With a memo file, the partitions take the feature vectors of their unchanged accounts from it (bs_memo).
+#     * --cpty-sketch runs the counterparty stage in its sketch mode (bs_cpty); the counterparty shares are then approximate.
+#     * Peak memory is that of the largest partition (plus the account keys), not that of the whole file;
+#       the rows, their labels and the output are the same as those of the in-memory run.
+#
+# Usage: python bs_ooc.py <statement folder> -o <BS_ACCT_SMRY.csv> [--as-of MM/DD/YYYY] [--windows N] [--window-rule days|month] [--recurrent auto|feed|detect] [--amounts float32|float64|minor] [--parts N] [--work-dir DIR] [--memo FILE] [--cpty-sketch N]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from bs_cache import SAVE_FRAME, LOAD_FRAME
+from bs_ingest import ITER_BS_TRAN, ITER_BS_ACCT_BAL, BS_TRAN_SCHEMA, BS_TRAN_OPTIONAL_SCHEMA, BS_ACCT_BAL_SCHEMA, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES
+from bs_ingest import BS_TRAN_FILE, BS_ACCT_BAL_FILE, BS_CHUNK_SIZE, AMOUNT_SCHEMA, PRESENT_SCHEMA, EMPTY_BS_FRAME, CONCAT_TYPED
+from bs_memo import MEMO_SCORE_ACCOUNTS
+from bs_parallel import BS_ROW_COL, SHARD_OF
+from bs_pipeline import ACCT_KEY_COLS, OUTLIER_THRESHOLDS, SCORE_ACCOUNTS
+from bs_recur import SET_RECURRENT_FLAGS
+from bs_window import BUILD_WINDOWS
+from bs_write import OPEN_WRITER, WRITE_BATCH, CLOSE_WRITER
+
+#Raw transaction file size per partition when the number of partitions is not given
+BS_OOC_PART_BYTES = 256 * 1024 ** 2
+#Summary rows written at a time while BS_ACCT_SMRY is assembled
+BS_OOC_BLOCK_ROWS = 100000
+
+
+#Function Name: OOC_PARTS
+#Function Description: This function returns the number of partitions of a raw transaction file, one per part_bytes of it
+def OOC_PARTS(file, part_bytes=BS_OOC_PART_BYTES):
+    return max(1, -(-os.path.getsize(file) // part_bytes))
+
+
+#Function Name: PART_DIR
+#Function Description: This function returns the folder of the partition p inside spill_dir
+def PART_DIR(spill_dir, p):
+    return os.path.join(spill_dir, 'p' + str(p))
+
+
+#Function Name: SPILL_CHUNKS
+#Function Description: This function writes the rows of every chunk into the partition folders of spill_dir (one SAVE_FRAME piece per chunk and partition)
+#                      and yields the chunk once spilled, so the caller can fold statistics over the same pass
+#                      The row labels are the running row numbers over the chunks, as READ_BS_CSV gives them, and are saved in the BS_ROW column
+def SPILL_CHUNKS(chunks, n_parts, spill_dir):
+    offset = 0
+    for i, chunk in enumerate(chunks):
+        chunk = chunk.set_axis(pd.RangeIndex(offset, offset + len(chunk)))
+        offset += len(chunk)
+        part = SHARD_OF(chunk['ACCT_ID'], n_parts)
+        order = np.argsort(part, kind='stable')
+        bounds = np.searchsorted(part[order], np.arange(n_parts + 1))
+        rows = chunk.iloc[order].rename_axis(BS_ROW_COL).reset_index()
+        for p in range(n_parts):
+            #Every partition gets a piece of the first chunk, even an empty one, so it always has the typed columns
+            if bounds[p + 1] > bounds[p] or i == 0:
+                SAVE_FRAME(rows.iloc[bounds[p]:bounds[p + 1]], os.path.join(PART_DIR(spill_dir, p), format(i, '08d')))
+        yield chunk
+
+
+#Function Name: READ_PART
+#Function Description: This function reads back the rows of the partition p of spill_dir, in file order and with their original row labels
+#                      A partition nothing was spilled to has no folder; it gives empty, the typed frame without rows of the file (bs_ingest.EMPTY_BS_FRAME)
+def READ_PART(spill_dir, p, empty):
+    part_dir = PART_DIR(spill_dir, p)
+    if not os.path.isdir(part_dir):
+        return empty
+    pieces = [LOAD_FRAME(os.path.join(part_dir, piece)) for piece in sorted(os.listdir(part_dir))]
+    return CONCAT_TYPED(pieces).set_index(BS_ROW_COL).rename_axis(None)
+
+
+#Function Name: PART_MAX
+#Function Description: This function returns the largest value of a column over every partition of spill_dir, reading only that column
+def PART_MAX(spill_dir, n_parts, col):
+    values = []
+    for p in range(n_parts):
+        part_dir = PART_DIR(spill_dir, p)
+        if os.path.isdir(part_dir):
+            values += [LOAD_FRAME(os.path.join(part_dir, piece))[col].max() for piece in os.listdir(part_dir)]
+    values = [v for v in values if not pd.isnull(v)]
+    return max(values) if values else pd.NaT
+
+
+#Function Name: MERGE_PARTS
+#Function Description: This function writes the df_ACCT_MAST_STG1 of the partitions (written by SAVE_FRAME with their row labels in BS_ROW)
+#                      to output_file as one table sorted by the account keys, as the in-memory run writes BS_ACCT_SMRY
+#                      Only the account keys are sorted in memory; the rows are gathered block_rows at a time from the memory-mapped partition results
+def MERGE_PARTS(result_dirs, output_file, block_rows=BS_OOC_BLOCK_ROWS):
+    frames = [LOAD_FRAME(d) for d in result_dirs]
+    if not frames:
+        open(output_file, 'w').close()
+        return 0
+    part = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+    pos = np.concatenate([np.arange(len(f)) for f in frames])
+    order = CONCAT_TYPED([f[ACCT_KEY_COLS] for f in frames]).sort_values(ACCT_KEY_COLS).index.to_numpy()
+
+    #A column takes the common dtype of the partitions, as pd.concat would give it (e.g. float when some partition has NaN in an int column)
+    dtypes = {c: np.result_type(*[f[c].dtype for f in frames]) for c in frames[0].columns
+              if not isinstance(frames[0][c].dtype, pd.CategoricalDtype)}
+
+    #The next block is gathered while the previous one is written
+    writer = OPEN_WRITER(output_file, background=True)
+    try:
+        for start in range(0, len(order), block_rows):
+            rows = order[start:start + block_rows]
+            by_part = np.argsort(part[rows], kind='stable')
+            rows_part = part[rows][by_part]
+            rows_pos = pos[rows][by_part]
+            block = CONCAT_TYPED([frames[q].iloc[rows_pos[rows_part == q]] for q in np.unique(rows_part)])
+            block = block.iloc[np.argsort(by_part)].astype(dtypes).set_index(BS_ROW_COL).rename_axis(None)
+            WRITE_BATCH(writer, block)
+    finally:
+        CLOSE_WRITER(writer)
+    return len(order)
+
+
+#Function Name: OOC_SCORE
+#Function Description: This function scores a transaction file and a balance file of any size into BS_ACCT_SMRY (output_file), one ACCT_ID partition at a time
+#                      The as-of date defaults to the last day-end balance date; n_parts defaults to one partition per BS_OOC_PART_BYTES of the transaction file
+#                      work_dir holds the spilled partitions while the run goes (the system temp folder by default)
+#                      With a memo_file the partitions are scored by bs_memo.MEMO_SCORE_ACCOUNTS; cpty_sketch_size is passed on to SCORE_ACCOUNTS
+#                      Returns the number of accounts written and the memo hit / miss counts summed over the partitions (None without a memo_file)
+def OOC_SCORE(tran_file, bal_file, output_file, as_of_dt=None, n_windows=6, rule='days', recur_mode='auto', amount_type='float32',
+              n_parts=None, work_dir=None, chunksize=BS_CHUNK_SIZE, memo_file=None, cpty_sketch_size=None):
+    n_parts = n_parts or OOC_PARTS(tran_file)
+    spill_dir = tempfile.mkdtemp(prefix='bs_ooc_', dir=work_dir)
+    try:
+        tran_dir = os.path.join(spill_dir, 'tran')
+        bal_dir = os.path.join(spill_dir, 'bal')
+        result_dir = os.path.join(spill_dir, 'smry')
+        tran_schema = AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, amount_type)
+        tran_empty = EMPTY_BS_FRAME(PRESENT_SCHEMA(tran_file, tran_schema, BS_TRAN_OPTIONAL_SCHEMA), ['TRAN_DT'], 'MANUAL_EXCLUSION')
+        bal_empty = EMPTY_BS_FRAME(BS_ACCT_BAL_SCHEMA, ['ACCT_BAL_DT'])
+        #One pass over each file: the thresholds are taken over all the transactions while they are spilled
+        inflow_threshold, outflow_threshold = OUTLIER_THRESHOLDS(SPILL_CHUNKS(ITER_BS_TRAN(tran_file, chunksize, tran_schema), n_parts, tran_dir))
+        for _ in SPILL_CHUNKS(ITER_BS_ACCT_BAL(bal_file, chunksize), n_parts, bal_dir):
+            pass
+        if as_of_dt is None or pd.isnull(as_of_dt):
+            as_of_dt = PART_MAX(bal_dir, n_parts, 'ACCT_BAL_DT')
+            if pd.isnull(as_of_dt):
+                as_of_dt = PART_MAX(tran_dir, n_parts, 'TRAN_DT')
+        df_WINDOWS = BUILD_WINDOWS(as_of_dt, n_windows, rule=rule)
+
+        result_dirs = []
+        memo = None if memo_file is None else {'HITS': 0, 'MISSES': 0, 'EVICTED': 0}
+        for p in range(n_parts):
+            df_tran = READ_PART(tran_dir, p, tran_empty)
+            #Partitions without transactions have no account in df_ACCT_MAST_STG1
+            if len(df_tran):
+                df_tran = SET_RECURRENT_FLAGS(df_tran, recur_mode)
+                if memo_file is None:
+                    df = SCORE_ACCOUNTS(df_tran, READ_PART(bal_dir, p, bal_empty), df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size)[0]
+                else:
+                    df, counts = MEMO_SCORE_ACCOUNTS(df_tran, READ_PART(bal_dir, p, bal_empty), df_WINDOWS, inflow_threshold, outflow_threshold, memo_file,
+                                                     cpty_sketch_size=cpty_sketch_size)
+                    memo = {k: memo[k] + counts[k] for k in memo}
+                result_dirs.append(PART_DIR(result_dir, p))
+                SAVE_FRAME(df.rename_axis(BS_ROW_COL).reset_index(), result_dirs[-1])
+            del df_tran
+            shutil.rmtree(PART_DIR(tran_dir, p), ignore_errors=True)
+            shutil.rmtree(PART_DIR(bal_dir, p), ignore_errors=True)
+        return MERGE_PARTS(result_dirs, output_file), memo
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a bank statement folder larger than memory into BS_ACCT_SMRY, one account partition at a time.')
+    parser.add_argument('folder', help='statement folder holding ' + BS_TRAN_FILE + ' and ' + BS_ACCT_BAL_FILE)
+    parser.add_argument('-o', '--output', default='BS_ACCT_SMRY.csv', help='output (.csv, .csv.gz, .npz or .parquet)')
+    parser.add_argument('--as-of', default=None, help='as-of date, MM/DD/YYYY (default: the last balance date)')
+    parser.add_argument('--windows', type=int, default=6, help='number of windows (M1 to Mn)')
+    parser.add_argument('--window-rule', choices=['days', 'month'], default='days', help='30-day windows ending on the as-of date, or calendar months')
+    parser.add_argument('--recurrent', choices=['auto', 'feed', 'detect'], default='auto',
+                        help='recurrent transaction flags from the feed, detected from the counterparties, or the feed when it has them')
+    parser.add_argument('--amounts', choices=BS_AMOUNT_TYPES, default='float32', help='type of the transaction amounts (minor = exact int64 cents)')
+    parser.add_argument('--parts', type=int, default=None, help='number of ACCT_ID partitions (default: one per 256 MB of transactions)')
+    parser.add_argument('--work-dir', default=None, help='folder of the spilled partitions (default: the system temp folder)')
+    parser.add_argument('--memo', default=None, help='sqlite file memoizing the per-account features across runs (bs_memo)')
+    parser.add_argument('--cpty-sketch', type=int, default=None,
+                        help='keep at most N counterparties per account and window (sketch mode of bs_cpty; approximate shares, default: exact)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_accounts, memo = OOC_SCORE(os.path.join(args.folder, BS_TRAN_FILE), os.path.join(args.folder, BS_ACCT_BAL_FILE), args.output,
+                                 args.as_of and pd.to_datetime(args.as_of, format='%m/%d/%Y'), args.windows, args.window_rule, args.recurrent, args.amounts,
+                                 args.parts, args.work_dir, memo_file=args.memo, cpty_sketch_size=args.cpty_sketch)
+    print(str(n_accounts) + ' accounts scored in ' + format(time.perf_counter() - start, '.2f') + ' s'
+          + ('' if memo is None else ', memo ' + str(memo['HITS']) + ' hits / ' + str(memo['MISSES']) + ' misses'), file=sys.stderr)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Parallel execution of the per-account feature pipeline (bs_pipeline.SCORE_ACCOUNTS) in a process pool.
+#     * Accounts are hash-partitioned into shards by ACCT_ID, so all the rows of an account land in the same shard.
+#     * The tables are written once, grouped by shard, as memory-mapped column files (bs_cache.SAVE_FRAME);
+#       a worker maps them and slices its shard's rows instead of receiving a pickled DataFrame.
+#     * Only the small per-account summaries travel back; they are merged in the account key order of the serial run,
+#       and the row labels of the input are kept, so the result is identical to SCORE_ACCOUNTS on the whole tables.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bs_cache import SAVE_FRAME, LOAD_FRAME
+from bs_pipeline import ACCT_KEY_COLS, OUTLIER_THRESHOLDS, SCORE_ACCOUNTS
+
+BS_ROW_COL = 'BS_ROW'
+
+
+#Function Name: SHARD_OF
+#Function Description: This function returns the shard of every account id (multiplicative hash, the same in every process and run)
+def SHARD_OF(acct_ids, n_shards):
+    h = np.asarray(acct_ids, dtype='int64').astype('uint64') * np.uint64(0x9E3779B97F4A7C15)
+    return ((h >> np.uint64(32)) % np.uint64(n_shards)).astype('int64')
+
+
+#Function Name: WRITE_SHARDS
+#Function Description: This function writes a table into entry_dir with its rows grouped by shard, and returns the row bounds of every shard
+#                      The row labels are saved in the BS_ROW column; rows keep their order within a shard
+def WRITE_SHARDS(df, n_shards, entry_dir):
+    shard = SHARD_OF(df['ACCT_ID'], n_shards)
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+    SAVE_FRAME(df.iloc[order].rename_axis(BS_ROW_COL).reset_index(), entry_dir)
+    return bounds
+
+
+#Function Name: READ_SHARD
+#Function Description: This function maps a table written by WRITE_SHARDS and returns the rows start:stop with their original row labels
+def READ_SHARD(entry_dir, start, stop):
+    df = LOAD_FRAME(entry_dir).iloc[start:stop]
+    return df.set_index(BS_ROW_COL).rename_axis(None)
+
+
+#Function Name: SCORE_SHARD
+#Function Description: This function is the worker task: it runs the pipeline on the rows of one shard and returns its df_ACCT_MAST_STG1
+def SCORE_SHARD(tran_dir, tran_bounds, bal_dir, bal_bounds, df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size=None):
+    df_tran = READ_SHARD(tran_dir, *tran_bounds)
+    df_bal = READ_SHARD(bal_dir, *bal_bounds)
+    return SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size)[0]
+
+
+#Function Name: PARALLEL_SCORE
+#Function Description: This function builds df_ACCT_MAST_STG1 with the pipeline running on n_workers processes, over n_shards account shards (one per worker by default)
+#                      The thresholds must be taken over all the transactions (bs_pipeline.OUTLIER_THRESHOLDS), never per shard
+#                      work_dir holds the shard files while the pool runs (the system temp folder by default); with n_workers <= 1 the pipeline runs serially
+#                      cpty_sketch_size is passed on to SCORE_ACCOUNTS
+def PARALLEL_SCORE(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, n_workers, n_shards=None, work_dir=None, cpty_sketch_size=None):
+    if n_workers <= 1:
+        return SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size)[0]
+    n_shards = n_shards or n_workers
+
+    shard_dir = tempfile.mkdtemp(prefix='bs_shards_', dir=work_dir)
+    try:
+        tran_dir = os.path.join(shard_dir, 'tran')
+        bal_dir = os.path.join(shard_dir, 'bal')
+        tran_bounds = WRITE_SHARDS(df_tran, n_shards, tran_dir)
+        bal_bounds = WRITE_SHARDS(df_bal, n_shards, bal_dir)
+        #Shards without transactions have no account in df_ACCT_MAST_STG1
+        shards = [s for s in range(n_shards) if tran_bounds[s + 1] > tran_bounds[s]]
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(SCORE_SHARD, tran_dir, tran_bounds[s:s + 2], bal_dir, bal_bounds[s:s + 2],
+                                   df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size) for s in shards]
+            results = [f.result() for f in futures]
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    #Shards hold disjoint accounts, so the serial row order is the account key order of the concatenation
+    return pd.concat(results).sort_values(ACCT_KEY_COLS)
+
+
+#Function Name: BENCH_PARALLEL_SCORE
+#Function Description: This function times PARALLEL_SCORE for 1 to max_workers workers (best of repeat runs) and checks every result against the serial one
+def BENCH_PARALLEL_SCORE(df_tran, df_bal, df_WINDOWS, max_workers, repeat=3):
+    inflow_threshold, outflow_threshold = OUTLIER_THRESHOLDS(df_tran)
+    serial = None
+    rows = []
+    for n_workers in range(1, max_workers + 1):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            df = PARALLEL_SCORE(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, n_workers)
+            seconds.append(time.perf_counter() - start)
+        if serial is None:
+            serial = df
+        pd.testing.assert_frame_equal(df, serial, check_exact=True)
+        rows.append({'WORKERS': n_workers, 'SECONDS': min(seconds)})
+    df_BENCH = pd.DataFrame(rows).set_index('WORKERS')
+    df_BENCH['SPEEDUP'] = df_BENCH['SECONDS'].iloc[0] / df_BENCH['SECONDS']
+    return df_BENCH
+
+
+if __name__ == '__main__':
+    #Scaling benchmark: python bs_parallel.py <statement folder> <as-of date> [max workers]
+    from bs_ingest import READ_BS_TRAN, READ_BS_ACCT_BAL, BS_TRAN_FILE, BS_ACCT_BAL_FILE
+    from bs_window import BUILD_WINDOWS
+    folder = sys.argv[1]
+    df_WINDOWS = BUILD_WINDOWS(sys.argv[2])
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    df_tran = READ_BS_TRAN(os.path.join(folder, BS_TRAN_FILE))
+    df_bal = READ_BS_ACCT_BAL(os.path.join(folder, BS_ACCT_BAL_FILE))
+    print(BENCH_PARALLEL_SCORE(df_tran, df_bal, df_WINDOWS, max_workers))
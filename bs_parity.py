@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Parity check of the vectorized transaction summary (bs_tran_smry.BUILD_MONTHLY_TRAN_SMRY) against the original groupby.apply definition.
+#     * REF_MONTHLY_TRAN_SMRY is the MONTHLY_TRAN_SMRY of the original notebook, kept as the reference definition of the features:
+#       the same row filters on the M1-M6 timestamp columns, the outlier cut-offs being passed in instead of read from globals.
+#     * BROADCAST_WINDOWS puts the window table back on every transaction as M*_START_DT / M*_END_DT columns, as the notebook did, for the reference to read.
+#     * CHECK_MONTHLY_TRAN_SMRY compares both on a statement and raises on any difference: same index and columns, identical counts, maxima and LAST_TRAN_DT,
+#       sums within float32 rounding (the grouped sums accumulate in another order); the reference takes seconds per hundred accounts.
+#     * The command line runs the check on a bs_synth statement (with the global and the per-account outlier thresholds).
+#
+# Usage: python bs_parity.py [--accounts N] [--seed N] [--as-of MM/DD/YYYY] [--amount-type float32|float64|minor]
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import is_integer_dtype
+
+from bs_ingest import BS_TRAN_FILE, BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES, MINOR_UNIT_SCALE, AMOUNT_SCHEMA, READ_BS_TRAN
+from bs_pipeline import AMOUNT_COLS, OUTLIER_THRESHOLDS, ACCOUNT_OUTLIER_THRESHOLDS
+from bs_synth import WRITE_SYNTH_STATEMENT
+from bs_tran_smry import BUILD_MONTHLY_TRAN_SMRY
+from bs_window import BUILD_WINDOWS
+
+#Relative tolerance of the amount sums
+PARITY_RTOL = 1e-6
+
+
+#Function Name: REF_MONTHLY_TRAN_SMRY
+#Function Description: This function sets up the conditions for aggregating OUTFLOW & outflow attributes for last 6 months (the original definition, for one account)
+#                      x = the transactions of the account with the M1-M6 timestamp columns (BROADCAST_WINDOWS); the thresholds are the OUTLIER_* cut-offs
+def REF_MONTHLY_TRAN_SMRY(x, inflow_threshold, outflow_threshold):
+    names = {
+        'TTL_REV_AMT_M1': x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_REV_AMT_M2': x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_REV_AMT_M3': x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_REV_AMT_M4': x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_REV_AMT_M5': x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_REV_AMT_M6': x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['REVENUE_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_AMT_M1': x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M1': x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_INFLOW_AMT_M2': x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M2': x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_INFLOW_AMT_M3': x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M3': x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_INFLOW_AMT_M4': x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M4': x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_INFLOW_AMT_M5': x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M5': x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_INFLOW_AMT_M6': x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT'])]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_INFLOW_CNT_M6': x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['INFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M1': x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M1': x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M2': x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M2': x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M3': x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M3': x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M4': x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M4': x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M5': x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M5': x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'TTL_OUTFLOW_AMT_M6': x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'TTL_OUTFLOW_CNT_M6': x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0)]['OUTFLOW_TRAN_AMT_HKD'].count(),
+        'MAX_INFLOW_TRAN_AMT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT'])]['INFLOW_TRAN_AMT_HKD'].max(),
+        'MAX_OUTFLOW_TRAN_AMT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT'])]['OUTFLOW_TRAN_AMT_HKD'].max(),
+        'TTL_TRAN_CNT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'TTL_TRAN_CNT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'TTL_TRAN_CNT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'TTL_TRAN_CNT_M4':x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'TTL_TRAN_CNT_M5':x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'TTL_TRAN_CNT_M6':x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & ((x['OUTFLOW_TRAN_AMT_HKD'] > 0) | (x['INFLOW_TRAN_AMT_HKD'] > 0))]['TRAN_DT'].count(),
+        'LAST_TRAN_DT':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0)]['TRAN_DT'].max(),
+        'OUTLIER_INFLOW_TRAN_CNT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_INFLOW_TRAN_CNT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_INFLOW_TRAN_CNT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_INFLOW_TRAN_CNT_M4':x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_INFLOW_TRAN_CNT_M5':x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_INFLOW_TRAN_CNT_M6':x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > inflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M4':x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M5':x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'OUTLIER_OUTFLOW_TRAN_CNT_M6':x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > outflow_threshold)]['TRAN_DT'].count(),
+        'RECUR_INFLOW_TRAN_AMT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_INFLOW_TRAN_AMT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_INFLOW_TRAN_AMT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_INFLOW_TRAN_AMT_M4':x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_INFLOW_TRAN_AMT_M5':x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_INFLOW_TRAN_AMT_M6':x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['INFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M4':x[(x['TRAN_DT'] <= x['M4_END_DT']) & (x['TRAN_DT'] >= x['M4_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M5':x[(x['TRAN_DT'] <= x['M5_END_DT']) & (x['TRAN_DT'] >= x['M5_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_AMT_M6':x[(x['TRAN_DT'] <= x['M6_END_DT']) & (x['TRAN_DT'] >= x['M6_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['OUTFLOW_TRAN_AMT_HKD'].sum(),
+        'RECUR_OUTFLOW_TRAN_CNT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count(),
+        'RECUR_OUTFLOW_TRAN_CNT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count(),
+        'RECUR_OUTFLOW_TRAN_CNT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['OUTFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count(),
+        'RECUR_INFLOW_TRAN_CNT_M1':x[(x['TRAN_DT'] <= x['M1_END_DT']) & (x['TRAN_DT'] >= x['M1_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count(),
+        'RECUR_INFLOW_TRAN_CNT_M2':x[(x['TRAN_DT'] <= x['M2_END_DT']) & (x['TRAN_DT'] >= x['M2_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count(),
+        'RECUR_INFLOW_TRAN_CNT_M3':x[(x['TRAN_DT'] <= x['M3_END_DT']) & (x['TRAN_DT'] >= x['M3_START_DT']) & (x['INFLOW_TRAN_AMT_HKD'] > 0) & (x['RECURRENT_INFLOW_TRAN_FLG'] == 1)]['TRAN_DT'].count()
+    }
+    return pd.Series(names, index=['TTL_REV_AMT_M1','TTL_REV_AMT_M2','TTL_REV_AMT_M3','TTL_REV_AMT_M4','TTL_REV_AMT_M5','TTL_REV_AMT_M6','TTL_OUTFLOW_AMT_M1','TTL_OUTFLOW_AMT_M2','TTL_OUTFLOW_AMT_M3','TTL_OUTFLOW_AMT_M4',                    'TTL_OUTFLOW_AMT_M5','TTL_OUTFLOW_AMT_M6','TTL_OUTFLOW_CNT_M1','TTL_OUTFLOW_CNT_M2','TTL_OUTFLOW_CNT_M3',                    'TTL_OUTFLOW_CNT_M4','TTL_OUTFLOW_CNT_M5','TTL_OUTFLOW_CNT_M6','TTL_INFLOW_AMT_M1','TTL_INFLOW_AMT_M2',                    'TTL_INFLOW_AMT_M3','TTL_INFLOW_AMT_M4','TTL_INFLOW_AMT_M5','TTL_INFLOW_AMT_M6','TTL_INFLOW_CNT_M1',                    'TTL_INFLOW_CNT_M2','TTL_INFLOW_CNT_M3','TTL_INFLOW_CNT_M4','TTL_INFLOW_CNT_M5','TTL_INFLOW_CNT_M6',                    'MAX_INFLOW_TRAN_AMT_M1','MAX_OUTFLOW_TRAN_AMT_M1','TTL_TRAN_CNT_M1','TTL_TRAN_CNT_M2','TTL_TRAN_CNT_M3',                    'TTL_TRAN_CNT_M4','TTL_TRAN_CNT_M5','TTL_TRAN_CNT_M6','LAST_TRAN_DT','OUTLIER_INFLOW_TRAN_CNT_M1',                    'OUTLIER_INFLOW_TRAN_CNT_M2','OUTLIER_INFLOW_TRAN_CNT_M3','OUTLIER_INFLOW_TRAN_CNT_M4','OUTLIER_INFLOW_TRAN_CNT_M5',                    'OUTLIER_INFLOW_TRAN_CNT_M6','OUTLIER_OUTFLOW_TRAN_CNT_M1','OUTLIER_OUTFLOW_TRAN_CNT_M2','OUTLIER_OUTFLOW_TRAN_CNT_M3',                    'OUTLIER_OUTFLOW_TRAN_CNT_M4','OUTLIER_OUTFLOW_TRAN_CNT_M5','OUTLIER_OUTFLOW_TRAN_CNT_M6','RECUR_INFLOW_TRAN_AMT_M1',                    'RECUR_INFLOW_TRAN_AMT_M2','RECUR_INFLOW_TRAN_AMT_M3','RECUR_INFLOW_TRAN_AMT_M4','RECUR_INFLOW_TRAN_AMT_M5','RECUR_INFLOW_TRAN_AMT_M6',                    'RECUR_OUTFLOW_TRAN_AMT_M1','RECUR_OUTFLOW_TRAN_AMT_M2','RECUR_OUTFLOW_TRAN_AMT_M3','RECUR_OUTFLOW_TRAN_AMT_M4',                    'RECUR_OUTFLOW_TRAN_AMT_M5','RECUR_OUTFLOW_TRAN_AMT_M6','RECUR_OUTFLOW_TRAN_CNT_M1','RECUR_OUTFLOW_TRAN_CNT_M2','RECUR_OUTFLOW_TRAN_CNT_M3',                    'RECUR_INFLOW_TRAN_CNT_M1','RECUR_INFLOW_TRAN_CNT_M2','RECUR_INFLOW_TRAN_CNT_M3'])
+
+
+#Function Name: BROADCAST_WINDOWS
+#Function Description: This function returns the transactions with the M*_START_DT / M*_END_DT columns of the window table on every row
+def BROADCAST_WINDOWS(df, df_WINDOWS):
+    df = df.copy()
+    for window, row in df_WINDOWS.iterrows():
+        df[window + '_START_DT'] = row['START_DT']
+        df[window + '_END_DT'] = row['END_DT']
+    return df
+
+
+#Function Name: ACCOUNT_THRESHOLD
+#Function Description: This function returns the outlier threshold of an account: the scalar threshold, or the account's one in a per-account Series (none: no outliers)
+def ACCOUNT_THRESHOLD(threshold, acct_id):
+    return threshold.get(acct_id, np.inf) if isinstance(threshold, pd.Series) else threshold
+
+
+#Function Name: CHECK_MONTHLY_TRAN_SMRY
+#Function Description: This function compares BUILD_MONTHLY_TRAN_SMRY with the reference (REF_MONTHLY_TRAN_SMRY per account) on a statement of the 6 windows
+#                      The thresholds are scalars or per-account Series (bs_pipeline.ACCOUNT_OUTLIER_THRESHOLDS); with amounts in minor units the reference is run in HKD
+#                      Raises a ValueError naming the mismatching columns; returns the number of accounts checked
+def CHECK_MONTHLY_TRAN_SMRY(df_tran, df_WINDOWS, inflow_threshold, outflow_threshold, rtol=PARITY_RTOL):
+    df_ref_tran = BROADCAST_WINDOWS(df_tran, df_WINDOWS)
+    ref_inflow, ref_outflow = inflow_threshold, outflow_threshold
+    if is_integer_dtype(df_tran['INFLOW_TRAN_AMT_HKD']):
+        df_ref_tran[AMOUNT_COLS] = df_ref_tran[AMOUNT_COLS] / MINOR_UNIT_SCALE
+        ref_inflow, ref_outflow = inflow_threshold / MINOR_UNIT_SCALE, outflow_threshold / MINOR_UNIT_SCALE
+    accounts = df_ref_tran.groupby('ACCT_ID')
+    df_REF = pd.DataFrame([REF_MONTHLY_TRAN_SMRY(x, ACCOUNT_THRESHOLD(ref_inflow, acct_id), ACCOUNT_THRESHOLD(ref_outflow, acct_id))
+                           for acct_id, x in accounts], index=pd.Index(list(accounts.groups), name='ACCT_ID'))
+    df_NEW = BUILD_MONTHLY_TRAN_SMRY(df_tran, df_WINDOWS, inflow_threshold, outflow_threshold)
+
+    if list(df_NEW.columns) != list(df_REF.columns) or not df_NEW.index.equals(df_REF.index):
+        raise ValueError('BUILD_MONTHLY_TRAN_SMRY differs from the reference in its columns / index')
+    mismatches = []
+    for col in df_REF.columns:
+        ref, new = df_REF[col], df_NEW[col]
+        if col == 'LAST_TRAN_DT':
+            same = pd.to_datetime(ref).equals(pd.to_datetime(new))
+        else:
+            same = np.allclose(new.astype('float64'), ref.astype('float64'), rtol=rtol, atol=0, equal_nan=True)
+        if not same:
+            mismatches.append(col)
+    if mismatches:
+        raise ValueError('BUILD_MONTHLY_TRAN_SMRY differs from the reference in ' + ', '.join(mismatches))
+    return len(df_REF)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check BUILD_MONTHLY_TRAN_SMRY against the original MONTHLY_TRAN_SMRY on a synthetic statement.')
+    parser.add_argument('--accounts', type=int, default=50, help='number of synthetic accounts')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic statement')
+    parser.add_argument('--as-of', default='10/26/2019', help='as-of date of the 6 windows (MM/DD/YYYY)')
+    parser.add_argument('--amount-type', default='float32', choices=BS_AMOUNT_TYPES, help='how the amounts are held')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='bs_parity_')
+    WRITE_SYNTH_STATEMENT(folder, args.accounts, seed=args.seed)
+    df_tran = READ_BS_TRAN(os.path.join(folder, BS_TRAN_FILE), schema=AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, args.amount_type))
+    df_WINDOWS = BUILD_WINDOWS(pd.to_datetime(args.as_of, format='%m/%d/%Y'))
+    for mode, thresholds in [('global', OUTLIER_THRESHOLDS(df_tran)), ('account', ACCOUNT_OUTLIER_THRESHOLDS(df_tran))]:
+        n_accounts = CHECK_MONTHLY_TRAN_SMRY(df_tran, df_WINDOWS, *thresholds)
+        print(mode + ' thresholds: BUILD_MONTHLY_TRAN_SMRY matches MONTHLY_TRAN_SMRY on ' + str(n_accounts) + ' accounts', file=sys.stderr)
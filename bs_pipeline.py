@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * The per-account feature pipeline of test.py as one function, from the typed raw tables to df_ACCT_MAST_STG1.
+#     * The day-level features are reductions over the dense account x day store (bs_daymat), not over the long daily table.
+#     * Every stage only looks at the rows of one account, so the pipeline can run on any subset of the accounts (see bs_parallel).
+#     * The outlier thresholds are taken over all the transactions (OUTLIER_THRESHOLDS) or per account (ACCOUNT_OUTLIER_THRESHOLDS) and passed in.
+
+import pandas as pd
+
+from bs_cpty import BUILD_CPTY_SMRY
+from bs_daymat import BUILD_DAY_MATRIX, BUILD_DAY_SMRY
+from bs_prof import PROFILED
+from bs_stats import WELFORD_COLUMNS, WELFORD_MEAN, WELFORD_STD, SKETCH_ALPHA, SKETCH_COUNTS, SKETCH_MERGE, SKETCH_QUANTILE
+from bs_tran_smry import BUILD_MONTHLY_TRAN_SMRY
+
+ACCT_KEY_COLS = ['CUST_ID', 'CUST_NAME', 'ACCT_ID', 'ACCT_TYP']
+AMOUNT_COLS = ['INFLOW_TRAN_AMT_HKD', 'OUTFLOW_TRAN_AMT_HKD']
+OUTLIER_STD_MULT = 2.5
+OUTLIER_IQR_MULT = 1.5
+
+
+#Function Name: OUTLIER_THRESHOLDS
+#Function Description: This function returns the inflow / outflow outlier thresholds (mean + 2.5 * stddev of all the transaction amounts)
+#                      df_tran is the transaction table or an iterable of its chunks (e.g. bs_ingest.ITER_BS_TRAN); the statistics are taken in one pass of Welford states
+def OUTLIER_THRESHOLDS(df_tran):
+    chunks = [df_tran] if isinstance(df_tran, pd.DataFrame) else df_tran
+    states = WELFORD_COLUMNS(chunks, AMOUNT_COLS)
+    return tuple(WELFORD_MEAN(states[col]) + OUTLIER_STD_MULT * WELFORD_STD(states[col]) for col in AMOUNT_COLS)
+
+
+#Function Name: ACCOUNT_OUTLIER_THRESHOLDS
+#Function Description: This function returns robust inflow / outflow outlier thresholds per account: upper quartile + k * interquartile range of the account's positive amounts
+#                      The quartiles come from quantile sketches (bs_stats.SKETCH_COUNTS) merged over the chunks, so they are within alpha of the exact ones
+#                      The thresholds are Series indexed by ACCT_ID and can be passed wherever the global thresholds are
+def ACCOUNT_OUTLIER_THRESHOLDS(df_tran, k=OUTLIER_IQR_MULT, alpha=SKETCH_ALPHA):
+    chunks = [df_tran] if isinstance(df_tran, pd.DataFrame) else df_tran
+    sketches = {}
+    for chunk in chunks:
+        for col in AMOUNT_COLS:
+            sketch = SKETCH_COUNTS(chunk['ACCT_ID'], chunk[col], alpha)
+            sketches[col] = SKETCH_MERGE(sketches[col], sketch) if col in sketches else sketch
+    thresholds = []
+    for col in AMOUNT_COLS:
+        q1 = SKETCH_QUANTILE(sketches[col], 0.25, ['ACCT_ID'], alpha)
+        q3 = SKETCH_QUANTILE(sketches[col], 0.75, ['ACCT_ID'], alpha)
+        thresholds.append(q3 + k * (q3 - q1))
+    return tuple(thresholds)
+
+
+#Function Name: SCORE_ACCOUNTS
+#Function Description: This function runs the feature pipeline of test.py on a transaction table and a day-end balance table
+#                      cpty_sketch_size = None sums every counterparty exactly, an integer m runs the counterparty stage in sketch mode (bs_cpty.BUILD_CPTY_SMRY)
+#                      Returns df_ACCT_MAST_STG1 (one row per account, sorted by the account keys) and the account x day store the day-level features came from
+def SCORE_ACCOUNTS(df_tran, df_bal, df_WINDOWS, inflow_threshold, outflow_threshold, cpty_sketch_size=None):
+    df_ACCT_MAST_STG1 = df_tran[ACCT_KEY_COLS].drop_duplicates().sort_values(ACCT_KEY_COLS)
+    df_MONTHLY_TRAN_SMRY = PROFILED('MONTHLY_TRAN_SMRY', BUILD_MONTHLY_TRAN_SMRY, df_tran, df_WINDOWS, inflow_threshold, outflow_threshold)
+
+    DAY_MATRIX = PROFILED('DAY_MATRIX', BUILD_DAY_MATRIX, df_bal, df_tran, df_WINDOWS)
+    df_MONTHLY_BAL_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2 = PROFILED('DAY_SMRY', BUILD_DAY_SMRY, DAY_MATRIX, df_WINDOWS)
+    df_CPTY_SMRY = PROFILED('CPTY_SMRY', BUILD_CPTY_SMRY, df_tran, df_WINDOWS, sketch_size=cpty_sketch_size)
+
+    for smry in [df_MONTHLY_BAL_SMRY, df_MONTHLY_TRAN_SMRY, df_TRAN_FLG_SMRY, df_TRAN_FLG_STG2, df_CPTY_SMRY]:
+        df_ACCT_MAST_STG1 = PROFILED('JOINS', pd.DataFrame.join, df_ACCT_MAST_STG1, smry, on='ACCT_ID')
+    return df_ACCT_MAST_STG1, DAY_MATRIX
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Stage profiler of the scorecard pipeline: where the time and the memory of a run go.
+#     * The stages are the calls wrapped in PROFILED (in test.py, bs_pipeline.SCORE_ACCOUNTS, bs_daymat.BUILD_DAY_SMRY and the chunked ingestion of bs_ingest).
+#       Each records its wall and CPU time, its peak RSS delta (the high-water mark of the resident memory during the stage, above the resident memory it started with)
+#       and its input / output row counts (rows of the DataFrame / Series arguments, rows of the result).
+#     * A stage called several times (e.g. once per csv chunk) is recorded once, with the sums of the times and row counts over its CALLS.
+#       A stage run within another is recorded under it (PARENT), so the parent's times include it.
+#     * The profiler is off unless START_PROFILE was called: PROFILED is then a plain call of the function, with one global lookup of overhead.
+#     * The peak RSS comes from /proc/self/status, the high-water mark being reset at every stage start (/proc/self/clear_refs, Linux);
+#       elsewhere the growth of the process' maximum RSS (getrusage) is reported instead, which misses the peaks below an earlier one.
+#     * WRITE_PROFILE_REPORT writes the stages, with an optional breakdown of the slowest accounts (PROFILE_ACCOUNTS), as a json report.
+
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#The profile of the run being profiled (None: profiling off)
+ACTIVE_PROFILE = None
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+#Written to clear_refs, resets the peak RSS (VmHWM) of the process to its current RSS
+PROC_RESET_PEAK_RSS = '5'
+MB = 2 ** 20
+#Accounts rescored on their own by PROFILE_ACCOUNTS (those with the most rows)
+PROFILE_SAMPLE_ACCOUNTS = 50
+
+
+#Function Name: PROC_RSS
+#Function Description: This function returns the (current RSS, peak RSS) of the process in bytes, from /proc/self/status
+def PROC_RSS():
+    rss = {}
+    with open(PROC_STATUS) as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                rss[line[:5]] = int(line.split()[1]) * 1024
+    return rss['VmRSS'], rss['VmHWM']
+
+
+#Function Name: RESET_PEAK_RSS
+#Function Description: This function resets the peak RSS of the process to its current RSS; returns False where the system cannot
+def RESET_PEAK_RSS():
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as f:
+            f.write(PROC_RESET_PEAK_RSS)
+        return True
+    except OSError:
+        return False
+
+
+#Function Name: MAX_RSS
+#Function Description: This function returns the maximum RSS the process has reached, in bytes (getrusage; 0 where it is not available)
+def MAX_RSS():
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+#Function Name: START_PROFILE
+#Function Description: This function switches the profiler on, with a new profile, and returns it
+def START_PROFILE():
+    global ACTIVE_PROFILE
+    ACTIVE_PROFILE = {'STAGES': {}, 'OPEN': [], 'RESET_PEAK': RESET_PEAK_RSS() and os.path.exists(PROC_STATUS),
+                      'WALL': time.perf_counter(), 'CPU': time.process_time()}
+    return ACTIVE_PROFILE
+
+
+#Function Name: STOP_PROFILE
+#Function Description: This function switches the profiler off and returns the profile, with the wall / CPU time from START_PROFILE
+def STOP_PROFILE():
+    global ACTIVE_PROFILE
+    profile, ACTIVE_PROFILE = ACTIVE_PROFILE, None
+    if profile is not None:
+        profile['WALL'] = time.perf_counter() - profile['WALL']
+        profile['CPU'] = time.process_time() - profile['CPU']
+    return profile
+
+
+#Function Name: ROW_COUNT
+#Function Description: This function returns the rows of the DataFrames / Series among values (None if there are none)
+#                      A tuple or list among values (e.g. of chunks, or the tables a stage returns) counts the rows of its DataFrames / Series
+def ROW_COUNT(values):
+    rows = None
+    for value in values:
+        if isinstance(value, (tuple, list)):
+            n = ROW_COUNT(value)
+        else:
+            n = len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+        if n is not None:
+            rows = n if rows is None else rows + n
+    return rows
+
+
+#Function Name: PROFILED
+#Function Description: This function returns fn(*args, **kwargs), recording it as the given stage of the active profile (if any)
+def PROFILED(stage, fn, *args, **kwargs):
+    profile = ACTIVE_PROFILE
+    if profile is None:
+        return fn(*args, **kwargs)
+
+    parent = profile['OPEN'][-1]['STAGE'] if profile['OPEN'] else None
+    record = profile['STAGES'].setdefault((parent, stage), {'STAGE': stage, 'PARENT': parent, 'CALLS': 0, 'WALL_S': 0.0, 'CPU_S': 0.0,
+                                                            'PEAK_RSS_DELTA_MB': 0.0, 'ROWS_IN': None, 'ROWS_OUT': None})
+    if profile['RESET_PEAK']:
+        #The peak of the enclosing stages so far is kept before it is reset for this one
+        rss, peak = PROC_RSS()
+        for frame in profile['OPEN']:
+            frame['PEAK'] = max(frame['PEAK'], peak)
+        RESET_PEAK_RSS()
+    else:
+        rss = MAX_RSS()
+    frame = {'STAGE': stage, 'PEAK': rss}
+    profile['OPEN'].append(frame)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        profile['OPEN'].pop()
+    peak = max(frame['PEAK'], PROC_RSS()[1] if profile['RESET_PEAK'] else MAX_RSS())
+    if profile['OPEN']:
+        profile['OPEN'][-1]['PEAK'] = max(profile['OPEN'][-1]['PEAK'], peak)
+
+    record['CALLS'] += 1
+    record['WALL_S'] += wall
+    record['CPU_S'] += cpu
+    record['PEAK_RSS_DELTA_MB'] = max(record['PEAK_RSS_DELTA_MB'], (peak - rss) / MB)
+    for key, rows in [('ROWS_IN', ROW_COUNT(list(args) + list(kwargs.values()))), ('ROWS_OUT', ROW_COUNT([result]))]:
+        if rows is not None:
+            record[key] = rows if record[key] is None else record[key] + rows
+    return result
+
+
+#Function Name: PROFILE_ACCOUNTS
+#Function Description: This function runs score(df_tran rows of the account, df_bal rows of the account, *args) on a bounded sample of the accounts, each on its own,
+#                      and returns the n slowest of them (ACCT_ID, WALL_S, CPU_S, TRAN_ROWS, BAL_ROWS), slowest first
+#                      score is e.g. bs_pipeline.SCORE_ACCOUNTS and df_bal the raw day-end balances it takes; as every account is a whole pipeline run,
+#                      only the max(sample, n) accounts with the most transaction and balance rows are rescored, the others being the quick ones
+def PROFILE_ACCOUNTS(score, df_tran, df_bal, n, *args, sample=PROFILE_SAMPLE_ACCOUNTS):
+    tran_rows = df_tran['ACCT_ID'].value_counts()
+    bal_rows = df_bal['ACCT_ID'].value_counts().reindex(tran_rows.index, fill_value=0)
+    picked = (tran_rows + bal_rows).nlargest(max(sample, n)).index
+    df_tran = df_tran[df_tran['ACCT_ID'].isin(picked)]
+    df_bal = df_bal[df_bal['ACCT_ID'].isin(picked)]
+    bal_groups = dict(iter(df_bal.groupby('ACCT_ID', sort=False)))
+    empty_bal = df_bal.iloc[:0]
+    accounts = []
+    for acct_id, tran in df_tran.groupby('ACCT_ID', sort=False):
+        bal = bal_groups.get(acct_id, empty_bal)
+        wall, cpu = time.perf_counter(), time.process_time()
+        score(tran, bal, *args)
+        accounts.append({'ACCT_ID': int(acct_id), 'WALL_S': time.perf_counter() - wall, 'CPU_S': time.process_time() - cpu,
+                         'TRAN_ROWS': len(tran), 'BAL_ROWS': len(bal)})
+    return sorted(accounts, key=lambda a: a['WALL_S'], reverse=True)[:n]
+
+
+#Function Name: PROFILE_REPORT
+#Function Description: This function returns the report of a stopped profile: the run's wall / CPU time, the way the peak RSS was measured,
+#                      the stages in the order they were first run, and the slowest accounts if given (PROFILE_ACCOUNTS)
+def PROFILE_REPORT(profile, slowest_accounts=None):
+    report = {'WALL_S': profile['WALL'], 'CPU_S': profile['CPU'], 'PEAK_RSS': 'VmHWM' if profile['RESET_PEAK'] else 'ru_maxrss',
+              'STAGES': list(profile['STAGES'].values())}
+    if slowest_accounts is not None:
+        report['SLOWEST_ACCOUNTS'] = slowest_accounts
+    return report
+
+
+#Function Name: WRITE_PROFILE_REPORT
+#Function Description: This function writes PROFILE_REPORT as json to file
+def WRITE_PROFILE_REPORT(profile, file, slowest_accounts=None):
+    with open(file, 'w') as f:
+        json.dump(PROFILE_REPORT(profile, slowest_accounts), f, indent=1)
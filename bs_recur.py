@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Detection of the seemingly recurrent transactions (RECURRENT_INFLOW_TRAN_FLG / RECURRENT_OUTFLOW_TRAN_FLG) from the transactions themselves.
+#     * The inflows and the outflows of an account are grouped by counterparty and amount bucket: a bucket is a run of amounts
+#       where each is within RECUR_AMOUNT_TOL (10%) of the next smaller one.
+#     * A group is recurrent when it has at least RECUR_MIN_CNT transactions, its median interval is between RECUR_MIN_DAYS and RECUR_MAX_DAYS
+#       (weekly to monthly), and at least RECUR_MIN_REGULAR of its intervals are within RECUR_INTERVAL_TOL of the median.
+#     * Every step is a sort or a reduction over the sorted rows, so the cost grows as n log n in the number of transactions;
+#       no pair of transactions is ever compared.
+#     * Feeds without a COUNTERPARTY column are grouped by amount bucket alone.
+
+import numpy as np
+import pandas as pd
+
+from bs_cpty import CPTY_COL
+
+RECUR_AMOUNT_TOL = 0.1
+RECUR_MIN_CNT = 3
+RECUR_MIN_DAYS = 6
+RECUR_MAX_DAYS = 35
+RECUR_INTERVAL_TOL = 0.25
+RECUR_MIN_REGULAR = 0.75
+
+#Recurrent flag column of every amount column
+RECUR_FLAG_COLS = {'INFLOW_TRAN_AMT_HKD': 'RECURRENT_INFLOW_TRAN_FLG', 'OUTFLOW_TRAN_AMT_HKD': 'RECURRENT_OUTFLOW_TRAN_FLG'}
+
+
+#Function Name: RECUR_GROUP_FLAGS
+#Function Description: This function flags the transactions of the regular groups, given per transaction the account, the counterparty code,
+#                      the amount (> 0) and the date as a day number; returns a 0 / 1 int8 array in the input order
+def RECUR_GROUP_FLAGS(acct, cpty, amount, day):
+    flag = np.zeros(len(acct), dtype='int8')
+    if not len(acct):
+        return flag
+
+    #Amount buckets: sorted by amount within the counterparty, a new bucket starts at a jump of more than RECUR_AMOUNT_TOL,
+    #so close amounts are never split by a fixed bucket edge
+    order = np.lexsort((amount, cpty, acct))
+    new_key = np.concatenate([[True], (np.diff(acct[order]) != 0) | (np.diff(cpty[order]) != 0)])
+    jump = np.concatenate([[True], amount[order][1:] > amount[order][:-1] * (1 + RECUR_AMOUNT_TOL)])
+    bucket = np.empty(len(acct), dtype='int64')
+    bucket[order] = np.cumsum(new_key | jump)
+
+    #Then one sort by bucket and date puts every group together, in date order
+    order = np.lexsort((day, bucket))
+    first = np.concatenate([[True], np.diff(bucket[order]) != 0])
+    group = np.cumsum(first) - 1
+    gap = np.diff(day[order], prepend=0).astype('float64')
+    gap[first] = np.nan
+
+    gaps = pd.Series(gap).groupby(group)
+    median = gaps.median().to_numpy()
+    n_gaps = gaps.count().to_numpy()
+    regular = np.abs(gap - median[group]) <= RECUR_INTERVAL_TOL * median[group]
+    n_regular = pd.Series(regular).groupby(group).sum().to_numpy()
+
+    recurrent = ((n_gaps + 1 >= RECUR_MIN_CNT) & (median >= RECUR_MIN_DAYS) & (median <= RECUR_MAX_DAYS)
+                 & (n_regular >= RECUR_MIN_REGULAR * n_gaps))
+    flag[order] = recurrent[group]
+    return flag
+
+
+#Function Name: DETECT_RECURRENT
+#Function Description: This function returns the RECURRENT_INFLOW_TRAN_FLG / RECURRENT_OUTFLOW_TRAN_FLG columns (int8, on df's index) detected from the transactions
+#                      Transactions with a missing counterparty are never recurrent
+def DETECT_RECURRENT(df):
+    acct = df['ACCT_ID'].to_numpy(dtype='int64')
+    day = df['TRAN_DT'].to_numpy(dtype='datetime64[D]').astype('int64')
+    cpty = pd.factorize(df[CPTY_COL])[0] if CPTY_COL in df else np.zeros(len(df), dtype='int64')
+    flags = {}
+    for amount_col, flag_col in RECUR_FLAG_COLS.items():
+        amount = df[amount_col].to_numpy(dtype='float64')
+        rows = np.flatnonzero((amount > 0) & (cpty >= 0))
+        flag = np.zeros(len(df), dtype='int8')
+        flag[rows] = RECUR_GROUP_FLAGS(acct[rows], cpty[rows], amount[rows], day[rows])
+        flags[flag_col] = flag
+    return pd.DataFrame(flags, index=df.index)
+
+
+#Function Name: SET_RECURRENT_FLAGS
+#Function Description: This function returns the transactions with their recurrent flags taken according to mode:
+#                      'feed' keeps the flags of the raw file, 'detect' replaces them by DETECT_RECURRENT,
+#                      'auto' keeps them when the file has them and detects them otherwise
+def SET_RECURRENT_FLAGS(df, mode='auto'):
+    if mode not in ('feed', 'detect', 'auto'):
+        raise ValueError('unknown recurrent flag mode ' + repr(mode))
+    has_flags = all(col in df for col in RECUR_FLAG_COLS.values())
+    if mode == 'feed' and not has_flags:
+        raise ValueError('the transactions have no RECURRENT_*_TRAN_FLG columns; use the detect mode')
+    if mode == 'feed' or (mode == 'auto' and has_flags):
+        return df
+    return df.assign(**DETECT_RECURRENT(df))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Resident scoring service: the scorecard attributes of one applicant per request, from a process that has pandas and the pipeline loaded.
+#     * POST /score takes a json payload holding the raw rows of one applicant, in the columns and text formats of the csv feeds:
+#         {"transactions": [{"CUST_ID": ..., "TRAN_DT": "dd/mm/YYYY", ...}, ...], "balances": [{..., "ACCT_BAL_DT": "dd/mm/YYYY", "ACCT_BAL": ...}, ...],
+#          "as_of_dt": "MM/DD/YYYY" (optional, default: the last balance date), "features": true (optional)}
+#       The rows are typed like bs_ingest types the csv (the same schema, date format and manual exclusion), then scored like one applicant of bs_batch.
+#       It answers {"AS_OF_DT": ..., "ACCOUNTS": [...]}: one record per account with the account keys and the attributes of df_ACCT_MAST_STG2
+#       (EVAL_ATTRIBUTES), or every column of df_ACCT_MAST_STG2 with "features": true. A bad payload gets 400, with {"ERROR": ...}.
+#     * Requests are scored on a pool of --workers threads; at most --queue more wait for one, the others are turned away at once with 503.
+#     * GET /metrics gives the request / error / rejection counts and the p50 / p99 / max latency of the last SERVE_METRIC_WINDOW requests
+#       (from the request being read to the response being ready, waiting for a worker included); GET /health answers {"STATUS": "OK"}.
+#     * The service listens on 127.0.0.1 (--port) or on a Unix socket (--unix), and scores one synthetic applicant before it starts listening,
+#       so the first request does not pay for the lazy imports and first-call setup.
+#     * loadtest fires synthetic applicants (bs_synth) at a running service, or at one started in the same process (--spawn),
+#       from --concurrency clients, and reports the client-side latencies with the service's own metrics.
+#
+# Usage: python bs_serve.py serve [--port N | --unix PATH] [--workers N] [--queue N] [--windows N] [--window-rule days|month] [--recurrent auto|feed|detect]
+#                                 [--amounts float32|float64|minor] [--memo FILE]
+#        python bs_serve.py loadtest [--port N | --unix PATH] [--spawn] [--requests N] [--concurrency N] [--applicants N] [--accounts N] [--seed N]
+
+import argparse
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bs_attrs import EVAL_ATTRIBUTES
+from bs_batch import SCORE_STATEMENT
+from bs_ingest import BS_TRAN_SCHEMA, BS_TRAN_OPTIONAL_SCHEMA, BS_ACCT_BAL_SCHEMA, BS_TRAN_AMOUNT_COLS, BS_AMOUNT_TYPES, BS_MINOR_UNITS, BS_DATE_FORMAT
+from bs_ingest import AMOUNT_SCHEMA, EXCLUDE_ROWS, TO_MINOR_UNITS
+from bs_pipeline import ACCT_KEY_COLS
+from bs_synth import SYNTH_BLOCK, SYNTH_FIRST_ACCT_ID
+
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8765
+#Latencies kept for the percentiles of /metrics
+SERVE_METRIC_WINDOW = 10000
+#Largest payload accepted, in bytes
+SERVE_MAX_PAYLOAD = 256 * 2 ** 20
+SERVE_TIMEOUT_S = 60
+#Connections waiting to be accepted (the listen backlog), so that bursts get a 503 rather than a refused connection
+SERVE_BACKLOG = 128
+
+
+#Function Name: PAYLOAD_FRAME
+#Function Description: This function types the rows of a payload (a list of records in the csv layout) as bs_ingest.READ_BS_CSV types the csv:
+#                      the schema's columns (and the optional ones present), dates parsed from BS_DATE_FORMAT, BS_MINOR_UNITS amounts converted to cents,
+#                      and the rows where exclude_col is not 0 dropped (with the column); a missing column raises ValueError
+def PAYLOAD_FRAME(rows, schema, date_cols, exclude_col=None, optional=None):
+    df = pd.DataFrame.from_records(rows)
+    missing = [c for c in schema if c not in df]
+    if missing:
+        raise ValueError('the payload rows have no ' + ', '.join(missing) + ' column')
+    schema = {**schema, **{c: t for c, t in (optional or {}).items() if c in df}}
+    df = df[list(schema)]
+    if exclude_col is not None:
+        df = EXCLUDE_ROWS(df.astype({exclude_col: schema[exclude_col]}), exclude_col)
+    df = df.reset_index(drop=True)
+    for col, dtype in schema.items():
+        if col == exclude_col:
+            continue
+        if col in date_cols:
+            df[col] = pd.to_datetime(df[col], format=BS_DATE_FORMAT)
+        elif dtype == BS_MINOR_UNITS:
+            df[col] = TO_MINOR_UNITS(df[col], col)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+#Function Name: SCORE_PAYLOAD
+#Function Description: This function scores a decoded payload and returns the json body of the answer (see the module header)
+#                      settings = the keyword arguments of bs_batch.SCORE_STATEMENT, with amount_type (the type of the transaction amounts)
+def SCORE_PAYLOAD(payload, settings):
+    if not isinstance(payload, dict) or not isinstance(payload.get('transactions'), list) or not isinstance(payload.get('balances'), list):
+        raise ValueError('the payload must be an object with transactions and balances lists')
+    if not payload['transactions']:
+        raise ValueError('the payload has no transactions')
+    settings = dict(settings)
+    tran_schema = AMOUNT_SCHEMA(BS_TRAN_SCHEMA, BS_TRAN_AMOUNT_COLS, settings.pop('amount_type', 'float32'))
+    df_tran = PAYLOAD_FRAME(payload['transactions'], tran_schema, ['TRAN_DT'], 'MANUAL_EXCLUSION', BS_TRAN_OPTIONAL_SCHEMA)
+    df_bal = PAYLOAD_FRAME(payload['balances'], BS_ACCT_BAL_SCHEMA, ['ACCT_BAL_DT']) if payload['balances'] else \
+        pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'ACCT_BAL_DT' else t) for c, t in BS_ACCT_BAL_SCHEMA.items()})
+    as_of_dt = pd.to_datetime(payload['as_of_dt'], format='%m/%d/%Y') if payload.get('as_of_dt') else None
+
+    df_ACCT_MAST_STG1, memo, df_WINDOWS = SCORE_STATEMENT(df_tran, df_bal, as_of_dt, **settings)
+    df_ATTRS = EVAL_ATTRIBUTES(df_ACCT_MAST_STG1, df_WINDOWS)
+    if payload.get('features'):
+        df = df_ACCT_MAST_STG1.join(df_ATTRS)
+    else:
+        df = df_ACCT_MAST_STG1[ACCT_KEY_COLS].join(df_ATTRS)
+    return ('{"AS_OF_DT": ' + json.dumps(df_WINDOWS.loc['M1', 'END_DT'].strftime('%Y-%m-%d'))
+            + ', "ACCOUNTS": ' + df.to_json(orient='records', date_format='iso') + '}')
+
+
+#Function Name: NEW_METRICS / RECORD_METRIC / SERVE_METRICS
+#Function Description: These functions keep the counts and the latencies of the last SERVE_METRIC_WINDOW requests of a service (thread-safe),
+#                      and summarize them for /metrics; outcome is 'OK', 'ERROR' or 'REJECTED'
+def NEW_METRICS():
+    return {'LOCK': threading.Lock(), 'LATENCIES': deque(maxlen=SERVE_METRIC_WINDOW), 'OK': 0, 'ERROR': 0, 'REJECTED': 0, 'START': time.time()}
+
+
+def RECORD_METRIC(metrics, outcome, seconds):
+    with metrics['LOCK']:
+        metrics[outcome] += 1
+        if outcome != 'REJECTED':
+            metrics['LATENCIES'].append(seconds)
+
+
+def SERVE_METRICS(metrics):
+    with metrics['LOCK']:
+        latencies = np.array(metrics['LATENCIES']) * 1000
+        report = {'REQUESTS': metrics['OK'] + metrics['ERROR'] + metrics['REJECTED'], 'OK': metrics['OK'], 'ERROR': metrics['ERROR'],
+                  'REJECTED': metrics['REJECTED'], 'UPTIME_S': round(time.time() - metrics['START'], 3), 'WINDOW': len(latencies)}
+    report.update(LATENCY_SUMMARY(latencies))
+    return report
+
+
+#Function Name: LATENCY_SUMMARY
+#Function Description: This function returns the P50_MS, P99_MS, MEAN_MS and MAX_MS of latencies in milliseconds (None for no latency)
+def LATENCY_SUMMARY(latencies):
+    if len(latencies) == 0:
+        return {'P50_MS': None, 'P99_MS': None, 'MEAN_MS': None, 'MAX_MS': None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {'P50_MS': round(float(p50), 3), 'P99_MS': round(float(p99), 3), 'MEAN_MS': round(float(np.mean(latencies)), 3),
+            'MAX_MS': round(float(np.max(latencies)), 3)}
+
+
+#Handler of the requests; the service's state (POOL, SLOTS, METRICS, SETTINGS) hangs on the server
+class ScoreHandler(http.server.BaseHTTPRequestHandler):
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, json.dumps(SERVE_METRICS(self.server.METRICS)))
+        elif self.path == '/health':
+            self.send_json(200, '{"STATUS": "OK"}')
+        else:
+            self.send_json(404, json.dumps({'ERROR': 'unknown path ' + self.path}))
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, json.dumps({'ERROR': 'unknown path ' + self.path}))
+            return
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > SERVE_MAX_PAYLOAD:
+            RECORD_METRIC(self.server.METRICS, 'ERROR', time.perf_counter() - start)
+            self.send_json(413, json.dumps({'ERROR': 'payload larger than ' + str(SERVE_MAX_PAYLOAD) + ' bytes'}))
+            return
+        body = self.rfile.read(length)
+        if not self.server.SLOTS.acquire(blocking=False):
+            RECORD_METRIC(self.server.METRICS, 'REJECTED', time.perf_counter() - start)
+            self.send_json(503, '{"ERROR": "the service is busy"}')
+            return
+        try:
+            status, answer = 200, self.server.POOL.submit(SCORE_PAYLOAD, json.loads(body), self.server.SETTINGS).result()
+        except (ValueError, KeyError, TypeError) as e:
+            status, answer = 400, json.dumps({'ERROR': repr(e)})
+        except Exception as e:
+            status, answer = 500, json.dumps({'ERROR': repr(e)})
+        finally:
+            self.server.SLOTS.release()
+        RECORD_METRIC(self.server.METRICS, 'OK' if status == 200 else 'ERROR', time.perf_counter() - start)
+        self.send_json(status, answer)
+
+
+class ScoreTCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = SERVE_BACKLOG
+
+
+class ScoreUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = SERVE_BACKLOG
+
+
+#Function Name: SYNTH_PAYLOAD
+#Function Description: This function returns the json payload of a synthetic applicant (bs_synth.SYNTH_BLOCK) with n_accounts accounts over start_dt to end_dt
+def SYNTH_PAYLOAD(seed=0, n_accounts=1, start_dt='2019-01-01', end_dt='2019-12-31', tran_per_day=2.0, recur_share=0.1, outlier_share=0.01,
+                  gap_share=0.2, gap_len=5):
+    rng = np.random.default_rng([seed, 0])
+    df_tran, df_bal = SYNTH_BLOCK(rng, SYNTH_FIRST_ACCT_ID + seed * n_accounts, n_accounts, pd.date_range(start_dt, end_dt, freq='D'),
+                                  tran_per_day, recur_share, outlier_share, gap_share, gap_len)
+    return '{"transactions": ' + df_tran.to_json(orient='records') + ', "balances": ' + df_bal.to_json(orient='records') + '}'
+
+
+#Function Name: START_SCORE_SERVER
+#Function Description: This function warms the pipeline up on a synthetic applicant (without the memo file) and starts the service in a background thread
+#                      address = (host, port), or the path of a Unix socket (replaced if it exists); port 0 takes a free port (see server.server_address)
+#                      settings = as for SCORE_PAYLOAD; returns the server (server.shutdown() stops it, server.POOL.shutdown() its workers)
+def START_SCORE_SERVER(address, workers=4, queue=16, settings=None):
+    settings = dict(settings or {})
+    #The synthetic applicant is not written into the memo file
+    SCORE_PAYLOAD(json.loads(SYNTH_PAYLOAD()), {k: v for k, v in settings.items() if k != 'memo_file'})
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = ScoreUnixServer(address, ScoreHandler)
+    else:
+        server = ScoreTCPServer(address, ScoreHandler)
+    server.POOL = ThreadPoolExecutor(max_workers=workers)
+    server.SLOTS = threading.BoundedSemaphore(workers + queue)
+    server.METRICS = NEW_METRICS()
+    server.SETTINGS = settings
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#Function Name: SERVE_REQUEST
+#Function Description: This function sends one request to a service at address ((host, port) or a Unix socket path) on a new connection
+#                      and returns the status and the decoded json answer
+def SERVE_REQUEST(address, method, path, body=None, timeout=SERVE_TIMEOUT_S):
+    if isinstance(address, str):
+        conn = http.client.HTTPConnection('localhost', timeout=timeout)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        conn.sock = sock
+    else:
+        conn = http.client.HTTPConnection(address[0], address[1], timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body is not None else {})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+#Function Name: LOAD_TEST
+#Function Description: This function sends n_requests /score requests to a service, cycling over payloads, from concurrency client threads at once
+#                      Returns the client-side counts (OK, REJECTED = 503, ERROR = anything else), throughput and latencies (LATENCY_SUMMARY),
+#                      and the service's /metrics after the run as SERVER
+def LOAD_TEST(address, payloads, n_requests=200, concurrency=8, timeout=SERVE_TIMEOUT_S):
+    def task(i):
+        start = time.perf_counter()
+        try:
+            status = SERVE_REQUEST(address, 'POST', '/score', payloads[i % len(payloads)], timeout)[0]
+        except (OSError, http.client.HTTPException, ValueError):
+            status = None
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(task, range(n_requests)))
+    seconds = time.perf_counter() - start
+    status = np.array([s if s is not None else -1 for s, _ in results])
+    latencies = np.array([t for s, t in results if s == 200]) * 1000
+    report = {'REQUESTS': n_requests, 'CONCURRENCY': concurrency, 'OK': int((status == 200).sum()), 'REJECTED': int((status == 503).sum()),
+              'ERROR': int(((status != 200) & (status != 503)).sum()), 'SECONDS': round(seconds, 3), 'REQUESTS_PER_S': round(n_requests / seconds, 2)}
+    report.update(LATENCY_SUMMARY(latencies))
+    report['SERVER'] = SERVE_REQUEST(address, 'GET', '/metrics', timeout=timeout)[1]
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resident bank statement scoring service, and its load test.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='run the scoring service')
+    load = sub.add_parser('loadtest', help='fire synthetic applicants at a scoring service')
+    for p in [serve, load]:
+        p.add_argument('--port', type=int, default=SERVE_PORT, help='port on ' + SERVE_HOST)
+        p.add_argument('--unix', default=None, help='Unix socket path (instead of the port)')
+        p.add_argument('--workers', type=int, default=4, help='requests scored at the same time')
+        p.add_argument('--queue', type=int, default=16, help='requests waiting for a worker before the others get 503')
+        p.add_argument('--windows', type=int, default=6, help='number of windows (M1 to Mn)')
+        p.add_argument('--window-rule', choices=['days', 'month'], default='days', help='30-day windows ending on the as-of date, or calendar months')
+        p.add_argument('--recurrent', choices=['auto', 'feed', 'detect'], default='auto',
+                       help='recurrent transaction flags from the payload, detected from the counterparties, or the payload\'s when it has them')
+        p.add_argument('--amounts', choices=BS_AMOUNT_TYPES, default='float32', help='type of the transaction amounts (minor = exact int64 cents)')
+        p.add_argument('--memo', default=None, help='sqlite file memoizing the per-account features across requests (bs_memo)')
+    load.add_argument('--spawn', action='store_true', help='start the service in this process (with the serve options) instead of using a running one')
+    load.add_argument('--requests', type=int, default=200, help='number of requests')
+    load.add_argument('--concurrency', type=int, default=8, help='requests in flight at the same time')
+    load.add_argument('--applicants', type=int, default=20, help='distinct synthetic applicants cycled over')
+    load.add_argument('--accounts', type=int, default=1, help='accounts per synthetic applicant')
+    load.add_argument('--seed', type=int, default=0, help='seed of the first synthetic applicant')
+    args = parser.parse_args()
+
+    address = args.unix if args.unix else (SERVE_HOST, args.port)
+    settings = {'n_windows': args.windows, 'rule': args.window_rule, 'recur_mode': args.recurrent, 'amount_type': args.amounts, 'memo_file': args.memo}
+
+    if args.command == 'serve':
+        server = START_SCORE_SERVER(address, args.workers, args.queue, settings)
+        print('scoring on ' + (args.unix if args.unix else 'http://' + SERVE_HOST + ':' + str(server.server_address[1])) + ' with '
+              + str(args.workers) + ' workers', file=sys.stderr)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+            server.POOL.shutdown()
+
+    if args.command == 'loadtest':
+        server = START_SCORE_SERVER(address, args.workers, args.queue, settings) if args.spawn else None
+        if server is not None and not args.unix:
+            address = server.server_address[:2]
+        payloads = [SYNTH_PAYLOAD(args.seed + i, args.accounts).encode('utf-8') for i in range(args.applicants)]
+        report = LOAD_TEST(address, payloads, args.requests, args.concurrency)
+        if server is not None:
+            server.shutdown()
+            server.POOL.shutdown()
+        print(json.dumps(report, indent=1))
+        sys.exit(0 if report['OK'] == report['REQUESTS'] else 1)
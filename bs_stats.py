@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Mergeable running statistics for the bank statement scorecard.
+#     * A Welford state is the tuple (n, mean, m2), m2 being the sum of squared deviations from the mean.
+#     * States of separate batches are combined with WELFORD_MERGE, so the mean and stddev never need the whole column in memory.
+#     * Quantiles are estimated from mergeable sketches (see SKETCH_COUNTS), per group, in one grouped count.
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+WELFORD_EMPTY = (0, 0.0, 0.0)
+
+
+#Function Name: WELFORD_STATE
+#Function Description: This function returns the Welford state of a batch of values, NaN values being skipped as in Series.mean() / Series.std()
+def WELFORD_STATE(values):
+    x = np.asarray(values, dtype='float64')
+    x = x[~np.isnan(x)]
+    if len(x) == 0:
+        return WELFORD_EMPTY
+    mean = x.mean()
+    return (len(x), float(mean), float(((x - mean) ** 2).sum()))
+
+
+#Function Name: WELFORD_MERGE
+#Function Description: This function combines the Welford states of two batches into the state of both (Chan et al. pairwise update)
+def WELFORD_MERGE(a, b):
+    n = a[0] + b[0]
+    if a[0] == 0 or b[0] == 0:
+        return a if b[0] == 0 else b
+    delta = b[1] - a[1]
+    mean = a[1] + delta * b[0] / n
+    m2 = a[2] + b[2] + delta * delta * a[0] * b[0] / n
+    return (n, mean, m2)
+
+
+#Function Name: WELFORD_STD
+#Function Description: This function returns the standard deviation of a Welford state (ddof=1, as Series.std())
+def WELFORD_STD(state, ddof=1):
+    n, mean, m2 = state
+    return math.sqrt(m2 / (n - ddof)) if n > ddof else float('nan')
+
+
+#Function Name: WELFORD_MEAN
+#Function Description: This function returns the mean of a Welford state
+def WELFORD_MEAN(state):
+    return state[1] if state[0] > 0 else float('nan')
+
+
+#Function Name: WELFORD_COLUMNS
+#Function Description: This function folds the Welford states of columns over an iterable of chunks in one pass (e.g. bs_ingest.ITER_BS_TRAN, or the shards of a run)
+#                      states = states to continue from (e.g. those of other shards); returns a dict of column -> state
+def WELFORD_COLUMNS(chunks, cols, states=None):
+    states = dict(states) if states is not None else {col: WELFORD_EMPTY for col in cols}
+    for chunk in chunks:
+        for col in cols:
+            states[col] = WELFORD_MERGE(states[col], WELFORD_STATE(chunk[col]))
+    return states
+
+
+# * Quantile sketch (DDSketch): a positive value x is counted in bucket ceil(log(x) / log(gamma)), gamma = (1 + alpha) / (1 - alpha).
+#     * Every value of a bucket is within a relative error alpha of the bucket's representative value, so the quantiles are too.
+#     * A sketch is a Series of counts indexed by the group keys plus BUCKET; sketches of chunks or shards merge by adding counts.
+SKETCH_ALPHA = 0.01
+
+
+#Function Name: SKETCH_GAMMA
+#Function Description: This function returns the bucket growth factor of a relative accuracy alpha
+def SKETCH_GAMMA(alpha=SKETCH_ALPHA):
+    return (1 + alpha) / (1 - alpha)
+
+
+#Function Name: SKETCH_BUCKET
+#Function Description: This function returns the bucket of every (positive) value
+def SKETCH_BUCKET(values, alpha=SKETCH_ALPHA):
+    return np.ceil(np.log(np.asarray(values, dtype='float64')) / math.log(SKETCH_GAMMA(alpha))).astype('int64')
+
+
+#Function Name: SKETCH_VALUE
+#Function Description: This function returns the representative value of every bucket
+def SKETCH_VALUE(buckets, alpha=SKETCH_ALPHA):
+    gamma = SKETCH_GAMMA(alpha)
+    return 2 * gamma ** np.asarray(buckets, dtype='float64') / (gamma + 1)
+
+
+#Function Name: SKETCH_COUNTS
+#Function Description: This function builds the sketch of the positive values per group in one grouped count; keys = frame (or Series) of the group keys
+#                      Zero, negative and NaN values are left out
+def SKETCH_COUNTS(keys, values, alpha=SKETCH_ALPHA):
+    keys = keys.to_frame() if isinstance(keys, pd.Series) else keys
+    values = np.asarray(values, dtype='float64')
+    positive = values > 0
+    df = keys[positive].assign(BUCKET=SKETCH_BUCKET(values[positive], alpha))
+    return df.groupby(list(df.columns), sort=True).size()
+
+
+#Function Name: SKETCH_MERGE
+#Function Description: This function merges two sketches built with the same alpha
+def SKETCH_MERGE(a, b):
+    return a.add(b, fill_value=0).astype('int64')
+
+
+#Function Name: SKETCH_QUANTILE
+#Function Description: This function returns the q quantile (lower rank, as numpy's 'lower' method) of every group of a sketch, grouped by the index levels in by
+def SKETCH_QUANTILE(sketch, q, by, alpha=SKETCH_ALPHA):
+    sketch = sketch.groupby(level=by + ['BUCKET'], sort=True).sum()
+    cum = sketch.groupby(level=by).cumsum()
+    n = sketch.groupby(level=by).transform('sum')
+    above = cum[cum > np.floor(q * (n - 1))]
+    first = above.reset_index().groupby(by, sort=True)['BUCKET'].first()
+    return pd.Series(SKETCH_VALUE(first.to_numpy(), alpha), index=first.index)
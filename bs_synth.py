@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Seeded generator of synthetic bank statements, shaped like the raw feeds (bs_ingest.BS_TRAN_FILE / bs_ingest.BS_ACCT_BAL_FILE),
+#   to measure the pipeline at any scale without customer files.
+#     * Every account opens on a day of the first quarter of the period and alternates active and gap runs (no transaction at all),
+#       gap_share of its days being gap days, in runs of gap_len days on average.
+#     * On an active day it has a Poisson number of one-off transactions (inflows about a third of them), lognormal amounts around
+#       an account-level scale, counterparties drawn from a Zipf-like pool; outlier_share of them are 20 to 60 times larger.
+#     * recur_share of the transactions are recurrent: weekly, fortnightly or monthly streams (salary, clients, rent, bills) with one counterparty,
+#       amounts within 3% and dates within a day of the period, flagged in RECURRENT_*_TRAN_FLG (bs_recur.DETECT_RECURRENT finds them too).
+#     * CAL_BAL_AMT_HKD is the running balance, and the balance feed holds the day-end balance of the opening day and of every day with transactions.
+#     * The accounts are generated in blocks of SYNTH_BLOCK_ACCOUNTS with their own seeds and appended to the csv files,
+#       so memory stays bounded and the same seed always gives the same files.
+#
+# Usage: python bs_synth.py <output folder> [--accounts N] [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--tran-per-day X] [--recurring SHARE] [--outliers SHARE] [--gaps SHARE] [--gap-len DAYS] [--seed N]
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from bs_ingest import BS_TRAN_FILE, BS_ACCT_BAL_FILE, BS_DATE_FORMAT
+
+SYNTH_BLOCK_ACCOUNTS = 2000
+SYNTH_FIRST_ACCT_ID = 10000000
+SYNTH_INFLOW_SHARE = 0.35
+SYNTH_EXCLUSION_SHARE = 0.01
+SYNTH_REVENUE_SHARE = 0.7
+#Recurrent stream periods in days and their weights
+SYNTH_PERIODS = np.array([7, 14, 30])
+SYNTH_PERIOD_WEIGHTS = np.array([0.2, 0.2, 0.6])
+SYNTH_CPTY_POOL = 500
+
+SYNTH_TRAN_COLS = ['CUST_ID', 'CUST_NAME', 'ACCT_ID', 'ACCT_TYP', 'TRAN_DT', 'INFLOW_TRAN_AMT_HKD', 'OUTFLOW_TRAN_AMT_HKD', 'CAL_BAL_AMT_HKD',
+                   'MANUAL_EXCLUSION', 'REVENUE_TRAN_FLG', 'RECURRENT_INFLOW_TRAN_FLG', 'RECURRENT_OUTFLOW_TRAN_FLG', 'COUNTERPARTY']
+SYNTH_BAL_COLS = ['CUST_ID', 'CUST_NAME', 'ACCT_ID', 'ACCT_TYP', 'ACCT_BAL_DT', 'ACCT_BAL']
+
+
+#Function Name: SYNTH_ACTIVE_DAYS
+#Function Description: This function returns the (accounts, days) mask of the days with transactions: from the opening day on,
+#                      a two-state chain switching into a gap with probability gap_share / (1 - gap_share) / gap_len and out of it with 1 / gap_len,
+#                      so gap_share of the days are gap days, in runs of gap_len days on average
+def SYNTH_ACTIVE_DAYS(rng, open_day, n_days, gap_share, gap_len):
+    if gap_share <= 0:
+        return np.arange(n_days) >= open_day[:, None]
+    n_accounts = len(open_day)
+    active = np.zeros((n_accounts, n_days), dtype=bool)
+    to_gap = min(gap_share / max(1 - gap_share, 1e-9) / gap_len, 1.0)
+    in_gap = rng.random(n_accounts) < gap_share
+    draws = rng.random((n_accounts, n_days))
+    for j in range(n_days):
+        in_gap = np.where(in_gap, draws[:, j] >= 1 / gap_len, draws[:, j] < to_gap)
+        active[:, j] = ~in_gap & (j >= open_day)
+    return active
+
+
+#Function Name: SYNTH_BLOCK
+#Function Description: This function generates the transactions and the day-end balances of n_accounts accounts, the first one being first_acct,
+#                      over the days of days (a DatetimeIndex), in the raw csv layout (dates as dd/mm/YYYY text)
+def SYNTH_BLOCK(rng, first_acct, n_accounts, days, tran_per_day, recur_share, outlier_share, gap_share, gap_len):
+    n_days = len(days)
+    day_text = np.asarray(days.strftime(BS_DATE_FORMAT))
+    acct = first_acct + np.arange(n_accounts)
+    open_day = rng.integers(0, max(n_days // 4, 1), n_accounts)
+    scale = rng.lognormal(np.log(1500), 0.8, n_accounts)
+    opening = rng.lognormal(np.log(50000), 1.0, n_accounts).round(2)
+
+    #One-off transactions: Poisson counts on the active days, so the long-run rate is tran_per_day * (1 - recur_share)
+    active = SYNTH_ACTIVE_DAYS(rng, open_day, n_days, gap_share, gap_len)
+    rate = tran_per_day * (1 - recur_share) / max(1 - gap_share, 1e-9)
+    counts = np.where(active, rng.poisson(rate, active.shape), 0).ravel()
+    cell = np.repeat(np.arange(counts.size), counts)
+    row, day = cell // n_days, cell % n_days
+    n = len(row)
+    inflow = rng.random(n) < SYNTH_INFLOW_SHARE
+    #Inflows are rarer, so they are larger: the expected inflow and outflow per account are about equal
+    amount = rng.lognormal(0, 0.9, n) * scale[row] * np.where(inflow, (1 - SYNTH_INFLOW_SHARE) / SYNTH_INFLOW_SHARE, 1.0)
+    amount *= np.where(rng.random(n) < outlier_share, rng.uniform(20, 60, n), 1.0)
+    cpty_no = (np.minimum(rng.zipf(1.5, n), SYNTH_CPTY_POOL) + acct[row] * 7) % SYNTH_CPTY_POOL
+    cpty = np.char.add(np.where(inflow, 'CLIENT ', 'MERCHANT '), cpty_no.astype(str))
+    recurrent = np.zeros(n, dtype=bool)
+
+    #Recurrent streams: Poisson number per account, so they give recur_share of the transactions on average
+    per_month = 30.0 / SYNTH_PERIODS
+    n_streams = rng.poisson(recur_share * tran_per_day * 30 / (per_month * SYNTH_PERIOD_WEIGHTS).sum(), n_accounts)
+    s_row = np.repeat(np.arange(n_accounts), n_streams)
+    s_no = np.arange(len(s_row)) - np.repeat(np.cumsum(n_streams) - n_streams, n_streams)
+    period = rng.choice(SYNTH_PERIODS, len(s_row), p=SYNTH_PERIOD_WEIGHTS)
+    s_inflow = rng.random(len(s_row)) < 0.4
+    s_amount = rng.lognormal(0, 0.5, len(s_row)) * scale[s_row] * np.where(s_inflow, 4.0, 2.0)
+    s_first = open_day[s_row] + rng.integers(0, period)
+    n_occ = np.maximum((n_days - 1 - s_first) // period + 1, 0)
+    occ_stream = np.repeat(np.arange(len(s_row)), n_occ)
+    occ_no = np.arange(len(occ_stream)) - np.repeat(np.cumsum(n_occ) - n_occ, n_occ)
+    occ_day = np.clip(s_first[occ_stream] + occ_no * period[occ_stream] + rng.integers(-1, 2, len(occ_stream)) * (period[occ_stream] >= 30),
+                      open_day[s_row[occ_stream]], n_days - 1)
+    occ_inflow = s_inflow[occ_stream]
+    occ_cpty = np.char.add(np.char.add(np.where(occ_inflow, 'EMPLOYER ', 'BILLER '), acct[s_row[occ_stream]].astype(str)),
+                           np.char.add('-', s_no[occ_stream].astype(str)))
+
+    row = np.concatenate([row, s_row[occ_stream]])
+    day = np.concatenate([day, occ_day])
+    inflow = np.concatenate([inflow, occ_inflow])
+    amount = np.concatenate([amount, s_amount[occ_stream] * rng.uniform(0.97, 1.03, len(occ_stream))]).round(2)
+    cpty = np.concatenate([cpty, occ_cpty])
+    recurrent = np.concatenate([recurrent, np.ones(len(occ_stream), dtype=bool)])
+
+    #Account and date order; the running balance moves by every transaction, the last one of a day giving the day-end balance
+    order = np.lexsort((day, row))
+    row, day, inflow, amount, cpty, recurrent = row[order], day[order], inflow[order], amount[order], cpty[order], recurrent[order]
+    n = len(row)
+    flow = np.where(inflow, amount, -amount)
+    first_of_acct = np.r_[True, row[1:] != row[:-1]] if n else np.zeros(0, dtype=bool)
+    running = np.cumsum(flow)
+    running = (running - np.repeat(running[first_of_acct] - flow[first_of_acct], np.diff(np.r_[np.flatnonzero(first_of_acct), n]))
+               + opening[row]).round(2)
+    cust = 500000 + acct // 2
+    df_tran = pd.DataFrame({
+        'CUST_ID': cust[row], 'CUST_NAME': np.char.add('CUST ', cust[row].astype(str)), 'ACCT_ID': acct[row], 'ACCT_TYP': 'CA',
+        'TRAN_DT': day_text[day],
+        'INFLOW_TRAN_AMT_HKD': np.where(inflow, amount, 0.0), 'OUTFLOW_TRAN_AMT_HKD': np.where(inflow, 0.0, amount),
+        'CAL_BAL_AMT_HKD': running,
+        'MANUAL_EXCLUSION': (rng.random(n) < SYNTH_EXCLUSION_SHARE).astype('int8'),
+        'REVENUE_TRAN_FLG': (inflow & (rng.random(n) < SYNTH_REVENUE_SHARE)).astype('int8'),
+        'RECURRENT_INFLOW_TRAN_FLG': (recurrent & inflow).astype('int8'),
+        'RECURRENT_OUTFLOW_TRAN_FLG': (recurrent & ~inflow).astype('int8'),
+        'COUNTERPARTY': cpty,
+    }, columns=SYNTH_TRAN_COLS)
+
+    #Day-end balances: the opening day, then the last running balance of every day with transactions
+    last_of_day = np.r_[(row[1:] != row[:-1]) | (day[1:] != day[:-1]), True] if n else np.zeros(0, dtype=bool)
+    bal_row = np.concatenate([np.arange(n_accounts), row[last_of_day]])
+    bal_day = np.concatenate([open_day, day[last_of_day]])
+    bal = np.concatenate([opening, running[last_of_day]])
+    order = np.lexsort((np.r_[np.zeros(n_accounts), np.ones(last_of_day.sum())], bal_day, bal_row))
+    df_bal = pd.DataFrame({
+        'CUST_ID': cust[bal_row[order]], 'CUST_NAME': np.char.add('CUST ', cust[bal_row[order]].astype(str)), 'ACCT_ID': acct[bal_row[order]],
+        'ACCT_TYP': 'CA', 'ACCT_BAL_DT': day_text[bal_day[order]], 'ACCT_BAL': bal[order],
+    }, columns=SYNTH_BAL_COLS)
+    #A day with transactions replaces the opening record of the same day
+    df_bal = df_bal[~df_bal.duplicated(['ACCT_ID', 'ACCT_BAL_DT'], keep='last').to_numpy()]
+    return df_tran, df_bal
+
+
+#Function Name: WRITE_SYNTH_STATEMENT
+#Function Description: This function writes a synthetic statement folder (BS_TRAN_FILE and BS_ACCT_BAL_FILE) of n_accounts accounts over start_dt to end_dt
+#                      tran_per_day = transactions per account per day; recur_share / outlier_share = share of the recurrent / outlier transactions;
+#                      gap_share = share of the days without transactions, in runs of gap_len days on average
+#                      Returns the number of transaction rows and balance rows written
+def WRITE_SYNTH_STATEMENT(folder, n_accounts=1000, start_dt='2019-01-01', end_dt='2019-12-31', tran_per_day=2.0, recur_share=0.1,
+                          outlier_share=0.01, gap_share=0.2, gap_len=5, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    days = pd.date_range(start_dt, end_dt, freq='D')
+    n_tran = n_bal = 0
+    with open(os.path.join(folder, BS_TRAN_FILE), 'w', newline='') as tran_out, open(os.path.join(folder, BS_ACCT_BAL_FILE), 'w', newline='') as bal_out:
+        for block, first in enumerate(range(0, n_accounts, SYNTH_BLOCK_ACCOUNTS)):
+            rng = np.random.default_rng([seed, block])
+            df_tran, df_bal = SYNTH_BLOCK(rng, SYNTH_FIRST_ACCT_ID + first, min(SYNTH_BLOCK_ACCOUNTS, n_accounts - first), days,
+                                          tran_per_day, recur_share, outlier_share, gap_share, gap_len)
+            df_tran.to_csv(tran_out, index=False, header=block == 0)
+            df_bal.to_csv(bal_out, index=False, header=block == 0)
+            n_tran += len(df_tran)
+            n_bal += len(df_bal)
+        if n_accounts <= 0:
+            pd.DataFrame(columns=SYNTH_TRAN_COLS).to_csv(tran_out, index=False)
+            pd.DataFrame(columns=SYNTH_BAL_COLS).to_csv(bal_out, index=False)
+    return n_tran, n_bal
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a seeded synthetic bank statement folder.')
+    parser.add_argument('folder', help='output folder (' + BS_TRAN_FILE + ' and ' + BS_ACCT_BAL_FILE + ' are written into it)')
+    parser.add_argument('--accounts', type=int, default=1000, help='number of accounts')
+    parser.add_argument('--start', default='2019-01-01', help='first day of the statements')
+    parser.add_argument('--end', default='2019-12-31', help='last day of the statements')
+    parser.add_argument('--tran-per-day', type=float, default=2.0, help='transactions per account per day')
+    parser.add_argument('--recurring', type=float, default=0.1, help='share of recurrent transactions')
+    parser.add_argument('--outliers', type=float, default=0.01, help='share of outlier transactions (20 to 60 times the usual amount)')
+    parser.add_argument('--gaps', type=float, default=0.2, help='share of days without transactions')
+    parser.add_argument('--gap-len', type=float, default=5, help='average length of a run of days without transactions')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    n_tran, n_bal = WRITE_SYNTH_STATEMENT(args.folder, args.accounts, args.start, args.end, args.tran_per_day, args.recurring,
+                                          args.outliers, args.gaps, args.gap_len, args.seed)
+    print(str(n_tran) + ' transactions and ' + str(n_bal) + ' day-end balances written to ' + args.folder)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Vectorized engine for the transaction summary of the bank statement scorecard.
+#     * Every transaction is tagged once with the window it falls in (see bs_window.TAG_WINDOW).
+#     * All sums, counts and maxima of all windows are then taken in one groupby over (ACCT_ID, window) (see bs_window.WINDOW_SMRY).
+#     * Amounts in int64 minor units (bs_ingest.BS_MINOR_UNITS) are summed exactly as integers and only the summary is converted back to HKD.
+
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from bs_ingest import MINOR_UNIT_SCALE
+from bs_window import ALL_WINDOWS, TAG_WINDOW, WINDOW_SMRY, ACCOUNT_INDEX
+
+
+#Layout of the wide transaction summary, in the column order of the original MONTHLY_TRAN_SMRY
+#Each entry is (feature prefix, measure column, windows the feature is reported for, 1 = M1; ALL_WINDOWS = every window of the window table)
+TRAN_SMRY_LAYOUT = [
+    ('TTL_REV_AMT', 'REV_AMT', ALL_WINDOWS),
+    ('TTL_OUTFLOW_AMT', 'OUTFLOW_AMT', ALL_WINDOWS),
+    ('TTL_OUTFLOW_CNT', 'OUTFLOW_CNT', ALL_WINDOWS),
+    ('TTL_INFLOW_AMT', 'INFLOW_AMT', ALL_WINDOWS),
+    ('TTL_INFLOW_CNT', 'INFLOW_CNT', ALL_WINDOWS),
+    ('MAX_INFLOW_TRAN_AMT', 'INFLOW_MAX', [1]),
+    ('MAX_OUTFLOW_TRAN_AMT', 'OUTFLOW_MAX', [1]),
+    ('TTL_TRAN_CNT', 'TRAN_CNT', ALL_WINDOWS),
+    ('LAST_TRAN_DT', 'LAST_INFLOW_DT', None),
+    ('OUTLIER_INFLOW_TRAN_CNT', 'OUTLIER_INFLOW_CNT', ALL_WINDOWS),
+    ('OUTLIER_OUTFLOW_TRAN_CNT', 'OUTLIER_OUTFLOW_CNT', ALL_WINDOWS),
+    ('RECUR_INFLOW_TRAN_AMT', 'RECUR_INFLOW_AMT', ALL_WINDOWS),
+    ('RECUR_OUTFLOW_TRAN_AMT', 'RECUR_OUTFLOW_AMT', ALL_WINDOWS),
+    ('RECUR_OUTFLOW_TRAN_CNT', 'RECUR_OUTFLOW_CNT', [1, 2, 3]),
+    ('RECUR_INFLOW_TRAN_CNT', 'RECUR_INFLOW_CNT', [1, 2, 3]),
+]
+
+#Aggregation used for every measure column; sums and counts of an empty window are 0, maxima are NaN / NaT
+TRAN_SMRY_AGG = {
+    'REV_AMT': 'sum', 'INFLOW_AMT': 'sum', 'OUTFLOW_AMT': 'sum', 'RECUR_INFLOW_AMT': 'sum', 'RECUR_OUTFLOW_AMT': 'sum',
+    'INFLOW_CNT': 'sum', 'OUTFLOW_CNT': 'sum', 'TRAN_CNT': 'sum', 'OUTLIER_INFLOW_CNT': 'sum', 'OUTLIER_OUTFLOW_CNT': 'sum',
+    'RECUR_INFLOW_CNT': 'sum', 'RECUR_OUTFLOW_CNT': 'sum',
+    'INFLOW_MAX': 'max', 'OUTFLOW_MAX': 'max', 'LAST_INFLOW_DT': 'max',
+}
+
+#Measures holding amounts, in the units of the transaction amounts
+TRAN_SMRY_AMOUNT_MEASURES = ['REV_AMT', 'INFLOW_AMT', 'OUTFLOW_AMT', 'RECUR_INFLOW_AMT', 'RECUR_OUTFLOW_AMT', 'INFLOW_MAX', 'OUTFLOW_MAX']
+
+
+#Function Name: TRAN_SMRY_MEASURES
+#Function Description: This function builds the per-transaction measure columns, i.e. each amount already filtered by its flag condition
+#                      A threshold is a scalar, or a Series of per-account thresholds indexed by ACCT_ID (accounts missing from it have no outliers)
+def TRAN_SMRY_MEASURES(df, inflow_threshold, outflow_threshold):
+    if isinstance(inflow_threshold, pd.Series):
+        inflow_threshold = df['ACCT_ID'].map(inflow_threshold)
+    if isinstance(outflow_threshold, pd.Series):
+        outflow_threshold = df['ACCT_ID'].map(outflow_threshold)
+    inflow = df['INFLOW_TRAN_AMT_HKD']
+    outflow = df['OUTFLOW_TRAN_AMT_HKD']
+    is_inflow = inflow > 0
+    is_outflow = outflow > 0
+    recur_inflow = is_inflow & (df['RECURRENT_INFLOW_TRAN_FLG'] == 1)
+    recur_outflow = is_outflow & (df['RECURRENT_OUTFLOW_TRAN_FLG'] == 1)
+    return pd.DataFrame({
+        'ACCT_ID': df['ACCT_ID'],
+        'REV_AMT': inflow.where(df['REVENUE_TRAN_FLG'] == 1, 0),
+        'INFLOW_AMT': inflow,
+        'OUTFLOW_AMT': outflow,
+        'RECUR_INFLOW_AMT': inflow.where(recur_inflow, 0),
+        'RECUR_OUTFLOW_AMT': outflow.where(recur_outflow, 0),
+        'INFLOW_CNT': is_inflow.astype('int64'),
+        'OUTFLOW_CNT': is_outflow.astype('int64'),
+        'TRAN_CNT': (is_inflow | is_outflow).astype('int64'),
+        'OUTLIER_INFLOW_CNT': (inflow > inflow_threshold).astype('int64'),
+        'OUTLIER_OUTFLOW_CNT': (outflow > outflow_threshold).astype('int64'),
+        'RECUR_INFLOW_CNT': recur_inflow.astype('int64'),
+        'RECUR_OUTFLOW_CNT': recur_outflow.astype('int64'),
+        'INFLOW_MAX': inflow,
+        'OUTFLOW_MAX': outflow,
+        'LAST_INFLOW_DT': df['TRAN_DT'].where(is_inflow),
+    }, index=df.index)
+
+
+#Function Name: TRAN_SMRY_MAJOR_UNITS
+#Function Description: This function converts the amount features of a transaction summary built from int64 minor units back to HKD (float64)
+#                      Each exact integer total is rounded once, so it is the closest float64 to the true HKD total
+def TRAN_SMRY_MAJOR_UNITS(smry, layout=TRAN_SMRY_LAYOUT):
+    prefixes = {name for name, measure, months in layout if measure in TRAN_SMRY_AMOUNT_MEASURES}
+    cols = [c for c in smry if c in prefixes or c.rsplit('_M', 1)[0] in prefixes]
+    smry[cols] = smry[cols] / MINOR_UNIT_SCALE
+    return smry
+
+
+#Function Name: BUILD_MONTHLY_TRAN_SMRY
+#Function Description: This function aggregates the inflow / outflow attributes of every account for the last 6 months in a single grouped reduction
+#                      df_WINDOWS = the window table (bs_window.BUILD_WINDOWS); the thresholds are the OUTLIER_* cut-offs (mean + 2.5 * stddev, or per account)
+#                      LAST_TRAN_DT is taken over all the windows together, i.e. from the M6 start to the M1 end
+#                      layout = the features to build, a subset of TRAN_SMRY_LAYOUT (all of it by default)
+#                      With amounts in minor units, the thresholds are in minor units too and the amount features come out in HKD
+def BUILD_MONTHLY_TRAN_SMRY(df, df_WINDOWS, inflow_threshold, outflow_threshold, layout=TRAN_SMRY_LAYOUT):
+    win = TAG_WINDOW(df['TRAN_DT'], df_WINDOWS)
+    measures = TRAN_SMRY_MEASURES(df, inflow_threshold, outflow_threshold)
+    smry = WINDOW_SMRY(measures, win, TRAN_SMRY_AGG, layout, ACCOUNT_INDEX(df), len(df_WINDOWS))
+    return TRAN_SMRY_MAJOR_UNITS(smry, layout) if is_integer_dtype(df['INFLOW_TRAN_AMT_HKD']) else smry
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Helpers for the M1-M6 time windows of the bank statement scorecard.
+#     * The windows are held once, in a small window table built from the as-of date, instead of as columns on every row.
+#     * The window table is indexed by window name (M1 is the most recent) with START_DT, END_DT (both inclusive) and DAYS.
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+
+#Window of a layout entry reported for every window of the window table (M1 to Mn)
+ALL_WINDOWS = 'ALL'
+
+
+#Function Name: BUILD_WINDOWS
+#Function Description: This function builds the window table of n_windows consecutive windows, M1 being the most recent
+#                      rule = 'days': windows of window_days days, M1 ending on the as-of date
+#                      rule = 'month': calendar months, M1 being the last month completed on the as-of date (the month before it, unless it is a month end)
+def BUILD_WINDOWS(as_of_dt, n_windows=6, window_days=30, rule='days'):
+    as_of = pd.to_datetime(as_of_dt).normalize()
+    if rule == 'days':
+        end = as_of - pd.to_timedelta(np.arange(n_windows) * window_days, unit='D')
+        start = end - pd.Timedelta(days=window_days - 1)
+    elif rule == 'month':
+        months = pd.period_range(end=(as_of + pd.Timedelta(days=1)).to_period('M') - 1, periods=n_windows, freq='M')[::-1]
+        start = months.to_timestamp(how='start')
+        end = months.to_timestamp(how='end').normalize()
+    else:
+        raise ValueError("unknown window rule " + repr(rule) + ", expected 'days' or 'month'")
+    return pd.DataFrame({'START_DT': start, 'END_DT': end, 'DAYS': (end - start).days + 1},
+                        index=pd.Index(['M' + str(i + 1) for i in range(n_windows)], name='WINDOW'))
+
+
+#Function Name: WINDOW_BOUNDS
+#Function Description: This function returns the start and end dates of the window table as datetime64 arrays, with the order sorting them by start date
+def WINDOW_BOUNDS(df_WINDOWS):
+    starts = np.asarray(df_WINDOWS['START_DT'], dtype='datetime64[ns]')
+    ends = np.asarray(df_WINDOWS['END_DT'], dtype='datetime64[ns]')
+    if (ends < starts).any():
+        raise ValueError('window end date is earlier than its start date')
+    order = np.argsort(starts, kind='stable')
+    if (starts[order][1:] <= ends[order][:-1]).any():
+        raise ValueError('windows must not overlap')
+    return starts, ends, order
+
+
+#Function Name: TAG_WINDOW
+#Function Description: This function returns, for every date, the position of the window holding it (0 for M1, 1 for M2, ...) or -1 if it falls outside all windows
+def TAG_WINDOW(dates, df_WINDOWS):
+    starts, ends, order = WINDOW_BOUNDS(df_WINDOWS)
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    pos = np.searchsorted(starts[order], dates, side='right') - 1
+    win = order[pos.clip(0)]
+    hit = (pos >= 0) & (dates <= ends[win])
+    return np.where(hit, win, -1)
+
+
+#Function Name: WINDOW_SMRY
+#Function Description: This function aggregates the measure columns per account and window in one groupby and lays the result out as one wide row per account
+#                      measures = frame with ACCT_ID and the measure columns; win = window position of every row (from TAG_WINDOW)
+#                      agg = aggregation of every measure; layout = [(feature prefix, measure, windows reported, 1 = M1)]
+#                      A window list of ALL_WINDOWS reports every one of the n_windows windows; None reports the measure over all the windows together, under the prefix alone
+#                      Sums of a window without rows are 0; any other aggregation of it is NaN / NaT
+#                      Only the measures named in the layout are aggregated
+def WINDOW_SMRY(measures, win, agg, layout, accounts, n_windows=6):
+    in_window = win >= 0
+    needed = list(dict.fromkeys(measure for name, measure, months in layout))
+    agg = {measure: agg[measure] for measure in needed}
+    measures = measures.loc[in_window, ['ACCT_ID'] + needed].assign(WINDOW=win[in_window])
+    grouped = measures.groupby(['ACCT_ID', 'WINDOW'], sort=True).agg(agg).unstack('WINDOW').reindex(accounts)
+
+    #A measure without any row in the windows is all NaN / NaT, still of the measure's dtype when it can hold them (so an empty table keeps the dtypes)
+    def missing(measure):
+        dtype = measures[measure].dtype
+        return pd.Series(np.nan, index=accounts, dtype=dtype if dtype.kind in 'fM' else 'float64')
+
+    columns = {}
+    for name, measure, months in layout:
+        if months is None:
+            columns[name] = grouped[measure].agg(agg[measure], axis=1) if measure in grouped else missing(measure)
+            continue
+        if months == ALL_WINDOWS:
+            months = range(1, n_windows + 1)
+        for m in months:
+            value = grouped[(measure, m - 1)] if (measure, m - 1) in grouped else missing(measure)
+            if agg[measure] == 'sum':
+                value = value.fillna(0)
+                if is_integer_dtype(measures[measure]):
+                    value = value.astype('int64')
+            columns[name + '_M' + str(m)] = value
+    return pd.DataFrame(columns, index=accounts)
+
+
+#Function Name: ACCOUNT_INDEX
+#Function Description: This function returns the sorted account ids of a table, as the index of the summary tables
+def ACCOUNT_INDEX(df):
+    return pd.Index(np.sort(df['ACCT_ID'].unique()), name='ACCT_ID')
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Streaming output writers of the result tables (BS_ACCT_SMRY, the batch / out-of-core outputs, the opt-in TRAN_FLG_STG1 snapshot).
+#     * A writer is opened on a file, takes the table batch by batch (per applicant, shard or block of rows) and appends each to the file,
+#       so the whole output never has to be held or converted at once.
+#     * The format is taken from the file name (OUTPUT_FORMAT_OF) or given:
+#         * 'csv': the layout of to_csv, as the scripts wrote it so far; 'csv.gz': the same, gzip-compressed
+#         * 'npz': compressed columnar zip of one .npy per column and batch (categoricals and text as codes plus their categories, as bs_cache stores them),
+#           with a meta.json; READ_OUTPUT reads it back with its dtypes, index and categoricals
+#         * 'parquet': zstd-compressed parquet row groups, one per batch (needs pyarrow, imported when such a writer is opened)
+#       A format is a set of OPEN / WRITE / CLOSE functions in OUTPUT_FORMATS, so others can be plugged in.
+#     * With background = True the batches are written by a thread of the writer, so the writing overlaps with the computation of the next batches:
+#       WRITE_BATCH only queues the batch (blocking when queue_size batches are waiting), and the batch must not be modified afterwards.
+#       An error of the thread is raised by the next WRITE_BATCH or by CLOSE_WRITER.
+#     * CLOSE_WRITER returns the rows, batches, seconds spent writing and bytes of the file.
+
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from bs_ingest import CONCAT_TYPED
+
+#Rows per batch of WRITE_ROWS / WRITE_FRAME, and batches waiting for a background writer
+OUTPUT_BATCH_ROWS = 200000
+OUTPUT_QUEUE_SIZE = 4
+#Fast compression levels, as the outputs are written on every run: level 1 is several times faster than 6 for about 25% more bytes
+OUTPUT_GZIP_LEVEL = 1
+OUTPUT_ZIP_LEVEL = 1
+OUTPUT_NPZ_META = 'meta.json'
+
+
+#Function Name: OUTPUT_FORMAT_OF
+#Function Description: This function returns the output format of a file name from its extension (csv unless .csv.gz, .npz or .parquet)
+def OUTPUT_FORMAT_OF(file):
+    name = str(file).lower()
+    for ext, fmt in [('.csv.gz', 'csv.gz'), ('.npz', 'npz'), ('.parquet', 'parquet')]:
+        if name.endswith(ext):
+            return fmt
+    return 'csv'
+
+
+#Function Name: CSV_OPEN / CSV_WRITE / CSV_CLOSE
+#Function Description: These functions write the batches as one csv (to_csv layout, the header with the first batch), gzip-compressed if compress
+def CSV_OPEN(file, index, compress=False, level=OUTPUT_GZIP_LEVEL):
+    out = gzip.open(file, 'wt', newline='', compresslevel=level) if compress else open(file, 'w', newline='')
+    return {'OUT': out, 'INDEX': index, 'HEADER': True}
+
+
+def CSV_WRITE(state, df):
+    df.to_csv(state['OUT'], header=state['HEADER'], index=state['INDEX'])
+    state['HEADER'] = False
+
+
+def CSV_CLOSE(state):
+    state['OUT'].close()
+
+
+#Function Name: NPZ_ARRAY
+#Function Description: This function returns the array of a column (or index) of the npz format and its meta entry:
+#                      categoricals as their codes with the categories, text as the codes of its categories (restored as text), others as they are
+def NPZ_ARRAY(values, file):
+    entry = {'file': file}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        entry['categories'] = values.categories.tolist()
+        return values.codes, entry
+    array = np.asarray(values)
+    if array.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        values = pd.Categorical(values)
+        entry.update({'categories': values.categories.tolist(), 'text': True})
+        return values.codes, entry
+    return array, entry
+
+
+#Function Name: NPZ_OPEN / NPZ_WRITE / NPZ_CLOSE
+#Function Description: These functions write the batches as a deflate-compressed zip of one .npy per column and batch (b<batch>/c<column>.npy, b<batch>/index.npy),
+#                      meta.json describing the columns, the index and every batch
+def NPZ_OPEN(file, index, level=OUTPUT_ZIP_LEVEL):
+    return {'ZIP': zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level), 'INDEX': index,
+            'META': {'columns': None, 'index': None, 'batches': []}}
+
+
+def NPZ_WRITE(state, df):
+    meta = state['META']
+    if meta['columns'] is None:
+        meta['columns'] = [str(c) for c in df.columns]
+        meta['index'] = df.index.name if state['INDEX'] else None
+    b = len(meta['batches'])
+    arrays = [NPZ_ARRAY(df.iloc[:, i], 'b' + str(b) + '/c' + str(i) + '.npy') for i in range(df.shape[1])]
+    if state['INDEX']:
+        arrays.append(NPZ_ARRAY(df.index, 'b' + str(b) + '/index.npy'))
+    for array, entry in arrays:
+        if array.dtype == object:
+            raise TypeError(entry['file'] + ' has no fixed-width dtype and cannot be written as npz')
+        with state['ZIP'].open(entry['file'], 'w', force_zip64=True) as f:
+            np.save(f, array)
+    batch = {'rows': len(df), 'columns': [entry for _, entry in arrays[:df.shape[1]]]}
+    if state['INDEX']:
+        batch['index'] = arrays[-1][1]
+    meta['batches'].append(batch)
+
+
+def NPZ_CLOSE(state):
+    with state['ZIP'].open(OUTPUT_NPZ_META, 'w') as f:
+        f.write(json.dumps(state['META']).encode('utf-8'))
+    state['ZIP'].close()
+
+
+#Function Name: NPZ_VALUES
+#Function Description: This function reads back a column (or index) array written by NPZ_WRITE
+def NPZ_VALUES(zf, entry):
+    with zf.open(entry['file']) as f:
+        values = np.load(f)
+    if 'categories' not in entry:
+        return values
+    values = pd.Categorical.from_codes(values, categories=entry['categories'])
+    return np.asarray(values, dtype=object) if entry.get('text') else values
+
+
+#Function Name: READ_NPZ
+#Function Description: This function reads a file written in the npz format back as one DataFrame, with its dtypes, index and categoricals
+#                      (the categoricals of the batches unioned, as bs_ingest.CONCAT_TYPED does)
+def READ_NPZ(file):
+    with zipfile.ZipFile(file) as zf:
+        meta = json.loads(zf.read(OUTPUT_NPZ_META))
+        columns = meta['columns'] or []
+        frames, index = [], []
+        for batch in meta['batches']:
+            frames.append(pd.DataFrame({c: NPZ_VALUES(zf, e) for c, e in zip(columns, batch['columns'])}, index=pd.RangeIndex(batch['rows'])))
+            if 'index' in batch:
+                index.append(np.asarray(NPZ_VALUES(zf, batch['index'])))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = CONCAT_TYPED(frames)
+    if index:
+        df.index = pd.Index(np.concatenate(index), name=meta['index'])
+    return df
+
+
+#Function Name: PARQUET_OPEN / PARQUET_WRITE / PARQUET_CLOSE
+#Function Description: These functions write the batches as the row groups of one parquet file (pyarrow), with the schema of the first batch
+def PARQUET_OPEN(file, index, compression='zstd'):
+    import pyarrow
+    import pyarrow.parquet
+    return {'FILE': file, 'INDEX': index, 'COMPRESSION': compression, 'PA': pyarrow, 'PQ': pyarrow.parquet, 'WRITER': None}
+
+
+def PARQUET_WRITE(state, df):
+    if state['WRITER'] is None:
+        table = state['PA'].Table.from_pandas(df, preserve_index=state['INDEX'])
+        state['WRITER'] = state['PQ'].ParquetWriter(state['FILE'], table.schema, compression=state['COMPRESSION'])
+    else:
+        table = state['PA'].Table.from_pandas(df, schema=state['WRITER'].schema, preserve_index=state['INDEX'])
+    state['WRITER'].write_table(table)
+
+
+def PARQUET_CLOSE(state):
+    if state['WRITER'] is not None:
+        state['WRITER'].close()
+
+
+#Output formats by name: the functions opening (file, index, **options), appending a batch to and closing a writer's file
+OUTPUT_FORMATS = {
+    'csv': {'OPEN': CSV_OPEN, 'WRITE': CSV_WRITE, 'CLOSE': CSV_CLOSE},
+    'csv.gz': {'OPEN': lambda file, index, **options: CSV_OPEN(file, index, compress=True, **options), 'WRITE': CSV_WRITE, 'CLOSE': CSV_CLOSE},
+    'npz': {'OPEN': NPZ_OPEN, 'WRITE': NPZ_WRITE, 'CLOSE': NPZ_CLOSE},
+    'parquet': {'OPEN': PARQUET_OPEN, 'WRITE': PARQUET_WRITE, 'CLOSE': PARQUET_CLOSE},
+}
+
+
+#Function Name: OPEN_WRITER
+#Function Description: This function opens a streaming writer on file, in fmt (default: from the file name) with the format's options
+#                      index = write the index of the batches; background = write them on a thread of the writer (see the module header)
+def OPEN_WRITER(file, fmt=None, index=True, background=False, queue_size=OUTPUT_QUEUE_SIZE, **options):
+    fmt = fmt or OUTPUT_FORMAT_OF(file)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError('unknown output format ' + repr(fmt) + ', expected one of ' + repr(list(OUTPUT_FORMATS)))
+    writer = {'FILE': file, 'FORMAT': OUTPUT_FORMATS[fmt], 'ROWS': 0, 'BATCHES': 0, 'SECONDS': 0.0, 'ERROR': None, 'QUEUE': None, 'THREAD': None}
+    writer['STATE'] = writer['FORMAT']['OPEN'](file, index, **options)
+    if background:
+        writer['QUEUE'] = queue.Queue(maxsize=queue_size)
+        writer['THREAD'] = threading.Thread(target=WRITER_LOOP, args=(writer,), daemon=True)
+        writer['THREAD'].start()
+    return writer
+
+
+#Function Name: WRITER_APPEND
+#Function Description: This function appends a batch to the writer's file, counting its rows and the time taken
+def WRITER_APPEND(writer, df):
+    start = time.perf_counter()
+    writer['FORMAT']['WRITE'](writer['STATE'], df)
+    writer['SECONDS'] += time.perf_counter() - start
+    writer['ROWS'] += len(df)
+    writer['BATCHES'] += 1
+
+
+#Function Name: WRITER_LOOP
+#Function Description: This function is the background thread of a writer: it appends the queued batches until it gets None
+#                      After an error the remaining batches are dropped (so the producer never blocks) and the error is kept for the producer
+def WRITER_LOOP(writer):
+    while True:
+        df = writer['QUEUE'].get()
+        if df is None:
+            return
+        if writer['ERROR'] is None:
+            try:
+                WRITER_APPEND(writer, df)
+            except BaseException as e:
+                writer['ERROR'] = e
+
+
+#Function Name: WRITE_BATCH
+#Function Description: This function appends a batch (a DataFrame with the columns of the first one) to an open writer
+def WRITE_BATCH(writer, df):
+    if writer['QUEUE'] is None:
+        WRITER_APPEND(writer, df)
+        return
+    if writer['ERROR'] is not None:
+        raise writer['ERROR']
+    writer['QUEUE'].put(df)
+
+
+#Function Name: CLOSE_WRITER
+#Function Description: This function waits for the queued batches, closes the writer's file and returns its ROWS, BATCHES, SECONDS (spent writing) and BYTES
+#                      The error of a background writer, if any, is raised once the file is closed
+def CLOSE_WRITER(writer):
+    if writer['THREAD'] is not None:
+        writer['QUEUE'].put(None)
+        writer['THREAD'].join()
+    start = time.perf_counter()
+    writer['FORMAT']['CLOSE'](writer['STATE'])
+    writer['SECONDS'] += time.perf_counter() - start
+    if writer['ERROR'] is not None:
+        raise writer['ERROR']
+    return {'ROWS': writer['ROWS'], 'BATCHES': writer['BATCHES'], 'SECONDS': writer['SECONDS'], 'BYTES': os.path.getsize(writer['FILE'])}
+
+
+#Function Name: WRITE_ROWS
+#Function Description: This function appends a whole DataFrame to an open writer, batch_rows rows at a time (an empty one as one empty batch, for its header)
+def WRITE_ROWS(writer, df, batch_rows=OUTPUT_BATCH_ROWS):
+    for start in range(0, max(len(df), 1), batch_rows):
+        WRITE_BATCH(writer, df.iloc[start:start + batch_rows])
+
+
+#Function Name: WRITE_FRAME
+#Function Description: This function writes a whole DataFrame to file through a writer (see OPEN_WRITER), batch_rows rows at a time; returns CLOSE_WRITER's counts
+def WRITE_FRAME(df, file, fmt=None, index=True, batch_rows=OUTPUT_BATCH_ROWS, background=False, **options):
+    writer = OPEN_WRITER(file, fmt, index, background, **options)
+    try:
+        WRITE_ROWS(writer, df, batch_rows)
+    finally:
+        stats = CLOSE_WRITER(writer)
+    return stats
+
+
+#Function Name: READ_OUTPUT
+#Function Description: This function reads an output file back (fmt default: from the file name); csv files are read as pandas reads them, without index
+def READ_OUTPUT(file, fmt=None):
+    fmt = fmt or OUTPUT_FORMAT_OF(file)
+    if fmt == 'npz':
+        return READ_NPZ(file)
+    if fmt == 'parquet':
+        return pd.read_parquet(file)
+    return pd.read_csv(file)
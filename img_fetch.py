@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# * Concurrent image fetcher of the Day009 scraper (Day009_HW.ipynb): the imgur images of a PTT post, saved with their real extension.
+#     * The images are fetched by a bounded pool of worker threads, over keep-alive connections pooled per host (at most `workers` per host),
+#       following redirects; a failed attempt (connection error, timeout, 429 or 5xx) is retried with exponential backoff and jitter.
+#     * A body is streamed to disk chunk by chunk (a .part file, renamed into place once complete) and hashed (sha256) on the way,
+#       so an image is never held in memory. The extension comes from the first bytes of the body (jpeg, png, gif, webp, bmp),
+#       named as PIL's Image.format did it in the notebook; a body that is none of them (e.g. an html error page) fails the image.
+#     * output_dir holds a manifest (FETCH_MANIFEST) of the sha256 of every file saved and of the file every url was saved to:
+#         * a url whose file is on disk with the hash of the manifest is skipped without any request
+#         * an image whose content is already saved under another name is not saved twice (DUPLICATE, pointing to the saved file)
+#     * bench starts a local stand-in image server (START_STANDIN_SERVER, with a simulated connection setup and response latency, and some 503s)
+#       and compares the notebook's loop (one blocking request on a new connection per image, no manifest) with the pooled fetcher and its rerun.
+#
+# Usage: python img_fetch.py fetch <output_dir> <url> [<url> ...] [--workers N] [--retries N]
+#        python img_fetch.py bench [--images N] [--kb N] [--latency MS] [--connect MS] [--fail-every N] [--workers N]
+
+import argparse
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+import numpy as np
+import pandas as pd
+
+FETCH_WORKERS = 8
+FETCH_RETRIES = 3
+#Backoff before retry k (from 0): FETCH_BACKOFF_S * 2 ** k, plus up to as much jitter
+FETCH_BACKOFF_S = 0.5
+FETCH_TIMEOUT_S = 30
+FETCH_CHUNK_BYTES = 64 * 1024
+FETCH_MAX_REDIRECTS = 5
+FETCH_MANIFEST = 'manifest.json'
+FETCH_USER_AGENT = 'Mozilla/5.0 (img_fetch)'
+#HTTP statuses worth retrying
+FETCH_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+#Leading bytes of the image formats, with the extension PIL's Image.format gives them
+IMAGE_MAGIC = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+]
+
+
+#Function Name: IMGUR_IMAGES
+#Function Description: This function returns the (image id, image url) of the imgur links among hrefs, as the notebook builds them, without repeats
+def IMGUR_IMAGES(hrefs):
+    images = {}
+    for href in hrefs:
+        if 'imgur' not in href:
+            continue
+        img_id = href.rstrip('/').split('/')[-1].split('.')[0]
+        images.setdefault(img_id, 'https://i.imgur.com/{}.jpg'.format(img_id))
+    return list(images.items())
+
+
+#Function Name: IMAGE_EXT
+#Function Description: This function returns the extension of an image from its first bytes (None if it is none of IMAGE_MAGIC or webp)
+def IMAGE_EXT(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for magic, ext in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+#Function Name: FILE_SHA256
+#Function Description: This function returns the sha256 of a file's content, read in chunks
+def FILE_SHA256(file, chunk_bytes=FETCH_CHUNK_BYTES):
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+#Function Name: READ_MANIFEST / WRITE_MANIFEST
+#Function Description: These functions read the manifest of output_dir ({'FILES': {file name: sha256}, 'URLS': {url: file name}}, empty if there is none)
+#                      and write it back atomically (to a temporary file renamed into place)
+def READ_MANIFEST(output_dir):
+    file = os.path.join(output_dir, FETCH_MANIFEST)
+    if not os.path.exists(file):
+        return {'FILES': {}, 'URLS': {}}
+    with open(file) as f:
+        return json.load(f)
+
+
+def WRITE_MANIFEST(output_dir, manifest):
+    tmp = os.path.join(output_dir, '.' + FETCH_MANIFEST + '.' + uuid.uuid4().hex)
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(output_dir, FETCH_MANIFEST))
+
+
+#Function Name: NEW_POOL
+#Function Description: This function returns a pool of keep-alive connections, at most max_per_host idle ones kept per (scheme, host, port)
+#                      With keep_alive = False every request gets a new connection, closed after it (as requests.get does)
+def NEW_POOL(max_per_host=FETCH_WORKERS, timeout=FETCH_TIMEOUT_S, keep_alive=True):
+    return {'LOCK': threading.Lock(), 'IDLE': {}, 'MAX': max_per_host, 'TIMEOUT': timeout, 'KEEP_ALIVE': keep_alive}
+
+
+#Function Name: POOL_GET / POOL_PUT / CLOSE_POOL
+#Function Description: These functions take a connection to a host from the pool (an idle one, or a new one), give it back once its response is fully read
+#                      (closed if it cannot be reused or the host has max_per_host idle ones), and close all the idle connections
+def POOL_GET(pool, key):
+    with pool['LOCK']:
+        idle = pool['IDLE'].get(key)
+        if idle:
+            return idle.pop()
+    scheme, host, port = key
+    connection = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return connection(host, port, timeout=pool['TIMEOUT'])
+
+
+def POOL_PUT(pool, key, conn, reusable):
+    if reusable and pool['KEEP_ALIVE']:
+        with pool['LOCK']:
+            idle = pool['IDLE'].setdefault(key, [])
+            if len(idle) < pool['MAX']:
+                idle.append(conn)
+                return
+    conn.close()
+
+
+def CLOSE_POOL(pool):
+    with pool['LOCK']:
+        for idle in pool['IDLE'].values():
+            for conn in idle:
+                conn.close()
+        pool['IDLE'] = {}
+
+
+#Function Name: STREAM_TO_FILE
+#Function Description: This function gets url through the pool (following redirects) and streams its body into file, chunk by chunk
+#                      Returns the sha256, bytes and extension (IMAGE_EXT) of the body
+#                      Raises OSError / http.client.HTTPException for what is worth retrying (FETCH_RETRY_STATUS included), ValueError for the rest
+def STREAM_TO_FILE(pool, url, file, chunk_bytes=FETCH_CHUNK_BYTES):
+    for _ in range(FETCH_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        conn = POOL_GET(pool, key)
+        try:
+            conn.request('GET', path, headers={'User-Agent': FETCH_USER_AGENT, 'Connection': 'keep-alive' if pool['KEEP_ALIVE'] else 'close'})
+            response = conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+        reusable = False
+        try:
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                response.read()
+                reusable = not response.will_close
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                response.read()
+                reusable = not response.will_close
+                error = OSError if response.status in FETCH_RETRY_STATUS else ValueError
+                raise error('HTTP ' + str(response.status) + ' for ' + url)
+
+            h = hashlib.sha256()
+            size = 0
+            head = b''
+            with open(file, 'wb') as out:
+                for chunk in iter(lambda: response.read(chunk_bytes), b''):
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            reusable = not response.will_close
+        finally:
+            POOL_PUT(pool, key, conn, reusable)
+        ext = IMAGE_EXT(head)
+        if ext is None:
+            raise ValueError(url + ' is not an image (' + str(response.getheader('Content-Type')) + ')')
+        return h.hexdigest(), size, ext
+    raise ValueError('more than ' + str(FETCH_MAX_REDIRECTS) + ' redirects for ' + url)
+
+
+#Function Name: FETCH_IMAGE
+#Function Description: This function saves the image at url as <name>.<extension> in output_dir, unless the manifest shows it is already there
+#                      manifest = READ_MANIFEST's, shared by the workers under lock; failed attempts are retried (retries times at most) with backoff
+#                      Returns NAME, URL, STATUS (FETCHED, SKIPPED, DUPLICATE or FAILED), FILE, BYTES, SHA256, ATTEMPTS, SECONDS and ERROR
+def FETCH_IMAGE(pool, name, url, output_dir, manifest, lock, retries=FETCH_RETRIES, backoff_s=FETCH_BACKOFF_S, chunk_bytes=FETCH_CHUNK_BYTES):
+    start = time.perf_counter()
+    result = {'NAME': name, 'URL': url, 'STATUS': 'FAILED', 'FILE': None, 'BYTES': None, 'SHA256': None, 'ATTEMPTS': 0, 'SECONDS': 0.0, 'ERROR': None}
+    with lock:
+        file = manifest['URLS'].get(url)
+        sha = manifest['FILES'].get(file)
+    if sha is not None and os.path.exists(os.path.join(output_dir, file)) and FILE_SHA256(os.path.join(output_dir, file)) == sha:
+        result.update({'STATUS': 'SKIPPED', 'FILE': file, 'BYTES': os.path.getsize(os.path.join(output_dir, file)), 'SHA256': sha,
+                       'SECONDS': time.perf_counter() - start})
+        return result
+
+    part = os.path.join(output_dir, '.' + name + '.' + uuid.uuid4().hex + '.part')
+    try:
+        for attempt in range(retries + 1):
+            result['ATTEMPTS'] = attempt + 1
+            try:
+                sha, size, ext = STREAM_TO_FILE(pool, url, part, chunk_bytes)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                result['ERROR'] = repr(e)
+                if attempt == retries:
+                    raise
+                time.sleep(backoff_s * 2 ** attempt * (1 + random.random()))
+        with lock:
+            saved = next((f for f, s in manifest['FILES'].items() if s == sha and os.path.exists(os.path.join(output_dir, f))), None)
+            if saved is None:
+                saved = name + '.' + ext
+                os.replace(part, os.path.join(output_dir, saved))
+                manifest['FILES'][saved] = sha
+                result['STATUS'] = 'FETCHED'
+            else:
+                result['STATUS'] = 'DUPLICATE'
+            manifest['URLS'][url] = saved
+        result.update({'FILE': saved, 'BYTES': size, 'SHA256': sha, 'ERROR': None})
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        result['ERROR'] = repr(e)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    result['SECONDS'] = time.perf_counter() - start
+    return result
+
+
+#Function Name: FETCH_IMAGES
+#Function Description: This function saves the images of images (a list of (name, url), e.g. IMGUR_IMAGES') into output_dir with FETCH_IMAGE,
+#                      on at most workers threads sharing a connection pool, and updates the manifest of output_dir (also when interrupted)
+#                      keep_alive = False gives every request a new connection; returns one row per image (see FETCH_IMAGE), FILE / SHA256 / ERROR being NaN where missing
+def FETCH_IMAGES(images, output_dir, workers=FETCH_WORKERS, retries=FETCH_RETRIES, backoff_s=FETCH_BACKOFF_S, timeout=FETCH_TIMEOUT_S, keep_alive=True,
+                 chunk_bytes=FETCH_CHUNK_BYTES):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = READ_MANIFEST(output_dir)
+    lock = threading.Lock()
+    pool = NEW_POOL(workers, timeout, keep_alive)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda image: FETCH_IMAGE(pool, image[0], image[1], output_dir, manifest, lock, retries, backoff_s, chunk_bytes),
+                                        images))
+    finally:
+        CLOSE_POOL(pool)
+        with lock:
+            WRITE_MANIFEST(output_dir, manifest)
+    return pd.DataFrame(results, columns=['NAME', 'URL', 'STATUS', 'FILE', 'BYTES', 'SHA256', 'ATTEMPTS', 'SECONDS', 'ERROR'])
+
+
+#Handler of the stand-in image server: GET /<name> answers the image of that name after the server's latency,
+#every fail_every-th request (counted over all the requests) with 503 instead; every new connection first waits connect_latency_s
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.LOCK:
+            self.server.CONNECTIONS += 1
+        time.sleep(self.server.CONNECT_LATENCY_S)
+
+    def do_GET(self):
+        with self.server.LOCK:
+            self.server.REQUESTS += 1
+            fail = self.server.FAIL_EVERY and self.server.REQUESTS % self.server.FAIL_EVERY == 0
+        time.sleep(self.server.LATENCY_S)
+        body = self.server.IMAGES.get(self.path.lstrip('/'))
+        status = 503 if fail else 200 if body is not None else 404
+        body = body if status == 200 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/jpeg' if status == 200 else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+#Function Name: START_STANDIN_SERVER
+#Function Description: This function starts a local stand-in image server on a free port of 127.0.0.1 (in a background thread), serving images ({name: bytes})
+#                      connect_latency_s / latency_s = the time taken by a new connection / by every response (e.g. the TLS handshake / round trip to imgur)
+#                      Returns the server: server.server_address is its address, server.CONNECTIONS / REQUESTS its counts, server.shutdown() stops it
+def START_STANDIN_SERVER(images, latency_s=0.0, connect_latency_s=0.0, fail_every=0):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandinHandler)
+    server.daemon_threads = True
+    server.IMAGES = images
+    server.LATENCY_S = latency_s
+    server.CONNECT_LATENCY_S = connect_latency_s
+    server.FAIL_EVERY = fail_every
+    server.LOCK = threading.Lock()
+    server.CONNECTIONS = 0
+    server.REQUESTS = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#Function Name: SYNTH_IMAGES
+#Function Description: This function returns n synthetic images {name: bytes} of about size_bytes each: jpeg and png bodies (their magic bytes and random content),
+#                      every tenth one a copy of the one before it under another name, as reposted images are
+def SYNTH_IMAGES(n, size_bytes=200 * 1024, seed=0):
+    rng = np.random.default_rng(seed)
+    images = {}
+    for i in range(n):
+        if i % 10 == 9:
+            images['img' + str(i)] = images['img' + str(i - 1)]
+            continue
+        magic = IMAGE_MAGIC[i % 2][0]
+        images['img' + str(i)] = magic + rng.integers(0, 256, size_bytes, dtype=np.uint8).tobytes()
+    return images
+
+
+#Function Name: BENCH_FETCH
+#Function Description: This function compares, against a stand-in server of n_images images, the notebook's loop (one blocking request per image on a new connection,
+#                      everything downloaded again on every run) with FETCH_IMAGES on workers threads, then FETCH_IMAGES rerun on the same output_dir
+#                      Returns one row per run: SECONDS, IMAGES_PER_S, MB_PER_S (of the images fetched), CONNECTIONS and REQUESTS of the server, and the counts by STATUS
+def BENCH_FETCH(work_dir, n_images=50, size_bytes=200 * 1024, latency_s=0.05, connect_latency_s=0.1, fail_every=0, workers=FETCH_WORKERS):
+    images = SYNTH_IMAGES(n_images, size_bytes)
+    server = START_STANDIN_SERVER(images, latency_s, connect_latency_s, fail_every)
+    base = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    items = [(name, base + name) for name in images]
+    runs = [('sequential (notebook loop)', os.path.join(work_dir, 'sequential'), 1, False),
+            ('pooled, ' + str(workers) + ' workers', os.path.join(work_dir, 'pooled'), workers, True),
+            ('pooled, rerun', os.path.join(work_dir, 'pooled'), workers, True)]
+    rows = []
+    try:
+        for name, output_dir, n_workers, keep_alive in runs:
+            connections, requests = server.CONNECTIONS, server.REQUESTS
+            start = time.perf_counter()
+            df = FETCH_IMAGES(items, output_dir, n_workers, keep_alive=keep_alive, backoff_s=0.05)
+            seconds = time.perf_counter() - start
+            if not keep_alive:
+                #The notebook keeps no manifest: every run downloads everything again
+                os.remove(os.path.join(output_dir, FETCH_MANIFEST))
+            fetched = df['STATUS'].isin(['FETCHED', 'DUPLICATE'])
+            row = {'RUN': name, 'SECONDS': seconds, 'IMAGES_PER_S': len(df) / seconds, 'MB_PER_S': df.loc[fetched, 'BYTES'].sum() / 2 ** 20 / seconds,
+                   'CONNECTIONS': server.CONNECTIONS - connections, 'REQUESTS': server.REQUESTS - requests}
+            row.update(df['STATUS'].value_counts().to_dict())
+            rows.append(row)
+    finally:
+        server.shutdown()
+    return pd.DataFrame(rows).set_index('RUN').fillna(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent, pooled, deduplicating image fetcher of the Day009 scraper.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    fetch = sub.add_parser('fetch', help='save images into a folder')
+    fetch.add_argument('output_dir', help='folder of the images and of their manifest')
+    fetch.add_argument('urls', nargs='+', help='image urls (imgur page links are turned into their image urls)')
+    fetch.add_argument('--workers', type=int, default=FETCH_WORKERS, help='images fetched at the same time')
+    fetch.add_argument('--retries', type=int, default=FETCH_RETRIES, help='retries of a failed image')
+    bench = sub.add_parser('bench', help='the notebook loop against the pooled fetcher, on a local stand-in server')
+    bench.add_argument('--images', type=int, default=50, help='number of images')
+    bench.add_argument('--kb', type=int, default=200, help='size of an image in KB')
+    bench.add_argument('--latency', type=float, default=50, help='response latency of the stand-in server in ms')
+    bench.add_argument('--connect', type=float, default=100, help='setup time of a new connection in ms (TCP + TLS handshake)')
+    bench.add_argument('--fail-every', type=int, default=0, help='answer every n-th request with 503 (0 = never)')
+    bench.add_argument('--workers', type=int, default=FETCH_WORKERS, help='workers of the pooled fetcher')
+    bench.add_argument('--work-dir', default=None, help='folder the images are saved to (default: a temporary folder)')
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        images = [(u.rstrip('/').split('/')[-1].rsplit('.', 1)[0], u) for u in args.urls if 'i.imgur.com' in u or 'imgur' not in u]
+        images += IMGUR_IMAGES([u for u in args.urls if 'imgur' in u and 'i.imgur.com' not in u])
+        df = FETCH_IMAGES(images, args.output_dir, args.workers, args.retries)
+        for r in df.itertuples():
+            print(r.STATUS + ' ' + (r.URL if pd.isna(r.FILE) else r.FILE) + ('' if pd.isna(r.ERROR) else ': ' + r.ERROR))
+        sys.exit(0 if (df['STATUS'] != 'FAILED').all() else 1)
+
+    if args.command == 'bench':
+        import tempfile
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix='img_fetch_')
+        df_BENCH = BENCH_FETCH(work_dir, args.images, args.kb * 1024, args.latency / 1000, args.connect / 1000, args.fail_every, args.workers)
+        with pd.option_context('display.width', 200, 'display.max_columns', 20):
+            print(df_BENCH)